@@ -8,11 +8,19 @@ import pathlib
 from copy import deepcopy
 from importlib import import_module
 from PyBake.logger import log, LogBlock
+from PyBake.snapshot import MenuSnapshot
 import os
 import re
 import json
 import zipfile
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
 from appdirs import AppDirs
+try:
+  import fcntl
+  msvcrt = None
+except ImportError:
+  import msvcrt
 import semantic_version
 
 
@@ -58,12 +66,28 @@ defaultPastriesDir.safe_mkdir(parents=True)
 
 
 
+# Maximum number of parsed objects kept by each of the caches behind `Version` and `VersionSpec`.
+parseCacheSize = 4096
+
+
+@lru_cache(maxsize=parseCacheSize)
+def _parseVersion(version):
+  return semantic_version.Version(version)
+
+
+@lru_cache(maxsize=parseCacheSize)
+def _parseVersionSpec(spec):
+  return semantic_version.Spec(spec)
+
+
 def Version(version):
   """
   Tries to create a `semantic_version.Version` object from param `version`.
   :param version: If it is a string, it must still be compliant with the semantic versioning scheme (http://semver.org/)
+
+  Parsed strings are cached, so identical strings share the same object. Do not modify the result.
   """
-  return version if isinstance(version, semantic_version.Version) else semantic_version.Version(version)
+  return version if isinstance(version, semantic_version.Version) else _parseVersion(str(version))
 
 
 def VersionSpec(spec):
@@ -73,12 +97,33 @@ def VersionSpec(spec):
   :example:
   VersionSpec(">0.1.0")
   VersionSpec(">0.1.0,<0.3.0,!=0.2.1-rc1")
+
+  Parsed strings are cached, so identical strings share the same object. Do not modify the result.
   """
   if isinstance(spec, semantic_version.Version):
-    return semantic_version.Spec("=={}".format(spec))
+    return _parseVersionSpec("=={}".format(spec))
   if isinstance(spec, semantic_version.Spec):
     return spec
-  return semantic_version.Spec(spec)
+  return _parseVersionSpec(str(spec))
+
+
+def parseCacheInfo():
+  """
+  Statistics of the caches behind `Version` and `VersionSpec`.
+  :return: A dict with the keys "Version" and "VersionSpec", each a dict with "hits", "misses", "size" and "maxSize".
+  """
+  def toDict(info):
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxSize": info.maxsize}
+  return {
+    "Version": toDict(_parseVersion.cache_info()),
+    "VersionSpec": toDict(_parseVersionSpec.cache_info()),
+  }
+
+
+def clearParseCache():
+  """Clear the caches behind `Version` and `VersionSpec`, including their statistics."""
+  _parseVersion.cache_clear()
+  _parseVersionSpec.cache_clear()
 
 
 def try_getattr(obj, choices, default_value=None, raise_error=False):
@@ -125,6 +170,9 @@ zipCompressionLookup = {
   "lzma": zipfile.ZIP_LZMA,
 }
 
+# Compression setting that lets the oven choose a compression per ingredient, see `oven.chooseCompression`.
+adaptiveCompression = "adaptive"
+
 
 byteSuffixLookup = [
   "B",
@@ -136,6 +184,17 @@ byteSuffixLookup = [
 ]
 
 
+def formatSize(numBytes):
+  """Format `numBytes` for humans with a suffix from `byteSuffixLookup`, e.g. "1.5 MiB"."""
+  byteSuffixIndex = 0
+  while numBytes >= 1024 and byteSuffixIndex < len(byteSuffixLookup) - 1:
+    numBytes /= 1024
+    byteSuffixIndex += 1
+  if byteSuffixIndex == 0:
+    return "{} {}".format(numBytes, byteSuffixLookup[0])
+  return "{:.1f} {}".format(numBytes, byteSuffixLookup[byteSuffixIndex])
+
+
 recipes = []
 
 
@@ -323,17 +382,65 @@ class ChangeDir:
     os.chdir(self.previous.as_posix())
 
 
+class FileLock:
+  """
+  Exclusive lock shared between processes, based on a lock file.
+  Blocks until the lock is acquired.
+  Usage:
+    with FileLock('some/file.lock'):
+      pass
+  """
+
+  def __init__(self, filePath):
+    self.filePath = Path(filePath)
+    self.lockFile = None
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, theType, value, traceback):
+    self.release()
+
+  def acquire(self):
+    """Acquire the lock. Should not be called manually, use `with` instead."""
+    self.filePath.parent.safe_mkdir(parents=True)
+    self.lockFile = self.filePath.open("a+")
+    if msvcrt:
+      self.lockFile.seek(0)
+      while True:
+        try:
+          msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_LOCK, 1)
+          break
+        except OSError:
+          # LK_LOCK gives up after 10 seconds.
+          continue
+    else:
+      fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX)
+
+  def release(self):
+    """Release the lock. Should not be called manually, use `with` instead."""
+    if msvcrt:
+      self.lockFile.seek(0)
+      msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+      fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_UN)
+    self.lockFile.close()
+    self.lockFile = None
+
+
 class Pastry:
   """
   Describes a pastry (a package).
   """
 
-  def __init__(self, data=None, *, name=None, version=None):
+  def __init__(self, data=None, *, name=None, version=None, digest=None):
     """
     Instantiate a pastry description from either a data dict, or a name and version.
-    :param data: A dict that contains a "name" and "version" key.
+    :param data: A dict that contains a "name" and "version" key, and optionally a "digest" key.
     :param name: The name of the pastry (str).
     :param version: The version of the pastry. Must be compliant with the semantic version scheme (http://semver.org/).
+    :param digest: Hex encoded SHA-256 digest of the pastry file, if known.
     :return: A pastry desc instance.1
 
     :example:
@@ -344,8 +451,10 @@ class Pastry:
     if data:
       name = data["name"]
       version = data["version"]
+      digest = data.get("digest", digest)
     self.name = str(name)
     self.version = Version(version)
+    self.digest = digest
 
   @property
   def path(self):
@@ -367,6 +476,8 @@ class Pastry:
     """
     yield ("name", self.name)
     yield ("version", str(self.version))
+    if self.digest:
+      yield ("digest", self.digest)
 
   def __str__(self):
     return "{} {}".format(self.name, self.version)
@@ -426,13 +537,18 @@ class Menu:
   """
   defaultPastriesDirPath = Path(".pastries")
   defaultFileName = "menu.json"
+  journalFileSuffix = ".journal"
+  snapshotFileSuffix = ".snapshot"
+  lockFileSuffix = ".lock"
+  # Number of journal records after which `save` compacts the journal into the menu file.
+  journalCompactionThreshold = 1000
 
   @classmethod
   def getDfeaultMenuFilePath(cls):
     return  cls.defaultPastriesDirPath / cls.defaultFileName
 
   def __init__(self, menuFilePath=None):
-    self.registry = []
+    self._initEntries()
     self.filePath = Path(menuFilePath or Menu.defaultPastriesDirPath / Menu.defaultFileName)
     if self.filePath.is_dir():
       self.filePath /= Menu.defaultFileName
@@ -442,11 +558,63 @@ class Menu:
     if not self.filePath.exists():
       log.info("Creating menu file because it does not exist yet: {}".format(self.filePath.as_posix()))
       self.filePath.parent.safe_mkdir(parents=True)
-      with self.filePath.open("w") as newFile:
-        json.dump([], newFile)
+      try:
+        # Another process might be creating the file at the same time.
+        with self.filePath.open("x") as newFile:
+          json.dump([], newFile)
+      except FileExistsError:
+        pass
     # Make sure we have an absolute file path.
     self.filePath = self.filePath.resolve()
 
+  def _initEntries(self):
+    """Set up the in-memory state of an empty menu, without touching any files."""
+    # Maps a pastry name to a list of pastries sorted by version.
+    self._index = {}
+    # Maps a pastry name to the sorted versions of the pastries in `_index`, used for bisecting.
+    self._versions = {}
+    self._size = 0
+    # Changes that have not been written to the journal yet, as (operation, pastry) tuples.
+    self._pending = []
+    # Number of records in the journal file.
+    self._journalLength = 0
+    # Whether `clear` was called since the last save, so the next `save` has to replace the entire menu file.
+    self._cleared = False
+    # Binary snapshot of the menu file. Names are only loaded into `_index` when they are accessed.
+    self._snapshot = None
+    self._materialized = set()
+    # Number of entries in `_snapshot` that are not in `_index` yet.
+    self._snapshotRemaining = 0
+    # The `_diskState` this menu is in sync with, see `refresh`.
+    self._syncedState = None
+    # Changes whenever pastries are added or removed, see `generation`.
+    self._generation = 0
+
+  @property
+  def generation(self):
+    """A number that changes whenever pastries are added to or removed from this menu, e.g. to invalidate caches."""
+    return self._generation
+
+  @property
+  def registry(self):
+    """All pastries on this menu as a list, sorted by name and version."""
+    return list(self)
+
+  @property
+  def journalFilePath(self):
+    """The journal file that records changes made since the menu file was last written."""
+    return self.filePath.with_suffix(Menu.journalFileSuffix)
+
+  @property
+  def lockFilePath(self):
+    """The file used to synchronize access to the menu files between processes, see `FileLock`."""
+    return self.filePath.with_suffix(Menu.lockFileSuffix)
+
+  @property
+  def snapshotFilePath(self):
+    """The binary snapshot of the menu file, see `PyBake.snapshot.MenuSnapshot`."""
+    return self.filePath.with_suffix(Menu.snapshotFileSuffix)
+
   @property
   def pastryDirPath(self):
     return self.filePath.parent
@@ -461,20 +629,61 @@ class Menu:
 
     If `menuFilePath` is omitted or `None`, The default is used: `self.pastriesDirPath / Menu.defaultPastriesRoot`
 
-    Will not attempt any file write operations.
+    The menu file is read first, then all changes recorded in the journal are replayed on top of it.
+    If the binary snapshot of the menu file is up to date, it is used instead of parsing the menu file,
+    and pastries are only loaded when they are accessed.
+
+    Will not attempt any file write operations, except for regenerating an outdated snapshot.
 
     Returns the number of new entries.
     """
+    with FileLock(self.lockFilePath):
+      return self._load()
+
+  def _load(self):
+    """Implementation of `load`. The caller has to hold the lock."""
     filePath = self.filePath
     if not filePath.exists():
       return -1
-    with filePath.open("r") as registryFile:
-      loadedRegistry = json.load(registryFile)
     numNewEntries = 0
-    # Using self.add will prevent adding duplicates.
-    for entry in loadedRegistry:
-      self.add(Pastry(entry))
-      numNewEntries += 1
+    self._generation += 1
+    # Read once, so the snapshot is checked against exactly the contents that would be parsed.
+    registryData = filePath.read_bytes()
+    # The snapshot represents only the contents of the menu file, so it can only be used by or written from an
+    # empty menu. Otherwise, entries that are already in the menu would be counted twice.
+    wasEmpty = len(self) == 0
+    snapshot = MenuSnapshot.open(self.snapshotFilePath)
+    if snapshot and wasEmpty and snapshot.isUpToDate(registryData):
+      self._attachSnapshot(snapshot)
+      numNewEntries += len(snapshot)
+    else:
+      if snapshot:
+        snapshot.close()
+      # Using self._insert will prevent adding duplicates.
+      for entry in json.loads(registryData.decode("UTF-8")):
+        self._insert(Pastry(entry))
+        numNewEntries += 1
+      if wasEmpty:
+        self._writeSnapshot(registryData)
+    self._journalLength = 0
+    journalFilePath = self.journalFilePath
+    if journalFilePath.exists():
+      with journalFilePath.open("r") as journalFile:
+        for line in journalFile:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            # Most likely the remains of an interrupted write, which is always the last line.
+            log.warning("Ignoring malformed menu journal record: {}".format(line.strip()))
+            continue
+          self._journalLength += 1
+          pastry = Pastry(record["pastry"])
+          if record["op"] == "add":
+            self._insert(pastry)
+            numNewEntries += 1
+          elif record["op"] == "remove":
+            self._delete(pastry)
+    self._syncedState = self._diskState()
     return numNewEntries
 
   def save(self):
@@ -482,7 +691,40 @@ class Menu:
     Save the menu to disk.
 
     If `menuFilePath` is omitted or `None`, The default is used: `Menu.defaultPastriesRoot`
+
+    Changes since the last `load` or `save` are appended to the journal file.
+    Once the journal has grown beyond `Menu.journalCompactionThreshold` records, the menu is compacted.
+
+    Other processes may save the same menu concurrently, their changes are not lost.
     """
+    with FileLock(self.lockFilePath):
+      if self._cleared or self._journalLength + len(self._pending) > Menu.journalCompactionThreshold:
+        self._compact()
+        return
+      if not self._pending:
+        return
+      # Changes of other processes are not in this menu yet, even after appending to the journal.
+      inSync = self._diskState() == self._syncedState
+      records = "".join(json.dumps({"op": op, "pastry": pastry}, cls=PastryJSONEncoder, sort_keys=True) + "\n"
+                        for op, pastry in self._pending)
+      with self.journalFilePath.open("a") as journalFile:
+        journalFile.write(records)
+      self._journalLength += len(self._pending)
+      self._pending.clear()
+      self._syncedState = self._diskState() if inSync else None
+
+  def compact(self):
+    """
+    Write the entire menu to the menu file and discard the journal.
+
+    Changes other processes saved in the meantime are merged into this menu first,
+    unless `clear` was called since the last save.
+    """
+    with FileLock(self.lockFilePath):
+      self._compact()
+
+  def _compact(self):
+    """Implementation of `compact`. The caller has to hold the lock."""
     filePath = self.filePath
     if not filePath.exists():
       log.warning("Creating menu file path that did not exist yet: {}".format(filePath.as_posix()))
@@ -490,8 +732,118 @@ class Menu:
     elif filePath.is_dir():
       filePath /= Menu.defaultFileName
       log.warning("Current menu file path is a directory. Using file path: {}".format(filePath.as_posix()))
-    with filePath.open("w") as registryFile:
-      json.dump(self.registry, registryFile, cls=PastryJSONEncoder, indent=2, sort_keys=True)
+    if not self._cleared:
+      self._mergeFromDisk()
+    registry = self.registry
+    # Write to a temporary file first, so readers never see a partially written menu.
+    tempFilePath = filePath.with_name("{}.{}.tmp".format(filePath.name, os.getpid()))
+    registryData = json.dumps(registry, cls=PastryJSONEncoder, indent=2, sort_keys=True).encode("UTF-8")
+    tempFilePath.write_bytes(registryData)
+    os.replace(tempFilePath.as_posix(), filePath.as_posix())
+    # Everything is in `_index` now, so the old snapshot is no longer needed.
+    self._detachSnapshot()
+    self._writeSnapshot(registryData)
+    # The menu file contains everything now, so the journal is obsolete.
+    journalFilePath = filePath.with_suffix(Menu.journalFileSuffix)
+    if journalFilePath.exists():
+      journalFilePath.unlink()
+    self._journalLength = 0
+    self._pending.clear()
+    self._cleared = False
+    self._syncedState = self._diskState()
+
+  def _diskState(self):
+    """Identifies the current contents of the menu files. Changes whenever any process saves the menu."""
+    state = []
+    for path in (self.filePath, self.journalFilePath):
+      try:
+        stat = os.stat(path.as_posix())
+        state.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+      except OSError:
+        state.append(None)
+    return tuple(state)
+
+  def refresh(self):
+    """
+    Load changes other processes saved since this menu was last loaded or saved.
+
+    Cheap if nothing changed, so it can be called before every access to a menu that is shared between processes.
+    Changes that are not saved yet are kept.
+    :return: Whether anything was loaded.
+    """
+    if self._diskState() == self._syncedState:
+      return False
+    with FileLock(self.lockFilePath):
+      if self._cleared:
+        # The next `save` replaces the menu files anyway.
+        pass
+      elif self._pending:
+        self._mergeFromDisk()
+      else:
+        self._reset()
+        self._load()
+      self._syncedState = self._diskState()
+    return True
+
+  def _mergeFromDisk(self):
+    """
+    Bring this menu up to date with the menu files, keeping all changes that are not saved yet.
+    The caller has to hold the lock.
+    """
+    diskMenu = Menu(self.filePath)
+    diskMenu._load()
+    self._generation += 1
+    # The last unsaved change to a pastry wins over whatever is on disk.
+    changed = set((pastry.name, pastry.version) for _, pastry in self._pending)
+    for pastry in diskMenu:
+      if (pastry.name, pastry.version) not in changed:
+        self._insert(pastry)
+    for pastry in self.registry:
+      if (pastry.name, pastry.version) not in changed and diskMenu.get(pastry.name, pastry.version) is None:
+        # Removed by another process.
+        self._delete(pastry)
+
+  def _writeSnapshot(self, registryData):
+    """
+    Write the binary snapshot of the menu file, containing all pastries in `_index`.
+    :param registryData: The contents of the menu file, which have to match `_index`.
+    """
+    try:
+      MenuSnapshot.write(self.snapshotFilePath,
+                         ((name, [(p.version, p.digest) for p in self._index[name]])
+                          for name in sorted(self._index)),
+                         sourceData=registryData)
+    except OSError as ex:
+      log.warning("Unable to write menu snapshot: {}".format(ex))
+
+  def _attachSnapshot(self, snapshot):
+    """Use `snapshot` as lazy source for pastries that are not in `_index` yet."""
+    self._detachSnapshot()
+    self._snapshot = snapshot
+    self._snapshotRemaining = len(snapshot)
+
+  def _detachSnapshot(self):
+    """Load all remaining pastries from the snapshot and close it."""
+    if self._snapshot is None:
+      return
+    for name in self._snapshot.names():
+      self._materialize(name)
+    self._snapshot.close()
+    self._snapshot = None
+    self._materialized.clear()
+    self._snapshotRemaining = 0
+
+  def _materialize(self, name):
+    """Make sure all pastries with the given `name` from the snapshot are in `_index`."""
+    if self._snapshot is None or name in self._materialized:
+      return
+    self._materialized.add(name)
+    entries = self._snapshot.entries(name)
+    if not entries:
+      return
+    self._snapshotRemaining -= len(entries)
+    for version, digest in entries:
+      self._insert(Pastry(name=name, version=version, digest=digest))
 
   def add(self, pastry):
     """
@@ -500,11 +852,11 @@ class Menu:
     If the pastry already exists, the existing instance is returned. Otherwise param `pastry` is added and returned.
     """
     assert hasattr(pastry, "name") and hasattr(pastry, "version"), "Expecting a `Pastry` compatible object!"
-    exisitng = self.get(pastry.name, VersionSpec(pastry.version))
-    if exisitng:
-      return exisitng
-    self.registry.append(pastry)
-    return pastry
+    result = self._insert(pastry)
+    if result is pastry:
+      self._pending.append(("add", pastry))
+      self._generation += 1
+    return result
 
   def remove(self, pastry):
     """
@@ -512,10 +864,40 @@ class Menu:
 
     :return: `False` on failure.
     """
-    try:
-      self.registry.remove(pastry)
-    except ValueError:
+    if not self._delete(pastry):
       return False
+    self._pending.append(("remove", pastry))
+    return True
+
+  def _insert(self, pastry):
+    """Add `pastry` to the index without recording it in the journal. Returns the pastry on the menu."""
+    self._materialize(pastry.name)
+    pastries = self._index.setdefault(pastry.name, [])
+    versions = self._versions.setdefault(pastry.name, [])
+    existing = self._find(pastry.name, pastry.version)
+    if existing is not None:
+      return pastries[existing]
+    i = bisect_right(versions, pastry.version)
+    pastries.insert(i, pastry)
+    versions.insert(i, pastry.version)
+    self._size += 1
+    return pastry
+
+  def _delete(self, pastry):
+    """Remove `pastry` from the index without recording it in the journal. Returns `False` on failure."""
+    self._materialize(pastry.name)
+    i = self._find(pastry.name, pastry.version)
+    if i is None:
+      return False
+    self._generation += 1
+    pastries = self._index[pastry.name]
+    versions = self._versions[pastry.name]
+    del pastries[i]
+    del versions[i]
+    if not pastries:
+      del self._index[pastry.name]
+      del self._versions[pastry.name]
+    self._size -= 1
     return True
 
   def get(self, name, spec, *, default=None):
@@ -523,12 +905,38 @@ class Menu:
     Try get the entry for the given pastry.
     :return: `default` if no such pastry exists.
     """
+    self._materialize(name)
+    pastries = self._index.get(name)
+    if not pastries:
+      return default
+    # Exact versions can be looked up directly.
+    if isinstance(spec, semantic_version.Version):
+      i = self._find(name, spec)
+      return default if i is None else pastries[i]
     spec = VersionSpec(spec)
-    candidates = []
-    for pastry in self.registry:
-      if pastry.name == name and pastry.version in spec:
-        candidates.append(pastry)
-    return max(candidates) if len(candidates) else default
+    # Pastries are sorted by version, so the first match from the top is the best one.
+    for pastry in reversed(pastries):
+      if pastry.version in spec:
+        return pastry
+    return default
+
+  def _find(self, name, version):
+    """
+    Find the index of the pastry with the given `name` and exact `version` in `self._index[name]`.
+    :return: `None` if no such pastry exists.
+    """
+    versions = self._versions.get(name)
+    if not versions:
+      return None
+    # Versions that only differ in their build metadata have the same precedence,
+    # so we have to check all of them.
+    i = bisect_left(versions, version)
+    end = bisect_right(versions, version, lo=i)
+    while i < end:
+      if versions[i] == version:
+        return i
+      i += 1
+    return None
 
   def makePath(self, pastry):
     """
@@ -546,11 +954,28 @@ class Menu:
     """
     Clear the registry entries.
     """
-    self.registry.clear()
+    self._reset()
+    # The journal can not express this, so the next `save` has to rewrite the menu file.
+    self._pending.clear()
+    self._cleared = True
+
+  def _reset(self):
+    """Remove all pastries from the index and close the snapshot, without recording anything."""
+    self._generation += 1
+    if self._snapshot is not None:
+      self._snapshot.close()
+      self._snapshot = None
+      self._materialized.clear()
+      self._snapshotRemaining = 0
+    self._index.clear()
+    self._versions.clear()
+    self._size = 0
 
   def __iter__(self):
-    for p in self.registry:
-      yield p
+    self._detachSnapshot()
+    for name in sorted(self._index):
+      for p in self._index[name]:
+        yield p
 
   def __len__(self):
-    return len(self.registry)
+    return self._size + self._snapshotRemaining
@@ -0,0 +1,231 @@
+"""
+Reading and writing pastry archives.
+
+Pastries are either zip files, or solid xz compressed tar files that compress many small similar files much better.
+Pastries on a menu keep the file name from `Pastry.path` in both formats, because shops and baskets refer to them
+by that name; the format is detected from the file name if it has a tar extension, else from the file contents.
+In tar files, pastry.json and ingredients.json come first, so they can be read without decompressing the ingredients.
+
+Reproducible archives (see `ReproducibleZipFile` and `TarWriter`) do not record file system timestamps, owners or
+permissions other than the executable bit, so baking the same ingredients twice gives byte identical files.
+"""
+
+from hashlib import sha256
+from io import BytesIO
+import os
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+
+from PyBake import Path
+from PyBake.blobs import ingredientArcName
+
+
+zipArchiveFormat = "zip"
+tarArchiveFormat = "tar.xz"
+
+# Files inside a pastry that are not ingredients.
+metaDataFileNames = ("pastry.json", "ingredients.json")
+
+# File name extensions of tar archives.
+tarExtensions = (".tar.xz", ".txz")
+
+xzMagic = b"\xfd7zXZ\x00"
+
+# 1980-01-01 00:00:00 UTC, the earliest time zip files can store.
+zipEpoch = 315532800
+
+
+def reproducibleTimestamp():
+  """
+  The modification time of all files in reproducible archives.
+  Uses the `SOURCE_DATE_EPOCH` environment variable (https://reproducible-builds.org/specs/source-date-epoch/) if set.
+  """
+  epoch = os.environ.get("SOURCE_DATE_EPOCH")
+  if epoch:
+    return max(int(epoch), zipEpoch)
+  return zipEpoch
+
+
+def reproducibleMode(filePath):
+  """The permissions of the file at `filePath` in reproducible archives: 0o755 if it is executable, else 0o644."""
+  return 0o755 if os.stat(str(filePath)).st_mode & 0o111 else 0o644
+
+
+def archiveDigest(filePath, chunkSize=1024 * 1024):
+  """Compute the hex encoded SHA-256 digest of the pastry archive at `filePath`, as stored on the menu."""
+  digest = sha256()
+  with open(str(filePath), "rb") as archiveFile:
+    for chunk in iter(lambda: archiveFile.read(chunkSize), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def detectArchiveFormat(filePath):
+  """
+  Detect the format of the pastry archive at `filePath`, see `tarExtensions`.
+  :return: `zipArchiveFormat`, `tarArchiveFormat` or `None` if the format is unknown.
+  """
+  if str(filePath).lower().endswith(tarExtensions):
+    return tarArchiveFormat
+  with open(str(filePath), "rb") as archiveFile:
+    magic = archiveFile.read(len(xzMagic))
+  if magic == xzMagic:
+    return tarArchiveFormat
+  if zipfile.is_zipfile(str(filePath)):
+    return zipArchiveFormat
+  return None
+
+
+class ReproducibleZipFile(zipfile.ZipFile):
+  """
+  A `zipfile.ZipFile` that writes the same metadata for every file, see `reproducibleTimestamp` and `reproducibleMode`.
+
+  The caller is responsible for writing the files in a stable order.
+  """
+
+  def _reproducibleInfo(self, name, mode, compress_type):
+    info = zipfile.ZipInfo(name, date_time=time.gmtime(reproducibleTimestamp())[:6])
+    info.compress_type = self.compression if compress_type is None else compress_type
+    info.create_system = 3  # Unix, so the permissions below are used everywhere.
+    info.external_attr = mode << 16
+    return info
+
+  def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+    if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+      zinfo_or_arcname = self._reproducibleInfo(zinfo_or_arcname, stat.S_IFREG | 0o644, compress_type)
+      compress_type = None
+    # Like `zipfile.ZipFile.writestr`, explicit arguments override the given `ZipInfo`.
+    super().writestr(zinfo_or_arcname, data, compress_type=compress_type, compresslevel=compresslevel)
+
+  def write(self, filename, arcname=None, compress_type=None, compresslevel=None):
+    arcname = arcname or ingredientArcName(filename)
+    if os.path.isdir(str(filename)):
+      info = self._reproducibleInfo(arcname.rstrip("/") + "/", stat.S_IFDIR | 0o755, zipfile.ZIP_STORED)
+      info.external_attr |= 0x10  # MS-DOS directory flag.
+      super().writestr(info, b"")
+      return
+    info = self._reproducibleInfo(arcname, stat.S_IFREG | reproducibleMode(filename), compress_type)
+    # Lets `open` decide whether zip64 extensions are needed.
+    info.file_size = os.path.getsize(str(filename))
+    with open(str(filename), "rb") as source, self.open(info, "w") as target:
+      shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+class TarWriter:
+  """
+  Writes an xz compressed tar file, offering the parts of the `zipfile.ZipFile` interface the oven uses.
+
+  With `reproducible`, timestamps, owners and permissions are normalized like in `ReproducibleZipFile`.
+
+  :example:
+  with TarWriter("foo.tar.xz") as archive:
+    archive.writestr("pastry.json", data)
+    archive.write("some/file.h")
+  """
+
+  def __init__(self, filePath, *, preset=6, reproducible=False):
+    self.reproducible = reproducible
+    self.tarFile = tarfile.open(str(filePath), "w:xz", preset=preset)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def writestr(self, name, data):
+    """Add a file with the name `name` and the contents `data` (bytes)."""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = reproducibleTimestamp() if self.reproducible else int(time.time())
+    info.mode = 0o644
+    self.tarFile.addfile(info, BytesIO(data))
+
+  def write(self, filePath, arcname=None, compress_type=None):
+    """Add the file at `filePath`. `compress_type` is ignored, the whole archive is compressed."""
+    filePath = Path(filePath).as_posix()
+    self.tarFile.add(filePath, arcname=arcname or ingredientArcName(filePath), recursive=False,
+                     filter=self._normalize if self.reproducible else None)
+
+  @staticmethod
+  def _normalize(info):
+    info.mtime = reproducibleTimestamp()
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    info.mode = 0o755 if info.isdir() or info.mode & 0o111 else 0o644
+    return info
+
+  def close(self):
+    self.tarFile.close()
+
+
+def readArchiveMember(filePath, name):
+  """
+  Read the file `name` from the pastry archive at `filePath`.
+  :return: The contents as bytes, or `None` if there is no such file.
+  """
+  if detectArchiveFormat(filePath) == tarArchiveFormat:
+    # Stream through the archive; metadata files are at the beginning, so stop at the first ingredient when looking
+    # for one of them.
+    with tarfile.open(str(filePath), "r|xz") as tarFile:
+      for member in tarFile:
+        if member.name == name:
+          return tarFile.extractfile(member).read()
+        if name in metaDataFileNames and member.name not in metaDataFileNames:
+          return None
+    return None
+  with zipfile.ZipFile(str(filePath)) as zipFile:
+    if name not in zipFile.namelist():
+      return None
+    return zipFile.read(name)
+
+
+def listArchive(filePath, *, exclude=metaDataFileNames):
+  """
+  List the files in the pastry archive at `filePath`, except for those in `exclude`.
+
+  Listing a tar archive takes a streaming pass over all of it.
+  :return: A list of (name, uncompressed size) tuples, in the order they are stored.
+  """
+  if detectArchiveFormat(filePath) == tarArchiveFormat:
+    with tarfile.open(str(filePath), "r|xz") as tarFile:
+      return [(member.name, member.size) for member in tarFile if member.isfile() and member.name not in exclude]
+  with zipfile.ZipFile(str(filePath)) as zipFile:
+    return [(info.filename, info.file_size) for info in zipFile.infolist()
+            if not info.is_dir() and info.filename not in exclude]
+
+
+def extractArchive(filePath, destination, *, exclude=metaDataFileNames):
+  """
+  Extract all files from the pastry archive at `filePath` to `destination`, except for those in `exclude`.
+
+  Tar archives are extracted in a single streaming pass.
+  :raise ValueError: If a file would be extracted outside of `destination`.
+  """
+  destination = Path(destination).as_posix()
+  if detectArchiveFormat(filePath) != tarArchiveFormat:
+    with zipfile.ZipFile(str(filePath)) as zipFile:
+      members = [name for name in zipFile.namelist() if name not in exclude]
+      zipFile.extractall(destination, members=members)
+    return
+  with tarfile.open(str(filePath), "r|xz") as tarFile:
+    for member in tarFile:
+      if member.name in exclude:
+        continue
+      if not (member.isfile() or member.isdir()):
+        raise ValueError("Unsupported entry in pastry: {}".format(member.name))
+      parts = Path(member.name).parts
+      if Path(member.name).is_absolute() or ".." in parts:
+        raise ValueError("Refusing to extract outside of the destination: {}".format(member.name))
+      targetPath = os.path.join(destination, member.name)
+      if member.isdir():
+        os.makedirs(targetPath, exist_ok=True)
+        continue
+      os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+      source = tarFile.extractfile(member)
+      with open(targetPath, "wb") as targetFile:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+          targetFile.write(chunk)
@@ -3,22 +3,93 @@ The place to get your daily pastries!
 """
 
 from importlib import import_module
-from zipfile import ZipFile
 import json
+import os
 from hashlib import sha1
 import requests
-from io import TextIOWrapper
+import sqlite3
+from contextlib import contextmanager
 
 # Variables.
-from PyBake import dataDir, defaultPastriesDir, byteSuffixLookup
+from PyBake import dataDir, defaultPastriesDir, byteSuffixLookup, formatSize
 # Functions.
 from PyBake import try_getattr, importFromFile, createFilename
 # Classes.
 from PyBake import Pastry, Path, Menu, PastryJSONEncoder
 # Logging.
 from PyBake.logger import log, LogBlock
+from PyBake.blobs import BlobStore, isBlobEntry
+from PyBake.archive import readArchiveMember, extractArchive, archiveDigest
 
-def downloadPastry(menu, pastryData, server, *, forceDownload):
+# Number of times an interrupted download is resumed before giving up.
+downloadRetries = 5
+
+# Errors after which a download is resumed.
+resumableErrors = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+def partialDownloadPaths(pastryPath):
+  """
+  Get the paths of the partial file a pastry is downloaded to, and of the JSON file that describes it.
+  The description identifies the pastry by its "version" and the "etag" of the shop, so a download is only
+  resumed if the pastry did not change.
+  """
+  return (pastryPath.with_name(pastryPath.name + ".partial"), pastryPath.with_name(pastryPath.name + ".partial.json"))
+
+
+def resumableLength(pastryPath, version, etag):
+  """Get the number of bytes of a previous download of `pastryPath` that can be reused, or 0."""
+  partialPath, infoPath = partialDownloadPaths(pastryPath)
+  if not etag or not partialPath.exists() or not infoPath.exists():
+    return 0
+  try:
+    with infoPath.open("r") as infoFile:
+      info = json.load(infoFile)
+  except ValueError:
+    return 0
+  if info.get("version") != str(version) or info.get("etag") != etag:
+    log.info("Discarding partial download of a different pastry: {}".format(partialPath.as_posix()))
+    return 0
+  return partialPath.stat().st_size
+
+
+def writePartialInfo(pastryPath, version, etag):
+  """Describe the partial download of `pastryPath`, see `resumableLength`."""
+  _, infoPath = partialDownloadPaths(pastryPath)
+  if not etag:
+    if infoPath.exists():
+      infoPath.unlink()
+    return
+  with infoPath.open("w") as infoFile:
+    json.dump({"version": str(version), "etag": etag}, infoFile)
+
+
+def receivePastry(response, partialPath, offset):
+  """Write the body of `response` to `partialPath`, appending if `offset` is not 0."""
+  size = int(response.headers.get("content-length", 1024)) + offset
+  with ByteProgressListener(maxSize=size) as progress:
+    progress(offset)
+    with partialPath.open("ab" if offset else "wb") as out_file:
+      chunk_size = 1024 * 4  # 4 KiB at a time.
+      for chunk in response.iter_content(chunk_size):
+        out_file.write(chunk)
+        progress(len(chunk))
+
+
+def downloadPastry(menu, pastryData, server, *, forceDownload, retries=None):
+  """
+  Download a pastry to the `menu`.
+
+  With `forceDownload`, the local pastry is revalidated with `If-None-Match`, so it is only downloaded
+  again if the shop has a different one.
+
+  The file is written to a ".partial" file first, see `partialDownloadPaths`. If the connection drops,
+  the download is resumed from the current length of that file, with an HTTP `Range` request,
+  up to `retries` times (`downloadRetries` by default). A partial file that is left over from a previous
+  call is resumed as well. The complete file is validated against the digest the shop sends.
+  :return: `False` on failure.
+  """
+  retries = downloadRetries if retries is None else retries
   pastryName = pastryData["name"]
   pastryVersionSpec = pastryData["version"]
   pastry = menu.get(pastryName, pastryVersionSpec)
@@ -29,41 +100,135 @@ def downloadPastry(menu, pastryData, server, *, forceDownload):
     return
   pastryRequestData = {"name": pastryName, "version": pastryVersionSpec}
   with LogBlock("Requesting {}".format(pastryRequestData)):
+    headers = {}
+    localPastry = pastry
+    if localPastry and menu.makePath(localPastry).exists():
+      if not localPastry.digest:
+        localPastry.digest = archiveDigest(menu.makePath(localPastry))
+        # Record the digest, so it does not have to be computed again.
+        menu.remove(localPastry)
+        menu.add(localPastry)
+      headers["If-None-Match"] = '"{}"'.format(localPastry.digest)
     response = requests.post("{}/get_pastry".format(server),
                              data=pastryRequestData,
+                             headers=headers,
                              stream=True)
+    if response.status_code == 304:
+      log.info("Pastry is up to date: {}".format(localPastry))
+      return
     if not response.ok:
       log.error("Request failed:\n{}".format(response.text))
       return False
 
-    size = 1024
-    if "content-length" in response.headers:
-      size = int(response.headers["content-length"])
-
     if "x-pastry-version" not in response.headers:
       log.error("Missing required http response header: X-Pastry-Version")
       return False
 
-    pastryVersion = response.headers["x-pastry-version"]
-    pastry = menu.add(Pastry(name=pastryName, version=pastryVersion))
+    pastry = Pastry(name=pastryName, version=response.headers["x-pastry-version"],
+                    digest=response.headers.get("x-pastry-digest"))
+    etag = response.headers.get("etag")
     out_path = menu.makePath(pastry)
+    partialPath, infoPath = partialDownloadPaths(out_path)
     log.info("Saving to: {}".format(out_path.as_posix()))
 
-    with ByteProgressListener(maxSize=size) as progress:
-      with out_path.open("wb") as out_file:
-        chunk_size = 1024 * 4  # 4 KiB at a time.
-        for chunk in response.iter_content(chunk_size):
-          out_file.write(chunk)
-          progress(chunk_size)
+    offset = resumableLength(out_path, pastry.version, etag)
+    if offset:
+      response.close()
+      response = None
+    else:
+      writePartialInfo(out_path, pastry.version, etag)
+
+    attempt = 0
+    while True:
+      try:
+        if response is None:
+          log.info("Resuming download at byte {}.".format(offset))
+          response = requests.get("{}/pastry/{}/{}".format(server, pastry.name, pastry.version),
+                                  headers={"Range": "bytes={}-".format(offset), "If-Range": etag},
+                                  stream=True)
+          if response.status_code == 416:
+            # The partial file is complete already.
+            response.close()
+            break
+          if not response.ok:
+            log.error("Request failed:\n{}".format(response.text))
+            return False
+          if response.status_code != 206:
+            log.info("Pastry changed on the shop, downloading it from the start.")
+            offset = 0
+            etag = response.headers.get("etag")
+            pastry.digest = response.headers.get("x-pastry-digest")
+            writePartialInfo(out_path, pastry.version, etag)
+        receivePastry(response, partialPath, offset)
+        break
+      except resumableErrors as ex:
+        attempt += 1
+        if attempt > retries or not etag:
+          log.error("Download failed: {}".format(ex))
+          return False
+        offset = partialPath.stat().st_size if partialPath.exists() else 0
+        log.warning("Download interrupted ({}), retrying {}/{}.".format(type(ex).__name__, attempt, retries))
+        response = None
+
+    if pastry.digest and archiveDigest(partialPath) != pastry.digest:
+      log.error("Downloaded pastry does not match its digest, discarding it: {}".format(pastry))
+      partialPath.unlink()
+      if infoPath.exists():
+        infoPath.unlink()
+      return False
+    os.replace(partialPath.as_posix(), out_path.as_posix())
+    if infoPath.exists():
+      infoPath.unlink()
+    existing = menu.get(pastry.name, pastry.version)
+    if existing:
+      # Replace the entry, so its digest is updated.
+      menu.remove(existing)
+    menu.add(pastry)
     log.success("Pastry received.")
 
 
-def installPastry(menu, receipt, pastryData, server, *, forceDownload, forceInstall):
+def planDownloads(menu, pastries, server, *, forceDownload):
+  """
+  Resolve the shopping list `pastries` and all dependencies with a single request to the shop's `/resolve`,
+  and download all pastries that are not on the `menu` yet up front, instead of one after another
+  while they are installed.
+
+  Entries with a "callback" are left to `installPastry`, so their download callbacks are called as before.
+  :return: A set of (name, version) pairs of the pastries that were downloaded, or revalidated with `forceDownload`.
+  """
+  shoppingList = [{"name": pastryData["name"], "version": str(pastryData["version"])}
+                  for pastryData in pastries if not pastryData.get("callback")]
+  planned = set()
+  if not shoppingList:
+    return planned
+  with LogBlock("Planning Downloads"):
+    response = requests.post("{}/resolve".format(server), json={"pastries": shoppingList})
+    if not response.ok:
+      # E.g. an older shop, or a pastry that is not on its menu. `installPastry` reports the details.
+      log.debug("Shop could not resolve the shopping list:\n{}".format(response.text))
+      return planned
+    data = response.json()
+    wanted = set((entry["name"], entry["version"]) for entry in data["resolved"]
+                 if forceDownload or not menu.get(entry["name"], entry["spec"]))
+    downloads = [entry for entry in data["pastries"] if (entry["name"], entry["version"]) in wanted]
+    log.info("Downloading {} of {} pastries, {} in total.".format(
+      len(downloads), len(data["pastries"]), formatSize(sum(entry["size"] for entry in downloads))))
+    for entry in downloads:
+      pastryData = {"name": entry["name"], "version": entry["version"]}
+      if downloadPastry(menu, pastryData, server, forceDownload=forceDownload) is not False:
+        planned.add((entry["name"], entry["version"]))
+  return planned
+
+
+def installPastry(menu, receipt, pastryData, server, *, forceDownload, forceInstall, planned=frozenset()):
+  """
+  Install a pastry and its dependencies, downloading them if they are not on the `menu`.
+
+  :param planned: (name, version) pairs of pastries that `planDownloads` fetched already, even with `forceDownload`.
+  """
   def getDependencies(menu, pastry):
-    with ZipFile(menu.makePath(pastry).as_posix()) as pastryFile:
-      with pastryFile.open("pastry.json") as dataFile:
-        pastryData = json.load(TextIOWrapper(dataFile, encoding="UTF-8"))
-        return pastryData.get("dependencies", [])
+    pastryData = json.loads(readArchiveMember(menu.makePath(pastry), "pastry.json").decode("UTF-8"))
+    return pastryData.get("dependencies", [])
 
   pastryName = pastryData["name"]
   pastryVersionSpec = pastryData["version"]
@@ -73,7 +238,7 @@ def installPastry(menu, receipt, pastryData, server, *, forceDownload, forceInst
     pastryName = pastryData.get("forceDownload", pastryName)
     pastryVersionSpec = pastryData.get("forceInstall", pastryVersionSpec)
   pastry = menu.get(pastryName, pastryVersionSpec)
-  if not pastry or forceDownload:
+  if not pastry or (forceDownload and (pastry.name, str(pastry.version)) not in planned):
     downloadPastry(menu, pastryData, server, forceDownload=forceDownload)
     pastry = menu.get(pastryName, pastryVersionSpec)
     pastryData["pastry"] = pastry
@@ -107,12 +272,18 @@ def installPastry(menu, receipt, pastryData, server, *, forceDownload, forceInst
   pastryPath = menu.makePath(pastry)
   for dep in getDependencies(menu, pastry):
     dep["destination"] = pastryDestination
-    installPastry(menu, receipt, dep, server, forceDownload=forceDownload, forceInstall=forceInstall)
+    installPastry(menu, receipt, dep, server, forceDownload=forceDownload, forceInstall=forceInstall, planned=planned)
   log.info("{} => {}".format(pastryPath, pastryDestination))
-  with ZipFile(pastryPath.as_posix()) as pastryFile:
-    blackList = ("pastry.json", "ingredients.json")
-    filteredFiles = [f for f in pastryFile.namelist() if f not in blackList]
-    pastryFile.extractall(pastryDestination.as_posix(), members=filteredFiles)
+  extractArchive(pastryPath, pastryDestination)
+  blobIngredients = []
+  ingredientsBytes = readArchiveMember(pastryPath, "ingredients.json")
+  if ingredientsBytes:
+    ingredients = json.loads(ingredientsBytes.decode("UTF-8"))
+    blobIngredients = [entry for entry in ingredients if isBlobEntry(entry)]
+  if blobIngredients:
+    if not installBlobs(BlobStore(menu.pastryDirPath / "blobs"), blobIngredients, pastryDestination, server):
+      log.error("Failed to install pastry: {}".format(pastry))
+      return
   receipt.add(pastry)
   callback = pastryData.get("callback", None)
   if callback:
@@ -120,6 +291,47 @@ def installPastry(menu, receipt, pastryData, server, *, forceDownload, forceInst
     callback("post-install", pastryData)
 
 
+def downloadBlob(blobStore, digest, server):
+  """
+  Downloads the blob with the given `digest` into the `blobStore`.
+  :return: `False` on failure.
+  """
+  response = requests.get("{}/get_blob/{}".format(server, digest), stream=True)
+  if not response.ok:
+    log.error("Failed to download blob {}:\n{}".format(digest, response.text))
+    return False
+  # Undo any transfer encoding while streaming.
+  response.raw.decode_content = True
+  try:
+    blobStore.write(digest, response.raw)
+  except ValueError as ex:
+    log.error(ex)
+    return False
+  return True
+
+
+def installBlobs(blobStore, ingredients, destination, server):
+  """
+  Copies the blobs of the given ingredients.json entries to `destination`.
+
+  Only blobs that are not in the local `blobStore` yet are downloaded from the server.
+  :return: `False` on failure.
+  """
+  missing = blobStore.missing(sorted(set(entry["blob"] for entry in ingredients)))
+  with LogBlock("Ingredients: {} blobs, {} to download".format(len(ingredients), len(missing))):
+    for digest in missing:
+      log.debug("Downloading blob: {}".format(digest))
+      if not downloadBlob(blobStore, digest, server):
+        return False
+    for entry in ingredients:
+      relativePath = Path(entry["path"])
+      if relativePath.is_absolute() or ".." in relativePath.parts:
+        log.error("Refusing to install ingredient outside of the destination: {}".format(entry["path"]))
+        return False
+      blobStore.copyTo(entry["blob"], destination / relativePath)
+  return True
+
+
 class ByteProgressListener:
   """
   Takes care of logging some bytes progressing.
@@ -181,16 +393,27 @@ if not defaultReceiptsDBPath.exists():
   with defaultReceiptsDBPath.open("w") as receiptsFile:
     json.dump({}, receiptsFile)
 
+# The optional SQLite receipts database, see `ReceiptsDatabase`.
+defaultReceiptsSQLitePath = dataDir / "receipts.sqlite"
+
 
-def getReceipt(shoppingListPath):
+def getReceipt(shoppingListPath, *, database=None):
   """
   Creates a receipt from the shopping list path.
+
+  If a `ReceiptsDatabase` is given as `database`, the receipt is stored in there instead of a JSON file.
   """
   shoppingListPath = Path(shoppingListPath).resolve()
   log.debug("Getting receipt for shopping list: {}".format(shoppingListPath.as_posix()))
   projectPath = shoppingListPath.parent
   log.debug("Key for receipt: {}".format(projectPath.as_posix()))
 
+  if database:
+    receipt = SQLiteReceipt(key=projectPath.as_posix(), database=database)
+    log.debug("Using {}".format(repr(receipt)))
+    database.addReceipt(receipt.key, receipt.hash)
+    return receipt
+
   with defaultReceiptsDBPath.open("r") as receiptsDBFile:
     receiptsDB = json.load(receiptsDBFile)
 
@@ -231,7 +454,206 @@ class Receipt(Menu):
     return "Receipt(key={}, hash={}, filePath={})".format(repr(self.key), repr(self.hash), repr(self.filePath))
 
 
-def run(*, shoppingList="shoppingList.py", forceInstall=False, forceDownload=False, **kwargs):
+def readLegacyReceipt(receiptPath):
+  """
+  Read the pastries of a receipt JSON file and its journal, see `Menu`, without creating any files next to them.
+  :return: A list of pastries.
+  """
+  receiptPath = Path(receiptPath)
+  with receiptPath.open("r") as receiptFile:
+    pastries = {(p.name, p.version): p for p in (Pastry(entry) for entry in json.load(receiptFile))}
+  journalPath = receiptPath.with_suffix(Menu.journalFileSuffix)
+  if journalPath.exists():
+    with journalPath.open("r") as journalFile:
+      for line in journalFile:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          # The remains of an interrupted write, like in `Menu.load`.
+          continue
+        pastry = Pastry(record["pastry"])
+        if record["op"] == "add":
+          pastries.setdefault((pastry.name, pastry.version), pastry)
+        elif record["op"] == "remove":
+          pastries.pop((pastry.name, pastry.version), None)
+  return list(pastries.values())
+
+
+class ReceiptsDatabase:
+  """
+  SQLite database that stores all receipts in a single file.
+
+  Replaces the receipts database JSON file and the per-project receipt JSON files.
+  Multiple processes may use the same database concurrently;
+  writers wait for each other for up to `timeout` seconds.
+  """
+
+  schema = """
+    CREATE TABLE IF NOT EXISTS receipts (
+      key TEXT PRIMARY KEY,
+      hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS pastries (
+      receipt TEXT NOT NULL REFERENCES receipts(key) ON DELETE CASCADE,
+      name TEXT NOT NULL,
+      version TEXT NOT NULL,
+      PRIMARY KEY (receipt, name, version)
+    );
+    CREATE INDEX IF NOT EXISTS pastries_by_name ON pastries(name, version);
+  """
+
+  def __init__(self, filePath=None, *, timeout=60):
+    self.filePath = Path(filePath or defaultReceiptsSQLitePath)
+    self.filePath.parent.safe_mkdir(parents=True)
+    isNew = not self.filePath.exists()
+    # Transactions are managed manually, see `transaction`.
+    self.connection = sqlite3.connect(self.filePath.as_posix(), timeout=timeout, isolation_level=None)
+    # Lets readers proceed while another process is writing.
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute("PRAGMA foreign_keys=ON")
+    with self.transaction() as cursor:
+      for statement in ReceiptsDatabase.schema.split(";"):
+        if statement.strip():
+          cursor.execute(statement)
+    self.filePath = self.filePath.resolve()
+    if isNew:
+      self.migrate()
+
+  @contextmanager
+  def transaction(self):
+    """
+    Run the body of the `with` statement in a write transaction.
+
+    The database is locked for other writers right away, so concurrent read-modify-write cycles can not interleave.
+    """
+    cursor = self.connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+      yield cursor
+    except BaseException:
+      cursor.execute("ROLLBACK")
+      raise
+    cursor.execute("COMMIT")
+
+  def addReceipt(self, key, receiptHash):
+    """Register a receipt. Does nothing if it exists already."""
+    with self.transaction() as cursor:
+      cursor.execute("INSERT OR IGNORE INTO receipts (key, hash) VALUES (?, ?)", (key, receiptHash))
+
+  def pastries(self, key):
+    """Get (name, version) pairs of all pastries on the receipt with the given `key`."""
+    return self.connection.execute("SELECT name, version FROM pastries WHERE receipt = ?", (key,)).fetchall()
+
+  def installations(self, name):
+    """Get (receipt key, version) pairs of all installations of pastries with the given `name`."""
+    return self.connection.execute("SELECT receipt, version FROM pastries WHERE name = ?", (name,)).fetchall()
+
+  def update(self, key, *, added=(), removed=(), replace=False):
+    """
+    Change the pastries on the receipt with the given `key` in a single transaction.
+    :param added: Pastries to add.
+    :param removed: Pastries to remove.
+    :param replace: Remove all pastries from the receipt first.
+    """
+    with self.transaction() as cursor:
+      if replace:
+        cursor.execute("DELETE FROM pastries WHERE receipt = ?", (key,))
+      cursor.executemany("DELETE FROM pastries WHERE receipt = ? AND name = ? AND version = ?",
+                         [(key, p.name, str(p.version)) for p in removed])
+      cursor.executemany("INSERT OR IGNORE INTO pastries (receipt, name, version) VALUES (?, ?, ?)",
+                         [(key, p.name, str(p.version)) for p in added])
+
+  def migrate(self, receiptsDBPath=None, receiptsDirPath=None):
+    """
+    Import receipts from the receipts database JSON file and the receipt JSON files it refers to.
+
+    Existing entries are kept, so this is safe to call more than once.
+    :return: The number of imported receipts.
+    """
+    receiptsDBPath = Path(receiptsDBPath or defaultReceiptsDBPath)
+    receiptsDirPath = Path(receiptsDirPath or defaultReceiptsDirPath)
+    if not receiptsDBPath.exists():
+      return 0
+    with LogBlock("Migrating Receipts: {}".format(receiptsDBPath.as_posix())):
+      with receiptsDBPath.open("r") as receiptsDBFile:
+        receiptsDB = json.load(receiptsDBFile)
+      numReceipts = 0
+      with self.transaction() as cursor:
+        for key, receiptHash in sorted(receiptsDB.items()):
+          cursor.execute("INSERT OR IGNORE INTO receipts (key, hash) VALUES (?, ?)", (key, receiptHash))
+          receiptPath = receiptsDirPath / "{}.json".format(receiptHash)
+          if not receiptPath.exists():
+            log.warning("Missing receipt file for {}: {}".format(key, receiptPath.as_posix()))
+            continue
+          cursor.executemany("INSERT OR IGNORE INTO pastries (receipt, name, version) VALUES (?, ?, ?)",
+                             [(key, p.name, str(p.version)) for p in readLegacyReceipt(receiptPath)])
+          numReceipts += 1
+      log.info("Migrated {} receipts.".format(numReceipts))
+      return numReceipts
+
+  def close(self):
+    """Close the database connection."""
+    self.connection.close()
+
+
+class SQLiteReceipt(Receipt):
+  """
+  A receipt that is stored in a `ReceiptsDatabase` instead of a JSON file.
+
+  `save` only writes the pastries that were added or removed since the last `load` or `save`,
+  so concurrent basket runs do not drop each other's changes.
+
+  None of the menu files are used. `filePath` is the database file and only serves to identify the receipt in logs.
+  """
+
+  def __init__(self, *, key, database):
+    self.key = key
+    self.hash = sha1(str(self.key).encode("UTF-8")).hexdigest()
+    self.database = database
+    self._initEntries()
+    self.filePath = database.filePath
+
+  def load(self):
+    """Load the pastries on this receipt from the database. Returns the number of new entries."""
+    numNewEntries = 0
+    for name, version in self.database.pastries(self.key):
+      self._insert(Pastry(name=name, version=version))
+      numNewEntries += 1
+    return numNewEntries
+
+  def save(self):
+    """Write changes since the last `load` or `save` to the database."""
+    if self._cleared:
+      self.compact()
+      return
+    added = [pastry for op, pastry in self._pending if op == "add"]
+    removed = [pastry for op, pastry in self._pending if op == "remove"]
+    if added or removed:
+      self.database.update(self.key, added=added, removed=removed)
+    self._pending.clear()
+
+  def compact(self):
+    """Replace all pastries on this receipt in the database."""
+    self.database.update(self.key, added=self.registry, replace=True)
+    self._pending.clear()
+    self._cleared = False
+
+  def refresh(self):
+    """
+    Reload the pastries on this receipt from the database, unless there are changes that are not saved yet.
+    :return: Whether anything was loaded.
+    """
+    if self._pending or self._cleared:
+      return False
+    self._reset()
+    self.load()
+    return True
+
+  def __repr__(self):
+    return "SQLiteReceipt(key={}, hash={}, filePath={})".format(repr(self.key), repr(self.hash), repr(self.filePath))
+
+
+def run(*, shoppingList="shoppingList.py", forceInstall=False, forceDownload=False, sqliteReceipts=False, **kwargs):
   """Gets pastries from the shop using the shopping list"""
   with LogBlock("Basket"):
     shoppingListPath = shoppingList.resolve()
@@ -250,15 +672,22 @@ def run(*, shoppingList="shoppingList.py", forceInstall=False, forceDownload=Fal
       menu = Menu(pastriesRoot)
       log.debug("Menu file path: {}".format(menu.filePath.as_posix()))
       menu.load()
-    with LogBlock("Load Recipe"):
-      receipt = getReceipt(shoppingListPath)
-      log.debug("Receipt file path: {}".format(receipt.filePath.as_posix()))
-      receipt.load()
-    with LogBlock("Installing Pastries"):
-      for pastry in pastries:
-        installPastry(menu, receipt, pastry, server, forceInstall=forceInstall, forceDownload=forceDownload)
-    receipt.save()
-    menu.save()
+    database = ReceiptsDatabase() if sqliteReceipts else None
+    try:
+      with LogBlock("Load Recipe"):
+        receipt = getReceipt(shoppingListPath, database=database)
+        log.debug("Receipt file path: {}".format(receipt.filePath.as_posix()))
+        receipt.load()
+      planned = planDownloads(menu, pastries, server, forceDownload=forceDownload)
+      with LogBlock("Installing Pastries"):
+        for pastry in pastries:
+          installPastry(menu, receipt, pastry, server, forceInstall=forceInstall, forceDownload=forceDownload,
+                        planned=planned)
+      receipt.save()
+      menu.save()
+    finally:
+      if database:
+        database.close()
 
     callback = try_getattr(shoppingList, ["callback"])
     if callback:
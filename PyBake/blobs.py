@@ -0,0 +1,102 @@
+"""
+Content-addressed storage for ingredients, shared by pastries that contain the same files.
+
+A pastry baked with blobs only contains pastry.json and ingredients.json.
+Each entry of ingredients.json then refers to the content of the ingredient by its digest:
+
+  {"path": "Code/Engine/Foundation/Basics.h", "blob": "<sha1 hex digest>", "size": 1234}
+"""
+
+from hashlib import sha1
+import os
+import shutil
+
+from PyBake import Path
+
+
+def hashFile(filePath, chunkSize=1024 * 1024):
+  """Compute the digest that identifies the blob with the contents of the file at `filePath`."""
+  digest = sha1()
+  with open(str(filePath), "rb") as blobFile:
+    for chunk in iter(lambda: blobFile.read(chunkSize), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def isBlobEntry(entry):
+  """Whether `entry` from an ingredients.json file refers to a blob."""
+  return isinstance(entry, dict) and "blob" in entry
+
+
+def ingredientArcName(path):
+  """The relative path an ingredient gets inside a pastry, like `zipfile.ZipFile.write` would choose it."""
+  parts = [part for part in Path(path).as_posix().split("/") if part not in ("", ".", "..")]
+  if parts and parts[0].endswith(":"):
+    # Strip Windows drive letters.
+    parts = parts[1:]
+  return "/".join(parts)
+
+
+class BlobStore:
+  """
+  A directory of blobs, each stored in a file named after its digest.
+
+  Blobs are written to a temporary file first and then renamed,
+  so concurrent processes can safely add the same blob.
+
+  :example:
+  store = BlobStore(".pastries/blobs")
+  digest = store.add("some/file.h")
+  store.path(digest)  # .pastries/blobs/ab/ab12...
+  """
+
+  def __init__(self, dirPath):
+    self.dirPath = Path(dirPath)
+
+  def path(self, digest):
+    """The path of the blob with the given `digest`, whether it exists or not."""
+    return self.dirPath / digest[:2] / digest
+
+  def has(self, digest):
+    """Whether the blob with the given `digest` is stored."""
+    return self.path(digest).exists()
+
+  def missing(self, digests):
+    """Get the digests in `digests` that are not stored, in their original order."""
+    return [digest for digest in digests if not self.has(digest)]
+
+  def add(self, filePath):
+    """Store a copy of the file at `filePath`. Returns its digest."""
+    digest = hashFile(filePath)
+    if not self.has(digest):
+      with open(str(filePath), "rb") as source:
+        self.write(digest, source)
+    return digest
+
+  def write(self, digest, stream, chunkSize=1024 * 1024):
+    """
+    Store the contents of the binary `stream` as the blob with the given `digest`.
+    :raise ValueError: If the contents do not match `digest`. Nothing is stored in this case.
+    """
+    targetPath = self.path(digest)
+    targetPath.parent.safe_mkdir(parents=True)
+    tempPath = targetPath.with_name("{}.{}.tmp".format(digest, os.getpid()))
+    actual = sha1()
+    try:
+      with tempPath.open("wb") as tempFile:
+        for chunk in iter(lambda: stream.read(chunkSize), b""):
+          actual.update(chunk)
+          tempFile.write(chunk)
+      if actual.hexdigest() != digest:
+        raise ValueError("Blob contents do not match digest {}: {}".format(digest, actual.hexdigest()))
+      os.replace(tempPath.as_posix(), targetPath.as_posix())
+    finally:
+      if tempPath.exists():
+        tempPath.unlink()
+    return targetPath
+
+  def copyTo(self, digest, destinationPath):
+    """Copy the blob with the given `digest` to `destinationPath`."""
+    destinationPath = Path(destinationPath)
+    destinationPath.parent.safe_mkdir(parents=True)
+    shutil.copyfile(self.path(digest).as_posix(), destinationPath.as_posix())
@@ -36,6 +36,11 @@ class BasketModuleManager:
                               action="append_const",
                               const="all",
                               help="Implies --force-download and --force-install.")
+    basketParser.add_argument("--sqlite-receipts",
+                              dest="sqliteReceipts",
+                              action="store_true",
+                              help="Store receipts in a single SQLite database instead of JSON files. "
+                                   "Existing JSON receipts are imported when the database is created.")
     basketParser.set_defaults(func=execute_basket)
 
 def execute_basket(args):
@@ -1,7 +1,7 @@
 """Command generation for oven"""
 
 from PyBake.commands import command
-from PyBake import Path, log, zipCompressionLookup
+from PyBake import Path, log, zipCompressionLookup, adaptiveCompression
 import textwrap
 
 @command("oven")
@@ -30,11 +30,51 @@ class OvenModuleManager:
                             help="The working directory when executing the `recipes_script`. Defaults to the current working dir.")
     ovenParser.add_argument("-f", "--force",
                             action="store_true",
-                            help="Ignore already existing pastries in the target output dir.")
+                            help="Ignore already existing pastries in the target output dir. "
+                                 "Pastries whose ingredients did not change since they were last baked are still skipped.")
+    ovenParser.add_argument("--content-hash",
+                            dest="contentHash",
+                            action="store_true",
+                            help="Also hash the contents of all ingredients to detect changes, "
+                                 "instead of only their paths, sizes and modification times.")
+    ovenParser.add_argument("--reproducible",
+                            action="store_true",
+                            help="Sort all files and normalize their timestamps and permissions, "
+                                 "so the same ingredients always give byte identical pastries. "
+                                 "Timestamps are taken from SOURCE_DATE_EPOCH if set.")
+    ovenParser.add_argument("--plan",
+                            action="store_true",
+                            help="Do not bake anything. Run the recipes and print the number of files, raw size and "
+                                 "duplicate ingredients of each pastry, and estimate its baked size and bake time.")
+    ovenParser.add_argument("--plan-json",
+                            dest="planJson",
+                            type=Path,
+                            help="Also write the plan to this JSON file. Implies --plan.")
     ovenParser.add_argument("-c", "--compression",
-                            choices=zipCompressionLookup.keys(),
+                            choices=list(zipCompressionLookup.keys()) + [adaptiveCompression],
                             default="deflated",
-                            help="The compression method used to create a pastry.")
+                            help="The compression method used to create a pastry. "
+                                 "'{}' chooses one per ingredient, based on the `compressionRules` dict "
+                                 "of the recipes script and a quick compression probe.".format(adaptiveCompression))
+    ovenParser.add_argument("--format",
+                            dest="archiveFormat",
+                            choices=["zip", "tar.xz"],
+                            default="zip",
+                            help="The archive format of the pastries. 'tar.xz' creates solid archives, which compress "
+                                 "many small similar files much better. Default: zip")
+    ovenParser.add_argument("--blobs",
+                            action="store_true",
+                            help="Store ingredients once in a content-addressed 'blobs' directory in the output dir, "
+                                 "instead of inside each pastry.")
+    ovenParser.add_argument("-j", "--jobs",
+                            type=int,
+                            default=1,
+                            help="The number of processes used to bake pastries concurrently. Default: 1")
+    ovenParser.add_argument("--recipe-jobs",
+                            dest="recipeJobs",
+                            type=int,
+                            default=1,
+                            help="The number of threads used to run recipes concurrently. Default: 1")
     ovenParser.set_defaults(func=execute_oven)
 
 def execute_oven(args):
@@ -42,5 +82,7 @@ def execute_oven(args):
   from PyBake import log
   log.info("Executing oven")
   from PyBake import oven
-  args.compression = zipCompressionLookup[args.compression]
+  if args.compression != adaptiveCompression:
+    args.compression = zipCompressionLookup[args.compression]
+  args.bakerFunc = oven.bakers[args.archiveFormat]
   return oven.run(**vars(args))
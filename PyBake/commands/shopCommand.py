@@ -16,6 +16,18 @@ class ShopModuleManager:
   def createArguments(self, shopParser):
     shopParser.add_argument("-c", "--config", default="shop_config",
                             help="Supply a custom config for the shop (defaults to shop_config")
+    shopParser.add_argument("--production",
+                            action="store_true",
+                            help="Serve with a pool of worker processes and threads instead of the Flask development "
+                                 "server. Can also be enabled with `production = True` in the config.")
+    shopParser.add_argument("-w", "--workers",
+                            type=int,
+                            help="Number of worker processes in production mode. "
+                                 "Defaults to `workers` in the config, or 1.")
+    shopParser.add_argument("-t", "--threads",
+                            type=int,
+                            help="Number of threads per worker process in production mode. "
+                                 "Defaults to `threads` in the config, or 8.")
     shopParser.set_defaults(func=execute_shop)
 
 def execute_shop(args):
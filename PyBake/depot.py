@@ -4,9 +4,10 @@ Sending pastries generated from the oven to the shop.
 
 from PyBake import *
 from PyBake.logger import *
+from PyBake.blobs import BlobStore, isBlobEntry
+from PyBake.archive import readArchiveMember
 from importlib import import_module
 import textwrap
-import zipfile
 import requests
 
 
@@ -19,18 +20,23 @@ def uploadPastry(menu, pastry, server, *, force):
   pastryPath = menu.makePath(pastry)
   # Extract pastry.json data from the pastry package (pastry.zip),
   # to validate the pastry.
-  with pastryPath.open("rb") as pastryFile:
-    with zipfile.ZipFile(pastryFile) as zip_file:
-      # Note: For some reason, json.load does not accept the result
-      #       of ZipFile.open, so we use ZipFile.read instead to load
-      #       the entire file as bytes, convert it to a string, and parse that.
-      pastryBytes = zip_file.read("pastry.json")
-      zippedPastry = Pastry(data=json.loads(pastryBytes.decode("UTF-8")))
+  pastryBytes = readArchiveMember(pastryPath, "pastry.json")
+  if pastryBytes is None:
+    log.error("Pastry file does not contain a pastry.json: {}".format(pastryPath.as_posix()))
+    return
+  zippedPastry = Pastry(data=json.loads(pastryBytes.decode("UTF-8")))
+  ingredientsBytes = readArchiveMember(pastryPath, "ingredients.json")
+  ingredients = json.loads(ingredientsBytes.decode("UTF-8")) if ingredientsBytes else []
 
   if zippedPastry != pastry:
     log.error("Pastry infos from the menu and the pastry.json inside it do not match: {} vs. {}".format(zippedPastry, pastry))
     return
 
+  blobs = sorted(set(entry["blob"] for entry in ingredients if isBlobEntry(entry)))
+  if blobs and not uploadBlobs(BlobStore(menu.pastryDirPath / "blobs"), blobs, server):
+    log.error("Failed to upload the ingredients of pastry: {}".format(pastry))
+    return
+
   # Construct the `files` dictionary with the pastry package (.zip).
   files = {"pastry": pastryPath.open("rb")}
 
@@ -50,6 +56,28 @@ def uploadPastry(menu, pastry, server, *, force):
       log.error("Failed to upload pastry.")
 
 
+def uploadBlobs(blobStore, digests, server):
+  """
+  Uploads all blobs with the given `digests` from the `blobStore` that the server does not have yet.
+  :return: `False` on failure.
+  """
+  with LogBlock("Uploading Blobs"):
+    response = requests.post("{}/missing_blobs".format(server), json={"blobs": digests})
+    if not response.ok:
+      log.error("Failed to query missing blobs:\n{}".format(response.text))
+      return False
+    missing = response.json()["missing"]
+    log.info("Uploading {} of {} blobs.".format(len(missing), len(digests)))
+    for digest in missing:
+      log.debug(digest)
+      with blobStore.path(digest).open("rb") as blobFile:
+        response = requests.post("{}/upload_blob".format(server), data={"digest": digest}, files={"blob": blobFile})
+      if not response.ok:
+        log.error("Failed to upload blob {}:\n{}".format(digest, response.text))
+        return False
+    return True
+
+
 def run(*, pastryPaths, configPath, force, **kwargs):
   """Deposit a pastry in a shop."""
   # Import the config script.
@@ -3,6 +3,7 @@ Logging facility of our bakery
 """
 
 import sys
+import threading
 from enum import IntEnum, unique
 from clint.textui import progress
 
@@ -41,14 +42,15 @@ class LogBackend:
   log.seriouswarning(...)
 
   where log is an object of this class
+
+  Log blocks are tracked per thread, so threads can log concurrently, e.g. while the shop serves several requests.
   """
 
   def __init__(self, *, sinks=[], verbosity=LogVerbosity.Success, quiet=False):
     self.sinks = sinks
     self.verbosity = verbosity
     self.quiet = quiet
-    self.printedBlocks = []
-    self.newBlocks = []
+    self._local = threading.local()
     self.progressBar = None
     self.prevBarTemplate = None
 
@@ -64,6 +66,28 @@ class LogBackend:
   def __call__(self, *args):
     self.info(*args)
 
+  @property
+  def printedBlocks(self):
+    """Log blocks of the current thread that were opened and printed."""
+    if not hasattr(self._local, "printedBlocks"):
+      self._local.printedBlocks = []
+    return self._local.printedBlocks
+
+  @printedBlocks.setter
+  def printedBlocks(self, blocks):
+    self._local.printedBlocks = blocks
+
+  @property
+  def newBlocks(self):
+    """Log blocks of the current thread that were opened, but are only printed along with the first message in them."""
+    if not hasattr(self._local, "newBlocks"):
+      self._local.newBlocks = []
+    return self._local.newBlocks
+
+  @newBlocks.setter
+  def newBlocks(self, blocks):
+    self._local.newBlocks = blocks
+
   @property
   def blockLevel(self):
       return len(self.printedBlocks) + len(self.newBlocks)
@@ -73,11 +97,14 @@ class LogBackend:
     Add a log sink that will be called when a logging event occurs.
     Can all the same sink multiple times.
     """
-    self.sinks.append(sink)
+    # Replace the list instead of changing it, other threads may be iterating it.
+    self.sinks = self.sinks + [sink]
 
   def removeLogSink(self, sink):
     """Remove a log sink so it won't receive logging events anymore."""
-    self.sinks.remove(sink)
+    sinks = list(self.sinks)
+    sinks.remove(sink)
+    self.sinks = sinks
 
   def addLogBlock(self, block):
     """Add a log block to the current logging context."""
@@ -177,6 +204,7 @@ class ScopedLogSink:
   Log sink that can be used for a `with` scope.
 
   Useful when monitoring the log messages for just a small code frame.
+  Only messages logged by the thread that entered the `with` scope are recorded.
 
   :example:
   with ScopedLogSink(log) as sink:
@@ -190,6 +218,7 @@ class ScopedLogSink:
       self.logged[logLevelName.lower()] = []
 
   def __enter__(self):
+    self.threadId = threading.get_ident()
     self.logBacked.addLogSink(self)
     return self
 
@@ -202,13 +231,42 @@ class ScopedLogSink:
 
   def logMessage(self, *, verbosity, message, blockLevel):
     """Handle the logging event."""
-    if verbosity <= LogLevel.Warning:
+    if verbosity <= LogLevel.Warning and threading.get_ident() == self.threadId:
       self.logged["error"].append(message)
 
   def logBlock(self, *, block, isOpening):
     pass
 
 
+class BufferedLogSink:
+  """
+  Log sink that stores all log messages so they can be replayed later, e.g. in another process.
+
+  :example:
+  sink = BufferedLogSink()
+  log.addLogSink(sink)
+  doSomethingThatLogsStuffGlobally()
+  log.removeLogSink(sink)
+  replayRecords(sink.records)
+  """
+  def __init__(self):
+    self.records = []
+
+  def logMessage(self, *, verbosity, message, blockLevel):
+    """Handle the logging event."""
+    self.records.append((int(verbosity), str(message)))
+
+  def logBlock(self, *, block, isOpening):
+    pass
+
+
+def replayRecords(records, logBackend=None):
+  """Log (verbosity, message) pairs recorded by a `BufferedLogSink` with the given `logBackend`."""
+  logBackend = logBackend or log
+  for verbosity, message in records:
+    logBackend.logMessage(LogLevel(verbosity), message)
+
+
 class LogBlock:
   """
   Create a log block in the current logging context.
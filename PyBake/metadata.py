@@ -0,0 +1,110 @@
+"""
+An index of the metadata of pastries, so it can be served without sending or opening the pastry archives.
+
+The shop adds each pastry to the index when it is uploaded. Entries are named after the digest of the pastry file,
+see `PyBake.archive.archiveDigest`, so they never change and all worker processes can share them:
+
+  {
+    "pastry": {"name": "foo", "version": "0.1.0", "dependencies": [...]},  # pastry.json
+    "ingredients": [...],                                                  # ingredients.json
+    "files": [{"path": "Code/Engine/Foundation/Basics.h", "size": 1234}, ...],
+    "size": 5678,                                                          # Size of the pastry file.
+  }
+
+"files" lists the ingredients stored in the archive as well as those stored as blobs, see `PyBake.blobs`.
+"""
+
+import json
+import os
+import threading
+
+from PyBake import Path
+from PyBake.archive import readArchiveMember, listArchive
+from PyBake.blobs import isBlobEntry
+
+
+def readPastryMetadata(filePath):
+  """
+  Read the metadata of the pastry archive at `filePath`, in the format of the `MetadataIndex` entries.
+  :raise ValueError: If the archive has no pastry.json.
+  """
+  filePath = Path(filePath)
+  pastryBytes = readArchiveMember(filePath, "pastry.json")
+  if pastryBytes is None:
+    raise ValueError("Pastry file does not contain a pastry.json: {}".format(filePath.as_posix()))
+  ingredientsBytes = readArchiveMember(filePath, "ingredients.json")
+  ingredients = json.loads(ingredientsBytes.decode("UTF-8")) if ingredientsBytes else []
+  files = [{"path": name, "size": size} for name, size in listArchive(filePath)]
+  files.extend({"path": entry["path"], "size": entry.get("size"), "blob": entry["blob"]}
+               for entry in ingredients if isBlobEntry(entry))
+  return {
+    "pastry": json.loads(pastryBytes.decode("UTF-8")),
+    "ingredients": ingredients,
+    "files": files,
+    "size": filePath.stat().st_size,
+  }
+
+
+class MetadataIndex:
+  """
+  A directory of pastry metadata, each entry stored in a JSON file named after the digest of the pastry file.
+
+  Entries are written to a temporary file first and then renamed, like blobs in a `PyBake.blobs.BlobStore`.
+
+  :example:
+  index = MetadataIndex(".pastries/metadata")
+  index.add(digest, "foo-0.1.0.zip")
+  index.get(digest)["pastry"]["dependencies"]
+  """
+
+  def __init__(self, dirPath):
+    self.dirPath = Path(dirPath)
+
+  def path(self, digest):
+    """The path of the entry of the pastry with the given `digest`, whether it exists or not."""
+    return self.dirPath / digest[:2] / "{}.json".format(digest)
+
+  def has(self, digest):
+    """Whether the metadata of the pastry with the given `digest` is stored."""
+    return self.path(digest).exists()
+
+  def add(self, digest, filePath):
+    """
+    Read the metadata of the pastry file at `filePath`, which has the given `digest`, and store it.
+    :return: The metadata.
+    :raise ValueError: If the archive has no pastry.json.
+    """
+    metadata = readPastryMetadata(filePath)
+    targetPath = self.path(digest)
+    targetPath.parent.safe_mkdir(parents=True)
+    tempPath = targetPath.with_name("{}.{}.{}.tmp".format(digest, os.getpid(), threading.get_ident()))
+    try:
+      with tempPath.open("w") as tempFile:
+        json.dump(metadata, tempFile, sort_keys=True)
+      os.replace(tempPath.as_posix(), targetPath.as_posix())
+    finally:
+      if tempPath.exists():
+        tempPath.unlink()
+    return metadata
+
+  def remove(self, digest):
+    """
+    Remove the metadata of the pastry with the given `digest`, e.g. when its file was replaced.
+    :return: Whether it was stored.
+    """
+    try:
+      self.path(digest).unlink()
+    except FileNotFoundError:
+      return False
+    return True
+
+  def get(self, digest):
+    """
+    Load the metadata of the pastry with the given `digest`.
+    :return: `None` if it is not stored.
+    """
+    try:
+      with self.path(digest).open("r") as metadataFile:
+        return json.load(metadataFile)
+    except FileNotFoundError:
+      return None
@@ -0,0 +1,194 @@
+"""
+Counters, gauges and histograms in the Prometheus text format, to watch the shop under load.
+
+Updating a metric only takes a lock and a few additions, so metrics are cheap enough to be always on.
+Each process keeps its own metrics; with several shop workers, every worker reports the requests it served.
+
+:example:
+registry = MetricsRegistry()
+requests = registry.counter("requests_total", "Number of requests.", labels=("endpoint",))
+requests.inc(endpoint="get_pastry")
+registry.render()  # 'requests_total{endpoint="get_pastry"} 1\n' with HELP and TYPE comments.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+
+# Upper bounds in seconds of the default buckets of `Histogram`.
+# Downloads and uploads of large pastries can take much longer than lookups.
+defaultBuckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Content type of `MetricsRegistry.render`.
+contentType = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def formatLabels(names, values, extra=()):
+  """Format label names and values like `{endpoint="get_pastry",le="0.5"}`."""
+  pairs = list(zip(names, values)) + list(extra)
+  if not pairs:
+    return ""
+  escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+  return "{" + ",".join('{}="{}"'.format(name, value) for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def formatValue(value):
+  """Format a sample value; Prometheus spells infinity "+Inf"."""
+  if value == float("inf"):
+    return "+Inf"
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return repr(value)
+
+
+class Metric:
+  """
+  Base class of all metrics. Values are kept per combination of label values.
+
+  :param name: The metric name, e.g. "pybake_shop_requests_total".
+  :param help: One line of documentation.
+  :param labels: Names of the labels, which have to be passed as keyword arguments when updating the metric.
+  """
+  type = None
+
+  def __init__(self, name, help, *, labels=()):
+    self.name = name
+    self.help = help
+    self.labels = tuple(labels)
+    self._lock = threading.Lock()
+    self._values = {}
+
+  def _key(self, labelValues):
+    if len(labelValues) != len(self.labels):
+      raise ValueError("Metric {} expects labels {}, got {}".format(self.name, self.labels, sorted(labelValues)))
+    return tuple(str(labelValues[label]) for label in self.labels)
+
+  def samples(self):
+    """
+    Get the current samples of this metric.
+    :return: A list of (name suffix, label values, extra labels, value) tuples.
+    """
+    with self._lock:
+      return [("", key, (), value) for key, value in sorted(self._values.items())]
+
+  def render(self):
+    """Format this metric in the Prometheus text format."""
+    lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+    for suffix, key, extra, value in self.samples():
+      lines.append("{}{}{} {}".format(self.name, suffix, formatLabels(self.labels, key, extra), formatValue(value)))
+    return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+  """A value that only goes up, e.g. the number of requests."""
+  type = "counter"
+
+  def inc(self, amount=1, **labelValues):
+    key = self._key(labelValues)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+  """
+  A value that goes up and down, e.g. the number of requests in flight.
+
+  :param collect: Optional function that returns the current value when the metric is rendered,
+                  for gauges without labels whose value is already known elsewhere, e.g. the size of the menu.
+  """
+  type = "gauge"
+
+  def __init__(self, name, help, *, labels=(), collect=None):
+    super().__init__(name, help, labels=labels)
+    self.collect = collect
+
+  def inc(self, amount=1, **labelValues):
+    key = self._key(labelValues)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount=1, **labelValues):
+    self.inc(-amount, **labelValues)
+
+  def set(self, value, **labelValues):
+    key = self._key(labelValues)
+    with self._lock:
+      self._values[key] = value
+
+  def samples(self):
+    if self.collect:
+      return [("", (), (), self.collect())]
+    return super().samples()
+
+
+class Histogram(Metric):
+  """
+  Counts observed values, e.g. request durations in seconds, in buckets with the given upper bounds.
+  """
+  type = "histogram"
+
+  def __init__(self, name, help, *, labels=(), buckets=defaultBuckets):
+    super().__init__(name, help, labels=labels)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labelValues):
+    key = self._key(labelValues)
+    i = bisect_left(self.buckets, value)
+    with self._lock:
+      counts, total = self._values.get(key, (None, 0))
+      if counts is None:
+        # One count per bucket and one for values above the largest bucket.
+        counts = [0] * (len(self.buckets) + 1)
+      counts[i] += 1
+      self._values[key] = (counts, total + value)
+
+  @contextmanager
+  def time(self, **labelValues):
+    """Observe the time it takes to run the `with` block."""
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, **labelValues)
+
+  def samples(self):
+    with self._lock:
+      values = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+    samples = []
+    for key, counts, total in values:
+      cumulative = 0
+      for bound, count in zip(self.buckets + (float("inf"),), counts):
+        cumulative += count
+        samples.append(("_bucket", key, (("le", formatValue(float(bound))),), cumulative))
+      samples.append(("_sum", key, (), total))
+      samples.append(("_count", key, (), cumulative))
+    return samples
+
+
+class MetricsRegistry:
+  """The metrics of one component, rendered together."""
+
+  def __init__(self):
+    self.metrics = []
+
+  def _register(self, metric):
+    self.metrics.append(metric)
+    return metric
+
+  def counter(self, name, help, **kwargs):
+    """Create and register a `Counter`."""
+    return self._register(Counter(name, help, **kwargs))
+
+  def gauge(self, name, help, **kwargs):
+    """Create and register a `Gauge`."""
+    return self._register(Gauge(name, help, **kwargs))
+
+  def histogram(self, name, help, **kwargs):
+    """Create and register a `Histogram`."""
+    return self._register(Histogram(name, help, **kwargs))
+
+  def render(self):
+    """Format all metrics in the Prometheus text format, see `contentType`."""
+    return "".join(metric.render() for metric in self.metrics)
@@ -2,46 +2,227 @@
 Generate a list of tagged files that will be combined to a crumble.
 """
 from PyBake import *
+from PyBake.logger import BufferedLogSink, replayRecords
+from PyBake.blobs import BlobStore, ingredientArcName
+from PyBake.scanner import scanner
+from PyBake.archive import ReproducibleZipFile, TarWriter, archiveDigest, zipArchiveFormat, tarArchiveFormat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import sha1
+import bz2
 import json
+import lzma
+import os
+import sys
+import threading
+import time
 import zipfile
+import zlib
+
+
+def ingredientPath(ingredient):
+  """
+  Turn an ingredient into a posix path string, like `Path(ingredient).as_posix()`.
+
+  Accepts strings, `Path` objects and `os.DirEntry` objects. Plain strings are not turned into `Path` objects
+  unless they need to be normalized.
+  """
+  if isinstance(ingredient, str):
+    if ("\\" in ingredient or "//" in ingredient or "/./" in ingredient or
+        ingredient.startswith("./") or ingredient.endswith("/") or ingredient.endswith("/.")):
+      return Path(ingredient).as_posix()
+    return ingredient
+  if isinstance(ingredient, os.DirEntry):
+    return ingredientPath(ingredient.path)
+  return Path(ingredient).as_posix()
+
+
+class IngredientSet:
+  """
+  Compact, insertion-ordered set of ingredient paths.
+
+  Paths are stored as interned posix strings, so pastries that share ingredients also share the strings.
+  Iterating yields `Path` objects for compatibility; use `paths` to get the strings instead.
+  Not thread-safe by itself, see `Pastry.addIngredients`.
+  """
+
+  def __init__(self, ingredients=()):
+    self._paths = []
+    self._seen = set()
+    self.update(ingredients)
+
+  def add(self, ingredient):
+    """Add a single ingredient, see `ingredientPath`."""
+    path = sys.intern(ingredientPath(ingredient))
+    if path not in self._seen:
+      self._seen.add(path)
+      self._paths.append(path)
+
+  def update(self, ingredients):
+    """Add all ingredients from the iterable `ingredients`, which is consumed lazily."""
+    seen = self._seen
+    paths = self._paths
+    for ingredient in ingredients:
+      path = sys.intern(ingredientPath(ingredient))
+      if path not in seen:
+        seen.add(path)
+        paths.append(path)
+
+  def paths(self):
+    """Get all ingredients as posix path strings, in the order they were added."""
+    return iter(self._paths)
+
+  def sort(self, key):
+    """Reorder the ingredients by `key`, which is called with posix path strings. The sort is stable."""
+    self._paths.sort(key=key)
+
+  def __getstate__(self):
+    # The set is redundant, leave it out to keep pickling to other processes cheap.
+    return self._paths
+
+  def __setstate__(self, state):
+    self._paths = [sys.intern(path) for path in state]
+    self._seen = set(self._paths)
+
+  def __contains__(self, ingredient):
+    return ingredientPath(ingredient) in self._seen
+
+  def __iter__(self):
+    for path in self._paths:
+      yield Path(path)
+
+  def __len__(self):
+    return len(self._paths)
+
+  def __eq__(self, other):
+    if isinstance(other, IngredientSet):
+      return self._seen == other._seen
+    if isinstance(other, (set, frozenset)):
+      return self._seen == set(ingredientPath(ingredient) for ingredient in other)
+    return NotImplemented
+
+  def __repr__(self):
+    return "IngredientSet({})".format(self._paths)
+
+
+# Which recipe the current thread runs while `Pot.runRecipes` runs recipes concurrently, see `recipeOrderKeys`.
+_concurrentRecipe = threading.local()
+
+
+def recipeOrderKeys(count):
+  """
+  Get keys that sort `count` ingredients the current thread adds in the order a serial run of the recipes would add them.
+
+  :return: A list of (recipe index, number of ingredients added before) tuples, or None outside of a concurrent recipe.
+  """
+  recipeIndex = getattr(_concurrentRecipe, "recipeIndex", None)
+  if recipeIndex is None:
+    return None
+  numAdded = _concurrentRecipe.numAdded
+  _concurrentRecipe.numAdded = numAdded + count
+  return [(recipeIndex, numAdded + i) for i in range(count)]
 
 
 class Pastry(Pastry):
   """
   Oven pastries are special, because they can have ingredients and dependencies.
+
+  Adding ingredients and dependencies is thread-safe.
   """
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
-    self.ingredients = set()
+    self.ingredients = IngredientSet()
     self.dependencies = set()
+    self._lock = threading.Lock()
+    # Maps ingredient paths added by concurrent recipes to the smallest key from `recipeOrderKeys`.
+    self._ingredientOrder = {}
+
+  def __getstate__(self):
+    # Locks can not be pickled, which is needed to bake in other processes.
+    state = dict(self.__dict__)
+    del state["_lock"]
+    del state["_ingredientOrder"]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+    self._ingredientOrder = {}
+
+  def _recordOrder(self, paths, keys):
+    """Remember the order keys of `paths`, see `sortIngredients`. Has to be called with `self._lock` held."""
+    order = self._ingredientOrder
+    for path, key in zip(paths, keys):
+      if path not in order or key < order[path]:
+        order[path] = key
+
+  def sortIngredients(self):
+    """
+    Put ingredients added by concurrent recipes in the order a serial run of the recipes would have added them.
+    Called by `Pot.runRecipes`; ingredients added outside of recipes keep their place in front.
+    """
+    with self._lock:
+      if self._ingredientOrder:
+        order = self._ingredientOrder
+        self.ingredients.sort(key=lambda path: order.get(path, (-1, 0)))
+        self._ingredientOrder = {}
 
   def __iter__(self):
-    yield ("name", str(self.name))
-    yield ("version", str(self.version))
+    yield from super().__iter__()
     if len(self.dependencies):
-      yield ("dependencies", [{"name": dep[0], "version": dep[1]} for dep in self.dependencies])
+      # Sorted, so the same dependencies always give the same pastry.json.
+      yield ("dependencies", [{"name": name, "version": spec}
+                              for name, spec in sorted((name, str(spec)) for name, spec in self.dependencies)])
 
   def addIngredient(self, ing):
     """
     Adds and ingredient to this pastry.
     """
-    self.ingredients.add(Path(ing))
+    keys = recipeOrderKeys(1)
+    with self._lock:
+      self.ingredients.add(ing)
+      if keys is not None:
+        self._recordOrder([ingredientPath(ing)], keys)
+
+  def addIngredients(self, ingredients):
+    """
+    Adds all ingredients from an iterable to this pastry.
+
+    Prefer this over many `addIngredient` calls. `ingredients` may be a generator, e.g. of path strings
+    or `os.DirEntry` objects, and is consumed lazily.
+    """
+    # Collect outside of the lock, so generators that do I/O do not block other threads.
+    batch = IngredientSet(ingredients)
+    keys = recipeOrderKeys(len(batch))
+    with self._lock:
+      self.ingredients.update(batch.paths())
+      if keys is not None:
+        self._recordOrder(batch.paths(), keys)
 
   def addDependency(self, name, versionSpec):
     """
     Adds a dependency to this pastry.
     """
     dep = (str(name), VersionSpec(versionSpec))
-    self.dependencies.add(dep)
+    with self._lock:
+      self.dependencies.add(dep)
 
 
 class Pot:
   """
   Manages new pastries when processing recipes.
+
+  Recipes may use a pot concurrently, see `runRecipes`.
   """
 
   def __init__(self):
     self.pastries = []
+    # Maps (name, version) to the pastries in `self.pastries`.
+    self._lookup = {}
+    # Maps (name, version) to a key that sorts pastries in the order a serial run of the recipes would create them.
+    self._order = {}
+    self._lock = threading.Lock()
+    # Index of the recipe the current thread is running and the number of `get` calls it made so far.
+    self._local = threading.local()
 
   def get(self, name, version):
     """
@@ -53,13 +234,53 @@ class Pot:
     """
     assert name, "Invalid `name`."
     assert version, "Invalid `version`"
-    for p in self.pastries:
-      if p.name == name and p.version == version:
-        return p
+    key = (str(name), Version(version))
+    recipeIndex = getattr(self._local, "recipeIndex", 0)
+    numCalls = getattr(self._local, "numCalls", 0)
+    self._local.numCalls = numCalls + 1
+    with self._lock:
+      order = (recipeIndex, numCalls)
+      if key not in self._order or order < self._order[key]:
+        self._order[key] = order
+      p = self._lookup.get(key)
+      if p is None:
+        p = Pastry(name=name, version=version)
+        self._lookup[key] = p
+        self.pastries.append(p)
+      return p
+
+  def runRecipes(self, recipes, *, jobs=1):
+    """
+    Call all `recipes` with this pot.
 
-    p = Pastry(name=name, version=version)
-    self.pastries.append(p)
-    return p
+    With `jobs` greater than 1, recipes run concurrently in that many threads.
+    `self.pastries` and their ingredients are in the same order afterwards, no matter which recipe finishes first.
+    """
+    def runRecipe(recipeIndex, rcp, concurrent=False):
+      self._local.recipeIndex = recipeIndex
+      self._local.numCalls = 0
+      if concurrent:
+        _concurrentRecipe.recipeIndex = recipeIndex
+        _concurrentRecipe.numAdded = 0
+      try:
+        rcp(self)
+      finally:
+        del self._local.recipeIndex
+        _concurrentRecipe.recipeIndex = None
+
+    if jobs <= 1:
+      for recipeIndex, rcp in enumerate(recipes):
+        runRecipe(recipeIndex, rcp)
+    else:
+      with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(runRecipe, recipeIndex, rcp, True) for recipeIndex, rcp in enumerate(recipes)]
+        for future in futures:
+          # Re-raises exceptions of the recipe.
+          future.result()
+    with self._lock:
+      self.pastries.sort(key=lambda p: self._order[(p.name, p.version)])
+    for p in self.pastries:
+      p.sortIngredients()
 
 
 def writePastryJson(zipFile, pastry):
@@ -69,41 +290,463 @@ def writePastryJson(zipFile, pastry):
   zipFile.writestr("pastry.json", bytes(pastryJSON, "UTF-8"))
 
 
-def writeIngredientsJson(zipFile, pastry):
-  """Helper function of `zipBaker` that writes an ingredients.json file to the given `zipFile`."""
+def writeIngredientsJson(zipFile, pastry, compressions=None, reproducible=False):
+  """
+  Helper function of `zipBaker` that writes an ingredients.json file to the given `zipFile`.
+
+  If `compressions` is given, each ingredient is written as an object with its "path" and the name of its "compression".
+  With `reproducible`, ingredients are sorted by path instead of being in the order they were added.
+  """
   log.info("Writing ingredients.json...")
-  ingredientsJSON = json.dumps(pastry.ingredients, indent=2, sort_keys=True, cls=PastryJSONEncoder)
+  ingredients = list(pastry.ingredients.paths())
+  if reproducible:
+    ingredients.sort()
+  if compressions is not None:
+    ingredients = [{"path": path, "compression": zipCompressionNames[compression]}
+                   for path, compression in sorted(compressions.items())]
+  ingredientsJSON = json.dumps(ingredients, indent=2, sort_keys=True, cls=PastryJSONEncoder)
   zipFile.writestr("ingredients.json", bytes(ingredientsJSON, "UTF-8"))
 
 
-def zipIngredients(zipFile, pastry):
-  """Helper function of `zipBaker` that adds all files in `ingredients` to the `zipFile`"""
+def zipIngredients(zipFile, pastry, compressions=None, reproducible=False):
+  """
+  Helper function of `zipBaker` that adds all files in `ingredients` to the `zipFile`
+
+  `compressions` optionally maps the posix path of an ingredient to the compression used for it.
+  With `reproducible`, ingredients are added sorted by path.
+  """
   log.info("Zipping ingredients...")
-  for ingredient in pastry.ingredients:
-    path = Path(ingredient).as_posix()
+  paths = pastry.ingredients.paths()
+  if reproducible:
+    paths = sorted(paths)
+  for path in paths:
     log.debug(path)
-    zipFile.write(path)
+    if compressions is None:
+      zipFile.write(path)
+    else:
+      zipFile.write(path, compress_type=compressions[path])
+
+
+# Maps the values of `zipCompressionLookup` back to their names.
+zipCompressionNames = {value: name for name, value in zipCompressionLookup.items()}
+
+# Rules for `chooseCompression` that apply to every recipes script.
+# Files with these extensions are compressed already.
+defaultCompressionRules = {extension: "stored" for extension in (
+  ".zip", ".7z", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".rar", ".cab", ".nupkg",
+  ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".ogg", ".mp4", ".dds", ".ktx",
+)}
+
+# Number of bytes read from an ingredient to estimate how well it compresses.
+compressionProbeSize = 64 * 1024
+
+# Ingredients whose probe does not compress below this ratio are stored uncompressed.
+compressionProbeThreshold = 0.9
+
+
+def chooseCompression(path, rules):
+  """
+  Choose the zip compression for the ingredient at `path` when baking with `adaptiveCompression`.
+
+  :param rules: Maps lower case file extensions (".dll") to names from `zipCompressionLookup`.
+                The "*" key sets the compression for compressible files without a rule, "deflated" by default.
+  Files without a rule are stored if a quick compression of their first bytes does not pay off.
+  """
+  extension = Path(path).suffix.lower()
+  if extension in rules:
+    return zipCompressionLookup[rules[extension]]
+  with open(path, "rb") as ingredientFile:
+    sample = ingredientFile.read(compressionProbeSize)
+  if sample and len(zlib.compress(sample, 1)) > len(sample) * compressionProbeThreshold:
+    return zipfile.ZIP_STORED
+  return zipCompressionLookup[rules.get("*", "deflated")]
+
+
+def adaptiveCompressionRules(compressionRules=None):
+  """Combine `defaultCompressionRules` with the `compressionRules` of a recipes script, for `chooseCompression`."""
+  rules = dict(defaultCompressionRules)
+  rules.update((extension.lower(), name) for extension, name in (compressionRules or {}).items())
+  return rules
+
+
+# Maximum number of ingredients per pastry that `planPastries` compresses to estimate size and bake time.
+planSampleFiles = 64
+
+
+def sampleCompressor(compression, archiveFormat=zipArchiveFormat):
+  """Get a function that compresses bytes about as well and as fast as baking with `compression` and `archiveFormat`."""
+  if archiveFormat == tarArchiveFormat:
+    return lambda data: lzma.compress(data, preset=6)
+  if compression == zipfile.ZIP_STORED:
+    return bytes
+  if compression == zipfile.ZIP_BZIP2:
+    return bz2.compress
+  if compression == zipfile.ZIP_LZMA:
+    return lzma.compress
+  return zlib.compress
+
+
+def planPastries(pastries, *, compression, compressionRules=None, archiveFormat=zipArchiveFormat, blobs=False):
+  """
+  Estimate what baking `pastries` would produce, without compressing all ingredients.
+
+  All ingredients are stat'ed to get their raw size. Up to `planSampleFiles` ingredients per pastry,
+  spread evenly over all of them, are read in parts of `compressionProbeSize` bytes and compressed
+  to estimate the compressed size and bake time of the whole pastry.
+  With `blobs`, ingredients are not compressed, only copied to the blob store.
+
+  :return: A dict with a "pastries" list, which has one dict per pastry, and the "total" of all of them.
+  """
+  rules = adaptiveCompressionRules(compressionRules)
+  # Number of pastries each ingredient is part of.
+  usage = {}
+  for pastry in pastries:
+    for path in pastry.ingredients.paths():
+      usage[path] = usage.get(path, 0) + 1
+
+  plans = []
+  for pastry in pastries:
+    sizes = {}
+    missing = []
+    for path in sorted(pastry.ingredients.paths()):
+      try:
+        sizes[path] = os.stat(path).st_size
+      except OSError:
+        missing.append(path)
+    rawSize = sum(sizes.values())
+    paths = sorted(sizes)
+    sample = paths[::max(1, len(paths) // planSampleFiles)][:planSampleFiles]
+    sampledSize = 0
+    compressedSize = 0
+    seconds = 0.0
+    for path in sample:
+      if blobs:
+        compress = bytes
+      elif compression == adaptiveCompression and archiveFormat != tarArchiveFormat:
+        compress = sampleCompressor(chooseCompression(path, rules))
+      else:
+        compress = sampleCompressor(compression, archiveFormat)
+      start = time.perf_counter()
+      with open(path, "rb") as ingredientFile:
+        data = ingredientFile.read(compressionProbeSize)
+      compressedSize += len(compress(data))
+      seconds += time.perf_counter() - start
+      sampledSize += len(data)
+    ratio = compressedSize / sampledSize if sampledSize else 1.0
+    plans.append({
+      "name": pastry.name,
+      "version": str(pastry.version),
+      "files": len(sizes),
+      "rawSize": rawSize,
+      "missing": missing,
+      "duplicates": [path for path in paths if usage[path] > 1],
+      "sampledFiles": len(sample),
+      "estimatedSize": int(rawSize * ratio),
+      "estimatedSeconds": rawSize * seconds / sampledSize if sampledSize else 0.0,
+    })
+
+  total = {key: sum(plan[key] for plan in plans) for key in ("files", "rawSize", "estimatedSize", "estimatedSeconds")}
+  total["pastries"] = len(plans)
+  total["uniqueFiles"] = len(usage)
+  return {"pastries": plans, "total": total}
+
+
+def logPlan(plan):
+  """Print the result of `planPastries`."""
+  with LogBlock("Plan"):
+    for pastry in plan["pastries"]:
+      log.success("{name} {version}: {files} files, {raw} raw, ~{estimated} baked, ~{seconds:.1f}s".format(
+        raw=formatSize(pastry["rawSize"]), estimated=formatSize(pastry["estimatedSize"]),
+        seconds=pastry["estimatedSeconds"], **pastry))
+      if pastry["duplicates"]:
+        log.info("  {} ingredients are also part of other pastries.".format(len(pastry["duplicates"])))
+        for path in pastry["duplicates"]:
+          log.debug("  {}".format(path))
+      for path in pastry["missing"]:
+        log.warning("  Missing ingredient: {}".format(path))
+    total = plan["total"]
+    log.success("Total: {pastries} pastries, {files} files ({uniqueFiles} unique), {raw} raw, ~{estimated} baked, "
+                "~{seconds:.1f}s".format(raw=formatSize(total["rawSize"]), estimated=formatSize(total["estimatedSize"]),
+                                         seconds=total["estimatedSeconds"], **total))
+
+
+# Name of the file in the output directory that stores the fingerprints of all baked pastries.
+fingerprintsFileName = "fingerprints.json"
+
+# Name of the file in the output directory that stores the directory listings of `PyBake.scanner.scanner`.
+scannerIndexFileName = "scanner.json"
+
+
+def fingerprintPastry(pastry, *, compression, contentHash=False):
+  """
+  Compute a digest of everything that goes into the pastry file of `pastry`.
+
+  Covers name, version, dependencies, `compression`, and the path, size and modification time of each ingredient.
+  If `contentHash` is `True`, the contents of all ingredients are hashed as well.
+  """
+  digest = sha1()
+
+  def update(*values):
+    digest.update(bytes("\0".join(str(value) for value in values) + "\n", "UTF-8"))
+
+  update(pastry.name, pastry.version, compression)
+  for name, spec in sorted((str(name), str(spec)) for name, spec in pastry.dependencies):
+    update("dependency", name, spec)
+  for path in sorted(pastry.ingredients.paths()):
+    try:
+      stat = os.stat(path)
+    except OSError:
+      update("missing", path)
+      continue
+    update("ingredient", path, stat.st_size, stat.st_mtime_ns)
+    if contentHash:
+      with open(path, "rb") as ingredientFile:
+        for chunk in iter(lambda: ingredientFile.read(1024 * 1024), b""):
+          digest.update(chunk)
+  return digest.hexdigest()
+
+
+def loadFingerprints(filePath):
+  """Load the fingerprints of baked pastries, as written by `saveFingerprints`."""
+  filePath = Path(filePath)
+  if not filePath.exists():
+    return {}
+  with filePath.open("r") as fingerprintsFile:
+    try:
+      return json.load(fingerprintsFile)
+    except ValueError:
+      log.warning("Ignoring malformed fingerprints file: {}".format(filePath.as_posix()))
+      return {}
+
+
+def saveFingerprints(filePath, fingerprints):
+  """
+  Save the fingerprints of baked pastries.
+  Maps `str(pastry)` to a dict with the "stat" and the "content" fingerprint (or `None`), see `fingerprintPastry`.
+  """
+  filePath = Path(filePath)
+  tempFilePath = filePath.with_name("{}.{}.tmp".format(filePath.name, os.getpid()))
+  with tempFilePath.open("w") as fingerprintsFile:
+    json.dump(fingerprints, fingerprintsFile, indent=2, sort_keys=True)
+  os.replace(tempFilePath.as_posix(), filePath.as_posix())
+
+
+def writeBlobs(zipFile, pastry, blobStore):
+  """
+  Helper function of `zipBaker` that adds all files in `ingredients` to the `blobStore`,
+  and writes an ingredients.json file that refers to them to the given `zipFile`.
+  """
+  log.info("Storing ingredients as blobs...")
+  ingredients = []
+  for path in pastry.ingredients.paths():
+    log.debug(path)
+    ingredients.append({"path": ingredientArcName(path), "blob": blobStore.add(path), "size": os.path.getsize(path)})
+  ingredients.sort(key=lambda entry: entry["path"])
+  log.info("Writing ingredients.json...")
+  ingredientsJSON = json.dumps(ingredients, indent=2, sort_keys=True)
+  zipFile.writestr("ingredients.json", bytes(ingredientsJSON, "UTF-8"))
+
+
+def solidOrder(path):
+  """Sort key for ingredients in solid archives, which puts similar files next to each other."""
+  return (os.path.splitext(path)[1].lower(), os.path.basename(path), path)
+
+
+def bakePastry(zipFilePath, pastry, compression, compressionRules=None, blobsDirPath=None, archiveFormat=zipArchiveFormat,
+               reproducible=False):
+  """
+  Create the archive at `zipFilePath` for the given `pastry`.
+
+  If `compression` is `adaptiveCompression`, it is chosen per ingredient with `chooseCompression` and `compressionRules`.
+  If `blobsDirPath` is given, ingredients are stored in the `BlobStore` there instead of the archive.
+  If `archiveFormat` is `tarArchiveFormat`, a solid xz compressed tar file is created and `compression` is ignored.
+  With `reproducible`, the same ingredients always give a byte identical archive, see `PyBake.archive`.
+  """
+  if archiveFormat == tarArchiveFormat:
+    with TarWriter(zipFilePath, reproducible=reproducible) as archive:
+      writePastryJson(archive, pastry)
+      if blobsDirPath is not None:
+        writeBlobs(archive, pastry, BlobStore(blobsDirPath))
+        return
+      writeIngredientsJson(archive, pastry, reproducible=reproducible)
+      log.info("Archiving ingredients...")
+      for path in sorted(pastry.ingredients.paths(), key=solidOrder):
+        log.debug(path)
+        archive.write(path)
+    return
+  zipFileClass = ReproducibleZipFile if reproducible else zipfile.ZipFile
+  if blobsDirPath is not None:
+    with zipFileClass(Path(zipFilePath).as_posix(), "w", compression=zipfile.ZIP_DEFLATED) as zipFile:
+      writePastryJson(zipFile, pastry)
+      writeBlobs(zipFile, pastry, BlobStore(blobsDirPath))
+    return
+  compressions = None
+  if compression == adaptiveCompression:
+    rules = adaptiveCompressionRules(compressionRules)
+    compressions = {}
+    for path in pastry.ingredients.paths():
+      compressions[path] = chooseCompression(path, rules)
+    compression = zipCompressionLookup[rules.get("*", "deflated")]
+  with zipFileClass(Path(zipFilePath).as_posix(), "w", compression=compression) as zipFile:
+    writePastryJson(zipFile, pastry)
+    writeIngredientsJson(zipFile, pastry, compressions, reproducible)
+    zipIngredients(zipFile, pastry, compressions, reproducible)
+
+
+def bakePastryJob(zipFilePath, pastry, compression, compressionRules, blobsDirPath, archiveFormat, reproducible,
+                  verbosity):
+  """
+  Runs `bakePastry` in a worker process of `zipBaker`.
+
+  Log messages are not printed but returned, so the parent process can print them in one piece.
+  :return: A tuple of the recorded log messages and the exception that was raised, which is `None` on success.
+  """
+  sink = BufferedLogSink()
+  log.sinks = [sink]
+  log.verbosity = verbosity
+  try:
+    bakePastry(zipFilePath, pastry, compression, compressionRules, blobsDirPath, archiveFormat, reproducible)
+  except Exception as ex:
+    return sink.records, ex
+  return sink.records, None
+
+
+def addBakedPastry(menu, pastry, existing, zipFilePath):
+  """
+  Helper function of `zipBaker` that puts a freshly baked `pastry` on the `menu`, along with the digest of its file.
+  Replaces the `existing` entry, if any, so the new digest is saved.
+  """
+  pastry.digest = archiveDigest(zipFilePath)
+  log.debug("Digest: {}".format(pastry.digest))
+  if existing:
+    menu.remove(existing)
+  menu.add(pastry)
 
 
 def zipBaker(*, menu, pot, force=False, options):
-  """Processes ingredients in a pot and creates pastries from that."""
-  with LogBlock("Baking Pastries (Zip)"):
+  """
+  Processes ingredients in a pot and creates pastries from that.
+
+  Pastries that are already on the menu are only baked again with `force`,
+  and only if their fingerprint (see `fingerprintPastry`) changed since they were last baked.
+  Set `options["contentHash"]` to include the contents of all ingredients in the fingerprints.
+  Without `force`, a warning is logged for pastries on the menu whose ingredients changed;
+  their contents are not hashed.
+
+  If `options["compression"]` is `adaptiveCompression`, `options["compressionRules"]` is passed to `chooseCompression`.
+
+  With `options["blobs"]`, ingredients are stored in a `BlobStore` in the "blobs" directory next to the menu.
+
+  With `options["jobs"]` greater than 1, pastries are baked concurrently in that many processes.
+  If baking a pastry fails, the others are still baked and put on the menu, then the first error is raised.
+
+  `options["archiveFormat"]` selects the format of the pastry files, see `tarBaker`.
+
+  With `options["reproducible"]`, the same ingredients always give byte identical pastry files.
+  The SHA-256 digest of each baked pastry file is stored on the menu.
+  """
+  jobs = options.get("jobs", 1) or 1
+  archiveFormat = options.get("archiveFormat", zipArchiveFormat)
+  compression = options["compression"]
+  compressionRules = options.get("compressionRules") or {}
+  blobsDirPath = menu.pastryDirPath / "blobs" if options.get("blobs") else None
+  reproducible = options.get("reproducible", False)
+  fingerprintsFilePath = menu.pastryDirPath / fingerprintsFileName
+  fingerprints = loadFingerprints(fingerprintsFilePath)
+  with LogBlock("Baking Pastries ({})".format(archiveFormat)):
+    orders = []
+    unchanged = []
+    fingerprintOptions = (compression, sorted(compressionRules.items()), blobsDirPath is not None, archiveFormat,
+                          reproducible)
+    contentHash = options.get("contentHash", False)
     for pastry in pot.pastries:
       existing = menu.get(pastry.name, pastry.version)
+      zipFilePath = menu.makePath(pastry)
+      previous = fingerprints.get(str(pastry))
+      if isinstance(previous, str):
+        # Written by an older oven, which only stored one fingerprint.
+        previous = {"stat": previous, "content": None}
       if existing and not force:
+        # Skipped pastries are only checked with the cheap fingerprint, their ingredients are never read.
+        if previous and fingerprintPastry(pastry, compression=fingerprintOptions) != previous["stat"]:
+          log.warning("Ingredients changed, but the pastry is already on the menu (use force to bake it anyway): {}".format(pastry))
         log.debug("Ignoring pastry because it is already on the menu: {}".format(pastry))
         continue
-      menu.add(pastry)
-      zipFilePath = menu.makePath(pastry)
-      with LogBlock("Pastry: {} with {} ingredients -> {}".format(pastry, len(pastry.ingredients), zipFilePath.as_posix())):
-        if existing and force:
-          log.info("Overwriting existing pastry file (force).")
-        with zipfile.ZipFile(zipFilePath.as_posix(), "w", compression=options["compression"]) as zipFile:
-          writePastryJson(zipFile, pastry)
-          writeIngredientsJson(zipFile, pastry)
-          zipIngredients(zipFile, pastry)
+      fingerprint = {
+        "stat": fingerprintPastry(pastry, compression=fingerprintOptions),
+        "content": fingerprintPastry(pastry, compression=fingerprintOptions, contentHash=True) if contentHash else None,
+      }
+      isUnchanged = previous == fingerprint and zipFilePath.exists()
+      if existing and isUnchanged:
+        unchanged.append(pastry)
+        continue
+      orders.append((pastry, existing, zipFilePath, fingerprint))
+
+    if unchanged:
+      with LogBlock("Skipped {} unchanged pastries".format(len(unchanged))):
+        for pastry in unchanged:
+          log.info(pastry)
 
-        log.success("Done baking pastry: {}".format(zipFilePath.as_posix()))
+    baked = 0
+    firstError = None
+    try:
+      if jobs <= 1 or len(orders) <= 1:
+        for pastry, existing, zipFilePath, fingerprint in orders:
+          with LogBlock("Pastry: {} with {} ingredients -> {}".format(pastry, len(pastry.ingredients), zipFilePath.as_posix())):
+            if existing and force:
+              log.info("Overwriting existing pastry file (force).")
+            bakePastry(zipFilePath, pastry, compression, compressionRules, blobsDirPath, archiveFormat, reproducible)
+            addBakedPastry(menu, pastry, existing, zipFilePath)
+            fingerprints[str(pastry)] = fingerprint
+            baked += 1
+            log.success("Done baking pastry: {}".format(zipFilePath.as_posix()))
+      else:
+        log.info("Baking {} pastries with {} jobs.".format(len(orders), jobs))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+          futures = [executor.submit(bakePastryJob, zipFilePath, pastry, compression, compressionRules, blobsDirPath,
+                                     archiveFormat, reproducible, log.verbosity)
+                     for pastry, _, zipFilePath, _ in orders]
+          # Results are processed in order, so the output does not depend on which pastry finishes first.
+          for (pastry, existing, zipFilePath, fingerprint), future in zip(orders, futures):
+            records, error = future.result()
+            with LogBlock("Pastry: {} with {} ingredients -> {}".format(pastry, len(pastry.ingredients), zipFilePath.as_posix())):
+              if existing and force:
+                log.info("Overwriting existing pastry file (force).")
+              replayRecords(records)
+              if error:
+                log.error("Failed baking pastry: {}: {}".format(type(error).__name__, error))
+                # Like the serial path, fail the whole bake, but only after all other pastries are done.
+                firstError = firstError or error
+                continue
+              # The menu is only updated by this process.
+              addBakedPastry(menu, pastry, existing, zipFilePath)
+              fingerprints[str(pastry)] = fingerprint
+              baked += 1
+              log.success("Done baking pastry: {}".format(zipFilePath.as_posix()))
+    finally:
+      if baked:
+        saveFingerprints(fingerprintsFilePath, fingerprints)
+    if firstError:
+      raise firstError
+    log.success("Baked {} pastries, skipped {} unchanged pastries.".format(baked, len(unchanged)))
+
+
+def tarBaker(*, menu, pot, force=False, options):
+  """
+  Like `zipBaker`, but creates solid xz compressed tar files.
+
+  Compresses many small similar files, like headers, much better than zip files.
+  """
+  options = dict(options)
+  options["archiveFormat"] = tarArchiveFormat
+  return zipBaker(menu=menu, pot=pot, force=force, options=options)
+
+
+# Maps the values of the `--format` option of the oven command to baker functions.
+bakers = {
+  zipArchiveFormat: zipBaker,
+  tarArchiveFormat: tarBaker,
+}
 
 
 def run(*,                   # Keyword arguments only.
@@ -112,6 +755,9 @@ def run(*,                   # Keyword arguments only.
         output,              # Directory that will contain all resulting pastries.
         force,               # Overwrite existing pastries.
         bakerFunc=zipBaker,  # Processes ingredients and creates a pastry.
+        recipeJobs=1,        # Number of threads that run recipes concurrently.
+        plan=False,          # Only print what would be baked, see `planPastries`.
+        planJson=None,       # Path to write the plan to as JSON. Implies `plan`.
         **kwargs):           # kwargs passed as `options` to the `bakerFunc`.
   """Run the oven command."""
   with LogBlock("Oven"):
@@ -131,22 +777,42 @@ def run(*,                   # Keyword arguments only.
         log.debug("Full path: {}".format(recipes_script.as_posix()))
         log.debug("Working dir: {}".format(working_dir.as_posix()))
         # Import the user script.
-        importFromFile(recipes_script)
+        recipesModule = importFromFile(recipes_script)
+        # Optional extension rules for adaptive compression.
+        kwargs.setdefault("compressionRules", try_getattr(recipesModule, ("compressionRules",), default_value={}))
 
       if len(recipes) == 0:
         log.error("No recipes found. Make sure to create functions in your script and decorate them with @recipe.")
         return 2
 
       with LogBlock("Processing Recipes"):
+        # Directory listings of previous runs let recipes skip unchanged directories.
+        scanner.loadIndex(output / scannerIndexFileName)
         # Create an empty pot.
         pot = Pot()
-        for rcp in recipes:
-          # Call the recipe with our pot.
-          rcp(pot)
+        # Call the recipes with our pot.
+        pot.runRecipes(recipes, jobs=recipeJobs)
+        scanner.saveIndex()
+
+      if plan or planJson:
+        result = planPastries(pot.pastries,
+                              compression=kwargs["compression"],
+                              compressionRules=kwargs["compressionRules"],
+                              archiveFormat=kwargs.get("archiveFormat", zipArchiveFormat),
+                              blobs=kwargs.get("blobs", False))
+        logPlan(result)
+        if planJson:
+          with Path(planJson).open("w") as planFile:
+            json.dump(result, planFile, indent=2, sort_keys=True)
+          log.info("Plan written to: {}".format(Path(planJson).as_posix()))
+        return 0
 
       menu = Menu(output)
       log.info("Menu file path: {}".format(menu.filePath.as_posix()))
       menu.load()
       # All ingredients are collected in the pot now, so the baker can start working.
-      bakerFunc(menu=menu, force=force, pot=pot, options=kwargs)
-      menu.save()
+      try:
+        bakerFunc(menu=menu, force=force, pot=pot, options=kwargs)
+      finally:
+        # Keeps the pastries that were baked before a failure, they match the saved fingerprints.
+        menu.save()
@@ -0,0 +1,174 @@
+"""
+Cached file system scanner for recipes.
+
+Use the global `scanner` instead of `Path.glob` and `Path.rglob` in recipes:
+
+  from PyBake.scanner import scanner
+
+  @recipe
+  def get_header_files(pot):
+    pastry = pot.get("foo", "0.1.0")
+    pastry.addIngredients(scanner.rglob("Code", "*.h"))
+
+Every directory is listed at most once per oven run, no matter how many patterns are matched against it.
+The oven persists the listings in an index next to the menu. In the next run, a directory is only listed again
+if its modification time changed, which is the case whenever entries are added, removed or renamed in it.
+"""
+
+from fnmatch import fnmatch
+import json
+import os
+import threading
+
+from PyBake import Path
+from PyBake.logger import log
+
+
+class Scanner:
+  """
+  Answers glob patterns from cached directory listings. Thread-safe.
+
+  Results are posix path strings, starting with the `root` that was passed in,
+  just like `str(path)` of the results of `Path(root).glob(pattern)` would on posix systems.
+  """
+
+  indexFormatVersion = 2
+
+  def __init__(self, indexFilePath=None):
+    # Maps absolute directory paths to (mtime in ns, sorted file names, sorted directory names, sorted names of the
+    # directories that are symlinks). Symlinked directories are also in the directory names.
+    self._index = {}
+    # Directories that were validated in this run.
+    self._fresh = set()
+    self._lock = threading.Lock()
+    self.indexFilePath = None
+    self.numListed = 0
+    self.numReused = 0
+    if indexFilePath:
+      self.loadIndex(indexFilePath)
+
+  def loadIndex(self, indexFilePath):
+    """Use the persisted index at `indexFilePath`, if it exists, and save to it in `saveIndex`."""
+    self.indexFilePath = Path(indexFilePath)
+    with self._lock:
+      self._index = {}
+      self._fresh = set()
+      self.numListed = 0
+      self.numReused = 0
+      if not self.indexFilePath.exists():
+        return
+      try:
+        with self.indexFilePath.open("r") as indexFile:
+          data = json.load(indexFile)
+      except ValueError:
+        log.warning("Ignoring malformed scanner index: {}".format(self.indexFilePath.as_posix()))
+        return
+      if data.get("version") != Scanner.indexFormatVersion:
+        return
+      self._index = {dirPath: tuple(listing) for dirPath, listing in data["dirs"].items()}
+
+  def saveIndex(self):
+    """Persist the listings of all directories that were validated in this run."""
+    if self.indexFilePath is None:
+      return
+    with self._lock:
+      dirs = {dirPath: self._index[dirPath] for dirPath in self._fresh}
+    tempFilePath = self.indexFilePath.with_name("{}.{}.tmp".format(self.indexFilePath.name, os.getpid()))
+    with tempFilePath.open("w") as indexFile:
+      json.dump({"version": Scanner.indexFormatVersion, "dirs": dirs}, indexFile)
+    os.replace(tempFilePath.as_posix(), self.indexFilePath.as_posix())
+    log.info("Scanner listed {} directories and reused {} cached listings.".format(self.numListed, self.numReused))
+
+  def _listing(self, dirPath):
+    """Get the (mtime, files, dirs, symlinked dirs) listing of the directory at `dirPath`."""
+    key = os.path.abspath(dirPath)
+    with self._lock:
+      if key in self._fresh:
+        return self._index[key]
+      cached = self._index.get(key)
+    try:
+      mtime = os.stat(key).st_mtime_ns
+    except OSError:
+      return (0, (), (), ())
+    if cached and cached[0] == mtime:
+      listing = cached
+      reused = True
+    else:
+      files = []
+      dirs = []
+      symlinkedDirs = []
+      try:
+        with os.scandir(key) as entries:
+          for entry in entries:
+            if entry.is_dir():
+              dirs.append(entry.name)
+              if entry.is_symlink():
+                symlinkedDirs.append(entry.name)
+            else:
+              files.append(entry.name)
+      except OSError:
+        pass
+      listing = (mtime, sorted(files), sorted(dirs), sorted(symlinkedDirs))
+      reused = False
+    with self._lock:
+      if key not in self._fresh:
+        self._fresh.add(key)
+        self._index[key] = listing
+        if reused:
+          self.numReused += 1
+        else:
+          self.numListed += 1
+      return self._index[key]
+
+  def glob(self, root, pattern, *, files=True, dirs=True):
+    """
+    Like `Path(root).glob(pattern)`, but returns a list of posix path strings.
+
+    "**" matches any number of directories. It is not supported as the last part of the pattern.
+    :param files: Include matching files.
+    :param dirs: Include matching directories.
+    """
+    rootPath = Path(root).as_posix()
+    prefix = "" if rootPath == "." else rootPath.rstrip("/") + "/"
+    parts = [part for part in pattern.replace("\\", "/").split("/") if part not in ("", ".")]
+    result = []
+    self._match(rootPath, prefix, parts, result, files, dirs)
+    if parts.count("**") > 1:
+      result = list(dict.fromkeys(result))
+    return result
+
+  def rglob(self, root, pattern, *, files=True, dirs=True):
+    """Like `Path(root).rglob(pattern)`, but returns a list of posix path strings. See `glob`."""
+    return self.glob(root, "**/" + pattern, files=files, dirs=dirs)
+
+  def _match(self, dirPath, prefix, parts, result, wantFiles, wantDirs):
+    if not parts:
+      return
+    part, rest = parts[0], parts[1:]
+    _, fileNames, dirNames, symlinkedDirNames = self._listing(dirPath)
+    if part == "**":
+      # "**" matches no directory at all, ...
+      self._match(dirPath, prefix, rest, result, wantFiles, wantDirs)
+      # ... or any sub directory. Like `Path.rglob`, it does not recurse into symlinked directories.
+      for name in dirNames:
+        if name in symlinkedDirNames:
+          continue
+        self._match(os.path.join(dirPath, name), prefix + name + "/", parts, result, wantFiles, wantDirs)
+    elif rest:
+      for name in dirNames:
+        if fnmatch(name, part):
+          self._match(os.path.join(dirPath, name), prefix + name + "/", rest, result, wantFiles, wantDirs)
+    else:
+      if wantDirs:
+        result.extend(prefix + name for name in dirNames if fnmatch(name, part))
+      if wantFiles:
+        result.extend(prefix + name for name in fileNames if fnmatch(name, part))
+
+  def isDir(self, path):
+    """Whether `path` is a directory, using the cached listing of its parent if possible."""
+    parent, name = os.path.split(os.path.abspath(str(path)))
+    return name in self._listing(parent)[2]
+
+
+# The scanner the oven sets up for recipes.
+scanner = Scanner()
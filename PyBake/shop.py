@@ -2,47 +2,297 @@
 Serving pastries to customers, fresh from the oven!
 """
 
-from flask import Flask, request, session, g, redirect, url_for, abort, \
-    render_template, flash, jsonify, send_from_directory, make_response
-
+from flask import Flask, Request, Response, request, session, g, redirect, url_for, abort, \
+    render_template, flash, jsonify, send_from_directory, make_response, current_app
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator, FileWrapper
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache, partial
+import hashlib
 import json
-
-from PyBake import Path, Menu, Pastry, try_getattr, defaultPastriesDir
+import os
+import re
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from PyBake import Path, Menu, Pastry, Version, try_getattr, defaultPastriesDir
 from PyBake.logger import log, LogBlock, ScopedLogSink
+from PyBake.blobs import BlobStore, isBlobEntry
+from PyBake.archive import readArchiveMember, archiveDigest
+from PyBake.metadata import MetadataIndex
+from PyBake.metrics import MetricsRegistry, contentType as metricsContentType
 from importlib import import_module
 import textwrap
 
 
-def processPastryUpload(menu, pastry, pastryFile, *, forceUpload):
+# Maximum number of resolved pastries each shop keeps in memory, see `Shop`.
+hotPastryCacheSize = 1024
+
+# Blob digests are hex encoded SHA-1 hashes.
+blobDigestPattern = re.compile(r"^[0-9a-f]{40}$")
+
+
+def isValidBlobDigest(digest):
+  """Whether `digest` is a well-formed blob digest, which makes it safe to use in a file path."""
+  return isinstance(digest, str) and blobDigestPattern.match(digest) is not None
+
+
+def missingPastryBlobs(pastryPath, blobStore):
+  """Get the digests of all blobs the pastry at `pastryPath` refers to that are not in the `blobStore`."""
+  ingredientsBytes = readArchiveMember(pastryPath, "ingredients.json")
+  if ingredientsBytes is None:
+    return []
+  ingredients = json.loads(ingredientsBytes.decode("UTF-8"))
+  return blobStore.missing(sorted(set(entry["blob"] for entry in ingredients if isBlobEntry(entry))))
+
+
+def currentUmask():
+  """Get the umask of this process. Changes it for a moment, so only call this while no other threads create files."""
+  umask = os.umask(0)
+  os.umask(umask)
+  return umask
+
+
+# Published pastries get the permissions files created with `open` would get, see `PastrySpool`.
+pastryFileMode = 0o666 & ~currentUmask()
+
+
+class PastrySpool:
+  """
+  A temporary file in the pastries directory that an upload is streamed to.
+  The SHA-256 digest of everything written is computed on the way, so the file does not have to be read again.
+
+  Until `publish` renamed it to its final path, closing the spool deletes the file.
+  The file gets `pastryFileMode` instead of the owner-only permissions of `tempfile.mkstemp`, so published pastries
+  can be read by others, e.g. a front server that serves the pastries directory.
+  """
+
+  def __init__(self, dirPath):
+    fd, filePath = tempfile.mkstemp(prefix=".upload-", suffix=".tmp", dir=Path(dirPath).as_posix())
+    os.chmod(filePath, pastryFileMode)
+    self.filePath = Path(filePath)
+    self._file = os.fdopen(fd, "w+b")
+    self._hash = hashlib.sha256()
+    self._published = False
+
+  def __getattr__(self, name):
+    return getattr(self._file, name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  @property
+  def digest(self):
+    """Hex encoded SHA-256 digest of all data written so far."""
+    return self._hash.hexdigest()
+
+  def write(self, data):
+    self._hash.update(data)
+    return self._file.write(data)
+
+  def publish(self, targetPath):
+    """Atomically move the received file to `targetPath`, replacing any existing file."""
+    self._file.close()
+    os.replace(self.filePath.as_posix(), Path(targetPath).as_posix())
+    self._published = True
+
+  def close(self):
+    self._file.close()
+    if not self._published and self.filePath.exists():
+      self.filePath.unlink()
+
+
+class ShopRequest(Request):
+  """
+  Streams the file of a pastry upload into a `PastrySpool` in the directory `PASTRY_SPOOL_DIR` of the app config,
+  instead of keeping it in memory or in the system temp directory.
+  """
+
+  def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+    if self.endpoint == "upload_pastry":
+      return PastrySpool(current_app.config["PASTRY_SPOOL_DIR"])
+    return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+class ShopResponse(Response):
+  """
+  Runs the `call_on_close` functions once the body was sent, also for files that are passed through to the server.
+  Werkzeug only runs them for bodies it iterates itself, but the server has to get a `SendfileWrapper` unchanged.
+  """
+
+  def get_app_iter(self, environ):
+    appIter = super().get_app_iter(environ)
+    if not (self.direct_passthrough and appIter is self.response):
+      return appIter
+    if not hasattr(appIter, "close"):
+      return ClosingIterator(appIter, self.close)
+
+    def close():
+      # `Response.close` closes the body with its own close method.
+      del appIter.close
+      self.close()
+    appIter.close = close
+    return appIter
+
+
+def checkPastryArchive(filePath, pastry):
+  """
+  Check that the file at `filePath` is a pastry archive with a pastry.json that describes `pastry`.
+  :return: An error message, or `None` if the archive is fine.
+  """
+  try:
+    pastryBytes = readArchiveMember(filePath, "pastry.json")
+  except Exception as ex:
+    return "Pastry file is not a valid archive: {}".format(ex)
+  if pastryBytes is None:
+    return "Pastry file does not contain a pastry.json"
+  try:
+    archivedPastry = Pastry(data=json.loads(pastryBytes.decode("UTF-8")))
+  except (ValueError, KeyError, TypeError) as ex:
+    return "Invalid pastry.json: {}".format(ex)
+  if archivedPastry != pastry:
+    return "Uploaded pastry and the pastry.json inside it do not match: {} vs. {}".format(pastry, archivedPastry)
+  return None
+
+
+def processPastryUpload(menu, pastry, pastryFile, *, forceUpload, blobStore=None, metadataIndex=None, menuLock=None):
+  """
+  Save an uploaded pastry and put it on the menu.
+
+  The upload is received in a `PastrySpool` in the pastries directory. If `pastryFile` was not already streamed
+  into one by `ShopRequest`, it is copied there. Only when its pastry.json matches `pastry` and all of its blobs are
+  present, it is renamed to its final path, so a concurrent download never sees a partially written pastry.
+  The menu entry is added after that. If a `metadataIndex` is given, the metadata of the pastry is added to it
+  before the pastry is published.
+
+  `menuLock` guards all accesses to the `menu` if the shop serves requests concurrently.
+  It is not held while the pastry file is received.
+  """
+  menuLock = menuLock or nullcontext()
   log.info("Pastry: {}".format(pastry))
-  existing = menu.get(pastry.name, pastry.version)
+  with menuLock:
+    existing = menu.get(pastry.name, pastry.version)
   if existing and not forceUpload:
     log.info("Pastry already exists. Ignoring.")
     return
   if existing and forceUpload:
     log.info("Forced upload.")
-  # Get the target path on the local system for the pastry.
-  pastryPath = menu.makePath(pastry)
-  log.info("Saving pastry to: {}".format(pastryPath.as_posix()))
-  # Try saving the pastry.
-  pastryFile.save(pastryPath.as_posix())
-  # Add that pastry to the menu.
-  menu.add(pastry)
-  # Make sure the menu database is up to date.
-  menu.save()
+  spool = pastryFile.stream
+  if not isinstance(spool, PastrySpool):
+    spool = PastrySpool(menu.pastryDirPath)
+    shutil.copyfileobj(pastryFile.stream, spool)
+  with spool:
+    spool.flush()
+    error = checkPastryArchive(spool.filePath, pastry)
+    if error:
+      log.error(error)
+      return
+    if blobStore:
+      missing = missingPastryBlobs(spool.filePath, blobStore)
+      if missing:
+        log.error("Pastry refers to {} blobs that were not uploaded, e.g. {}".format(len(missing), missing[0]))
+        return
+    # Lets clients validate downloads, see `sendPastry`.
+    pastry.digest = spool.digest
+    if metadataIndex:
+      metadataIndex.add(pastry.digest, spool.filePath)
+    # Get the target path on the local system for the pastry.
+    pastryPath = menu.makePath(pastry)
+    log.info("Saving pastry to: {}".format(pastryPath.as_posix()))
+    spool.publish(pastryPath)
+  with menuLock:
+    existing = menu.get(pastry.name, pastry.version)
+    if existing:
+      # Replace the entry, so its digest is updated.
+      menu.remove(existing)
+    # Add that pastry to the menu.
+    menu.add(pastry)
+    # Make sure the menu database is up to date. Other worker processes pick it up with `Menu.refresh`.
+    menu.save()
+  if existing and metadataIndex and existing.digest and existing.digest != pastry.digest:
+    # No file with the old digest is left.
+    metadataIndex.remove(existing.digest)
 
 
-def getPastry(menu, pastryName, pastryVersionSpec):
+def resolvePastries(menu, shoppingList, *, dependencies, menuLock=None):
   """
-  Retrieve a pastry with the given name and version spec.
+  Resolve the pastries of a shopping list and all their dependencies to concrete pastries on the `menu`.
+
+  Each (name, version spec) pair is resolved once, to the best matching pastry, like `Menu.get` does.
+
+  :param shoppingList: A list of dicts with the "name" and "version" spec of a pastry.
+  :param dependencies: Called with the menu and a pastry to get a list of dicts with the "name" and "version" spec of
+                       each of its dependencies. Returns `None` if the file of the pastry is missing, which is
+                       reported as an error.
+  :param menuLock: Guards all accesses to the `menu`, see `processPastryUpload`.
+  :return: A tuple of the resolved pastries in the order they were found, a list of dicts with the "name", "spec"
+           and resolved "version" of each requested pair, and a list of error messages.
   """
-  with LogBlock("Finding Pastry {} with version spec {}".format(pastryName, pastryVersionSpec)):
-    pastry = menu.get(pastryName, pastryVersionSpec)
+  menuLock = menuLock or nullcontext()
+  pastries = {}
+  resolved = []
+  errors = []
+  pending = [(entry["name"], str(entry["version"])) for entry in shoppingList]
+  visited = set()
+  while pending:
+    name, spec = pending.pop(0)
+    if (name, spec) in visited:
+      continue
+    visited.add((name, spec))
+    try:
+      with menuLock:
+        pastry = menu.get(name, spec)
+    except ValueError as ex:
+      errors.append("Invalid version spec for pastry {}: {}".format(name, ex))
+      continue
     if not pastry:
-      log.error("Pastry not found.")
-      return
-    log.dev("Pastry '{}' found at: {}".format(pastry, menu.makePath(pastry).as_posix()))
-    return pastry
+      errors.append("Pastry not found: {} {}".format(name, spec))
+      continue
+    resolved.append({"name": name, "spec": spec, "version": str(pastry.version)})
+    key = (pastry.name, str(pastry.version))
+    if key in pastries:
+      continue
+    pastryDeps = dependencies(menu, pastry)
+    if pastryDeps is None:
+      errors.append("Pastry file is missing: {}".format(pastry))
+      # Report each pastry only once.
+      pastries[key] = None
+      continue
+    pastries[key] = pastry
+    pending.extend((dep["name"], str(dep["version"])) for dep in pastryDeps)
+  return [pastry for pastry in pastries.values() if pastry is not None], resolved, errors
+
+
+def sendPastry(pastry, pastryPath):
+  """
+  Create the response that sends the file of `pastry` at `pastryPath`.
+
+  The pastry digest is used as strong ETag, if it is known. If the client already has the pastry
+  (`If-None-Match`), only a 304 response is sent, for POST requests as well.
+  GET requests may ask for a `Range` of the file to resume interrupted downloads;
+  `If-Range` makes sure the file did not change in the meantime.
+  """
+  if pastry.digest and request.if_none_match.contains(pastry.digest):
+    log.info("Pastry not modified: {}".format(pastry))
+    response = make_response("", 304)
+    response.set_etag(pastry.digest)
+  else:
+    log.info("Sending file: {}".format(pastryPath.as_posix()))
+    response = make_response(send_from_directory(pastryPath.parent.as_posix(), pastryPath.name,
+                                                 etag=pastry.digest or True))
+  response.headers["X-Pastry-Version"] = str(pastry.version)
+  if pastry.digest:
+    response.headers["X-Pastry-Digest"] = pastry.digest
+  return response
 
 
 def Shop(*, menu, name=__name__):
@@ -50,6 +300,8 @@ def Shop(*, menu, name=__name__):
   with LogBlock("Creating Shop Instance"):
     # create our little application :)
     app = Flask(name)
+    app.request_class = ShopRequest
+    app.response_class = ShopResponse
 
     # Load default config and override config from an environment variable
     app.config.update(dict(
@@ -57,21 +309,211 @@ def Shop(*, menu, name=__name__):
       DEBUG=True,
       SECRET_KEY='development key',
       USERNAME='admin',
-      PASSWORD='default'
+      PASSWORD='default',
+      # Uploaded pastries are received here, so they can be renamed into place.
+      PASTRY_SPOOL_DIR=menu.pastryDirPath.as_posix(),
     ))
     app.config.from_envvar('FLASKR_SETTINGS', silent=True)
 
+    blobStore = BlobStore(menu.pastryDirPath / "blobs")
+    metadataIndex = MetadataIndex(menu.pastryDirPath / "metadata")
+    # Requests may be served concurrently, but the menu is not thread-safe.
+    menuLock = threading.RLock()
+
+    def withDigest(pastry):
+      """Compute and store the digest of a pastry that was put on the menu without one, e.g. by an older shop."""
+      if pastry.digest:
+        return pastry
+      digest = archiveDigest(menu.makePath(pastry))
+      with menuLock:
+        if menu.remove(pastry):
+          pastry.digest = digest
+          menu.add(pastry)
+          menu.save()
+      return pastry
+
+    # Metrics of this shop, served by `/metrics`.
+    metrics = MetricsRegistry()
+    requestCount = metrics.counter("pybake_shop_requests_total", "Number of handled requests.",
+                                   labels=("endpoint", "status"))
+    requestDuration = metrics.histogram("pybake_shop_request_duration_seconds",
+                                        "Time to handle requests, including sending the response body.",
+                                        labels=("endpoint",))
+    requestsInFlight = metrics.gauge("pybake_shop_requests_in_flight", "Number of requests being handled.",
+                                     labels=("endpoint",))
+    receivedBytes = metrics.counter("pybake_shop_request_bytes_total", "Size of request bodies.", labels=("endpoint",))
+    sentBytes = metrics.counter("pybake_shop_response_bytes_total", "Size of response bodies.", labels=("endpoint",))
+    uploadDuration = metrics.histogram("pybake_shop_upload_seconds",
+                                       "Time to receive uploaded pastries, and to check, index and publish them.",
+                                       labels=("phase",))
+    menuLookupDuration = metrics.histogram("pybake_shop_menu_lookup_seconds",
+                                           "Time to look up pastries on the menu, when they are not cached.")
+    cacheLookups = metrics.counter("pybake_shop_pastry_cache_lookups_total", "Number of pastry cache lookups.")
+    cacheMisses = metrics.counter("pybake_shop_pastry_cache_misses_total", "Number of pastry cache misses.")
+    metrics.gauge("pybake_shop_pastry_cache_entries", "Number of cached pastries.",
+                  collect=lambda: cachedPastry.cache_info().currsize)
+    metrics.gauge("pybake_shop_menu_pastries", "Number of pastries on the menu.", collect=lambda: len(menu))
+
+    @app.before_request
+    def start_request():
+      g.metricsEndpoint = request.endpoint or "unknown"
+      g.metricsStart = time.perf_counter()
+      requestsInFlight.inc(endpoint=g.metricsEndpoint)
+      if request.content_length:
+        receivedBytes.inc(request.content_length, endpoint=g.metricsEndpoint)
+
+    def finishRequest(endpoint, start):
+      requestsInFlight.dec(endpoint=endpoint)
+      requestDuration.observe(time.perf_counter() - start, endpoint=endpoint)
+
+    @app.after_request
+    def count_response(response):
+      requestCount.inc(endpoint=g.metricsEndpoint, status=response.status_code)
+      if response.content_length:
+        sentBytes.inc(response.content_length, endpoint=g.metricsEndpoint)
+      # The request is torn down before the body is sent, so it is finished when the response is closed.
+      response.call_on_close(partial(finishRequest, g.metricsEndpoint, g.metricsStart))
+      g.metricsFinishOnClose = True
+      return response
+
+    @app.teardown_request
+    def finish_request(exc):
+      if not g.get("metricsFinishOnClose"):
+        # There is no response to wait for, e.g. because an after request function failed.
+        finishRequest(g.metricsEndpoint, g.metricsStart)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_text():
+      """Sends the metrics of this shop process in the Prometheus text format."""
+      return app.response_class(metrics.render(), content_type=metricsContentType)
+
+    @lru_cache(maxsize=hotPastryCacheSize)
+    def cachedPastry(name, spec, generation):
+      # `generation` is only part of the key, see `lookupPastry`.
+      cacheMisses.inc()
+      with menuLock:
+        with menuLookupDuration.time():
+          pastry = menu.get(name, spec)
+      if not pastry:
+        return None
+      pastryPath = menu.makePath(pastry)
+      if not pastryPath.exists():
+        log.error("Pastry file is missing: {}".format(pastryPath.as_posix()))
+        return None
+      pastry = withDigest(pastry)
+      return pastry, pastryPath, pastryPath.stat().st_size, pastry.digest
+
+    def lookupPastry(name, spec):
+      """
+      Resolve a pastry name and version spec to a (pastry, path, size, digest) tuple, or `None` if there is none.
+      Popular pastries are requested over and over, so the results are cached until the menu changes.
+      Results are cached per `Menu.generation`, so any change to the menu, by this shop or not, is seen.
+      """
+      cacheLookups.inc()
+      return cachedPastry(name, spec, menu.generation)
+
+    @app.before_request
+    def refresh_menu():
+      """Picks up pastries that other worker processes put on the menu."""
+      with menuLock:
+        if menu.refresh():
+          log.debug("Reloaded menu: {}".format(menu.filePath.as_posix()))
+
+    @app.route("/missing_blobs", methods=["POST"])
+    def missing_blobs():
+      """Tells the client which of the given blobs have to be uploaded."""
+      data = request.get_json(silent=True) or {}
+      digests = data.get("blobs", [])
+      invalid = [digest for digest in digests if not isValidBlobDigest(digest)]
+      if invalid:
+        return jsonify({"result": "Error", "errors": ["invalid blob digests: {}".format(invalid)]}), 400
+      return jsonify({"result": "Ok", "missing": blobStore.missing(digests)})
+
+    @app.route("/upload_blob", methods=["POST"])
+    def upload_blob():
+      """Receives a single blob from the client."""
+      digest = request.form.get("digest")
+      blobFile = request.files.get("blob")
+      if not isValidBlobDigest(digest) or blobFile is None:
+        return jsonify({"result": "Error", "errors": ["missing blob or valid 'digest'"]}), 400
+      if not blobStore.has(digest):
+        try:
+          blobStore.write(digest, blobFile.stream)
+        except ValueError as ex:
+          return jsonify({"result": "Error", "errors": [str(ex)]}), 400
+      return jsonify({"result": "Ok"})
+
+    @app.route("/get_blob/<digest>", methods=["GET"])
+    def get_blob(digest):
+      """Sends a single blob to the client."""
+      if not isValidBlobDigest(digest) or not blobStore.has(digest):
+        abort(404)
+      blobPath = blobStore.path(digest)
+      # Blobs never change, their digest is a strong ETag.
+      return send_from_directory(blobPath.parent.as_posix(), blobPath.name, etag=digest)
+
+    @lru_cache(maxsize=hotPastryCacheSize)
+    def loadMetadata(digest, pastryPath):
+      """
+      Load the metadata of the pastry file at `pastryPath` from the `metadataIndex`.
+      Entries are named after the digest of the pastry file, so they never change and this cache is never cleared.
+      """
+      metadata = metadataIndex.get(digest)
+      if metadata is None:
+        # The pastry was put on the menu without being uploaded, e.g. by an older shop.
+        log.debug("Indexing pastry: {}".format(pastryPath.as_posix()))
+        metadata = metadataIndex.add(digest, pastryPath)
+      return metadata
+
+    def indexedDependencies(menu, pastry):
+      """Get the dependencies of `pastry` from the `metadataIndex`, or `None` if its file is missing."""
+      found = lookupPastry(pastry.name, pastry.version)
+      if not found:
+        return None
+      _, pastryPath, _, digest = found
+      return loadMetadata(digest, pastryPath)["pastry"].get("dependencies", [])
+
+    @app.route("/resolve", methods=["POST"])
+    def resolve():
+      """Resolves a whole shopping list, including all dependencies, to concrete pastries in one go."""
+      data = request.get_json(silent=True) or {}
+      shoppingList = data.get("pastries")
+      if not isinstance(shoppingList, list) or \
+         not all(isinstance(entry, dict) and "name" in entry and "version" in entry for entry in shoppingList):
+        return jsonify({"result": "Error", "errors": ["expected a list of 'pastries' with 'name' and 'version'"]}), 400
+      with LogBlock("Resolving {} pastries".format(len(shoppingList))):
+        pastries, resolved, errors = resolvePastries(menu, shoppingList, dependencies=indexedDependencies,
+                                                     menuLock=menuLock)
+      if errors:
+        return jsonify({"result": "Error", "errors": errors}), 400
+      response = []
+      for pastry in pastries:
+        found = lookupPastry(pastry.name, pastry.version)
+        if not found:
+          # Removed since it was resolved.
+          return jsonify({"result": "Error", "errors": ["Pastry file is missing: {}".format(pastry)]}), 400
+        pastry, _, size, digest = found
+        response.append({
+          "name": pastry.name,
+          "version": str(pastry.version),
+          "digest": digest,
+          "size": size,
+          "dependencies": indexedDependencies(menu, pastry),
+        })
+      return jsonify({"result": "Ok", "pastries": response, "resolved": resolved})
+
     @app.route("/upload_pastry", methods=["POST"])
     def upload_pastry():
       """Downloads a pastry from the client to the server."""
       with LogBlock("Upload"):
         log.debug("Recieved upload request")
 
-        data = dict(request.form)
-        log.debug("Data: {}".format(data))
-
-        files = dict(request.files)
-        log.debug("Files: {}".format(files))
+        # Accessing the form receives the whole upload, see `ShopRequest`.
+        with uploadDuration.time(phase="receive"):
+          data = request.form
+          files = request.files
+        log.debug("Data: {}".format(dict(data)))
+        log.debug("Files: {}".format(dict(files)))
 
         returnCode = 200
         errors = []
@@ -88,18 +530,17 @@ def Shop(*, menu, name=__name__):
         if "pastry" not in files:
           errors.append("missing pastry file")
 
-        force = False
-        if "force" in data:
-          force = bool(data["force"][0])
+        # Form values are strings, the depot sends "True" or "False".
+        force = data.get("force", "").lower() in ("1", "true", "yes")
 
         if len(errors) == 0:
-          # `data` is a multi-dict, which is why we need to extract it here.
-          name = data["name"][0]
-          version = data["version"][0]
+          name = data["name"]
+          version = data["version"]
           with ScopedLogSink() as sink:
             pastry = Pastry(name=name, version=version)
-            with LogBlock("Processing Pastry Upload: {}".format(pastry)):
-              processPastryUpload(menu, pastry, files["pastry"][0], forceUpload=force)
+            with LogBlock("Processing Pastry Upload: {}".format(pastry)), uploadDuration.time(phase="process"):
+              processPastryUpload(menu, pastry, files["pastry"], forceUpload=force, blobStore=blobStore,
+                                  metadataIndex=metadataIndex, menuLock=menuLock)
             errors.extend(sink.logged["error"])
 
         if errors and len(errors) != 0:
@@ -115,8 +556,8 @@ def Shop(*, menu, name=__name__):
       with LogBlock("Get Pastry"):
         log.debug("Recieved download request")
 
-        data = dict(request.form)
-        log.debug("Data: {}".format(data))
+        data = request.form
+        log.debug("Data: {}".format(dict(data)))
 
         errors = []
         response = {
@@ -129,30 +570,297 @@ def Shop(*, menu, name=__name__):
         if "version" not in data:
           errors.append("missing pastry 'version'")
 
-        pastryPath = None
         if len(errors) == 0:
-          # `data` is a multi-dict, which is why we need to extract it here.
-          name = data["name"][0]
-          version = data["version"][0]
-          with ScopedLogSink() as sink:
-            pastry = getPastry(menu, name, version)
-            if pastry:
-              pastryPath = menu.makePath(pastry)
-            errors.extend(sink.logged["error"])
+          name = data["name"]
+          version = data["version"]
+          found = lookupPastry(name, version)
+          if not found:
+            errors.append("Pastry not found.")
 
         if errors and len(errors) != 0:
           response["errors"] = errors
           response["result"] = "Error"
           return jsonify(response), 400
-        log.info("Sending file: {}".format(pastryPath.as_posix()))
-        response = make_response(send_from_directory(pastryPath.parent.as_posix(), pastryPath.name))
-        response.headers["X-Pastry-Version"] = str(pastry.version)
-        return response
+        pastry, pastryPath, _, _ = found
+        return sendPastry(pastry, pastryPath)
+
+    @app.route("/pastry/<name>/<version>", methods=["GET"])
+    def pastry_file(name, version):
+      """Sends the pastry with exactly the given version. Supports `Range` requests to resume downloads."""
+      try:
+        version = Version(version)
+      except ValueError:
+        abort(400)
+      found = lookupPastry(name, version)
+      if not found:
+        abort(404)
+      pastry, pastryPath, _, _ = found
+      return sendPastry(pastry, pastryPath)
+
+    def sendMetadata(name, version, select):
+      """
+      Send the parts of the metadata of a pastry that `select` picks from its `metadataIndex` entry.
+      The metadata only changes with the pastry file, so the digest of the file is a strong ETag.
+      """
+      try:
+        version = Version(version)
+      except ValueError:
+        abort(400)
+      found = lookupPastry(name, version)
+      if not found:
+        abort(404)
+      pastry, pastryPath, _, digest = found
+      try:
+        metadata = loadMetadata(digest, pastryPath)
+      except ValueError as ex:
+        # The pastry file is not a valid pastry, e.g. it has no pastry.json.
+        log.error("Failed to index pastry {}: {}".format(pastry, ex))
+        return jsonify({"result": "Error", "errors": [str(ex)]}), 422
+      response = jsonify(dict(select(metadata), result="Ok", name=pastry.name, version=str(pastry.version),
+                              digest=digest))
+      response.set_etag(digest)
+      return response.make_conditional(request)
+
+    @app.route("/pastry/<name>/<version>/metadata", methods=["GET"])
+    def pastry_metadata(name, version):
+      """Sends the pastry.json of a pastry and the sizes of its file and its ingredients, without the archive."""
+      return sendMetadata(name, version, lambda metadata: {
+        "pastry": metadata["pastry"],
+        "size": metadata["size"],
+        "files": len(metadata["files"]),
+        "filesSize": sum(entry["size"] or 0 for entry in metadata["files"]),
+      })
+
+    @app.route("/pastry/<name>/<version>/dependencies", methods=["GET"])
+    def pastry_dependencies(name, version):
+      """Sends the dependencies of a pastry, without the archive."""
+      return sendMetadata(name, version, lambda metadata: {"dependencies": metadata["pastry"].get("dependencies", [])})
+
+    @app.route("/pastry/<name>/<version>/files", methods=["GET"])
+    def pastry_files(name, version):
+      """Sends the paths and sizes of the ingredients of a pastry, without the archive."""
+      return sendMetadata(name, version, lambda metadata: {"files": metadata["files"]})
 
     return app
 
 
-def run(*, config, **kwargs):
+class SendfileWrapper(FileWrapper):
+  """
+  The `wsgi.file_wrapper` of `ShopRequestHandler`.
+
+  If the server gets it back from the app unchanged, see `sendfileApp`, the file is sent with `socket.sendfile`,
+  so its bytes go straight from the kernel to the socket instead of being copied through Python.
+  Otherwise, e.g. for `Range` responses or behind middleware, it behaves like a `FileWrapper`.
+  """
+
+  def __init__(self, handler, file, buffer_size=8192):
+    super().__init__(file, buffer_size)
+    self.handler = handler
+    # Set by `sendfileApp`.
+    self.zeroCopy = False
+    self._headersSent = False
+
+  def __next__(self):
+    if not self.zeroCopy:
+      return super().__next__()
+    if not self._headersSent:
+      # Lets the handler send the status line and headers first.
+      self._headersSent = True
+      return b""
+    self.zeroCopy = False
+    if self.handler.chunkedResponse:
+      # Without a Content-Length, the body has to be sent in chunks.
+      return super().__next__()
+    self.handler.connection.sendfile(self.file, self.file.tell())
+    raise StopIteration()
+
+
+def sendfileApp(app):
+  """Wrap the WSGI `app`, so that files it returns in a `SendfileWrapper` are sent with `socket.sendfile`."""
+  def wrapped(environ, start_response):
+    appIter = app(environ, start_response)
+    if isinstance(appIter, SendfileWrapper):
+      appIter.zeroCopy = True
+    return appIter
+  return wrapped
+
+
+class ShopRequestHandler(WSGIRequestHandler):
+  """Request handler of `PooledWSGIServer`."""
+  # Keep-alive connections let clients reuse connections for many requests.
+  protocol_version = "HTTP/1.1"
+  # Seconds a connection may be idle before it is closed, so idle clients do not occupy threads forever.
+  # When the server closes, idle connections are closed right away, see `PooledWSGIServer.closeIdleConnections`.
+  timeout = 30
+
+  def handle_one_request(self):
+    if not self.server.markIdle(self.connection):
+      self.close_connection = True
+      return
+    super().handle_one_request()
+
+  def parse_request(self):
+    # Called as soon as the request line was received.
+    self.server.markBusy(self.connection)
+    return super().parse_request()
+
+  def make_environ(self):
+    environ = super().make_environ()
+    environ["wsgi.file_wrapper"] = partial(SendfileWrapper, self)
+    self.chunkedResponse = False
+    return environ
+
+  def send_header(self, keyword, value):
+    if keyword.lower() == "transfer-encoding":
+      self.chunkedResponse = True
+    super().send_header(keyword, value)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+  """
+  Production WSGI server that handles connections with a fixed number of threads.
+
+  Slow clients, e.g. downloading a large pastry, only occupy one of the threads.
+  `server_close` waits for all running requests to finish and closes idle keep-alive connections.
+  """
+
+  multithread = True
+
+  def __init__(self, host, port, app, *, threads=8):
+    super().__init__(host, port, sendfileApp(app), handler=ShopRequestHandler)
+    self.threads = threads
+    self.executor = ThreadPoolExecutor(max_workers=threads)
+    # Connections that wait for their next request, see `ShopRequestHandler`.
+    self.idleConnections = set()
+    self.closing = False
+    self._connectionsLock = threading.Lock()
+
+  def markIdle(self, connection):
+    """
+    Called before a connection waits for its next request.
+    :return: False if the server is closing, so the connection should be closed instead.
+    """
+    with self._connectionsLock:
+      if self.closing:
+        return False
+      self.idleConnections.add(connection)
+      return True
+
+  def markBusy(self, connection):
+    """Called when a request was received on a connection."""
+    with self._connectionsLock:
+      self.idleConnections.discard(connection)
+
+  def closeIdleConnections(self):
+    """
+    Stop reading from connections that wait for their next request, so their threads finish without waiting for the
+    timeout. Connections with a running request are closed after it.
+    """
+    with self._connectionsLock:
+      self.closing = True
+      for connection in self.idleConnections:
+        try:
+          connection.shutdown(socket.SHUT_RD)
+        except OSError:
+          # The client closed the connection already.
+          pass
+      self.idleConnections.clear()
+
+  def process_request(self, request, client_address):
+    self.executor.submit(self.process_request_thread, request, client_address)
+
+  def process_request_thread(self, request, client_address):
+    """Like `socketserver.ThreadingMixIn.process_request_thread`."""
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      self.markBusy(request)
+      self.shutdown_request(request)
+
+  def server_close(self):
+    super().server_close()
+    self.closeIdleConnections()
+    self.executor.shutdown(wait=True)
+
+
+def serveWorker(server, menu):
+  """
+  Serve requests with `server` until SIGTERM or SIGINT is received.
+  Then wait for running requests and save the `menu`.
+  """
+  def stop(signum, frame):
+    log.info("Shutting down worker {}...".format(os.getpid()))
+    # `shutdown` waits for `serve_forever` to return, which runs in this thread.
+    threading.Thread(target=server.shutdown, daemon=True).start()
+
+  signal.signal(signal.SIGTERM, stop)
+  signal.signal(signal.SIGINT, stop)
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    menu.save()
+
+
+def serve(app, menu, *, host, port, workers=1, threads=8):
+  """
+  Serve `app` with a `PooledWSGIServer` in `workers` processes with `threads` threads each.
+
+  All processes share the listening socket and the menu files, see `Menu.refresh`.
+  On SIGTERM or SIGINT, all workers finish their running requests and save the menu before the shop closes.
+  Workers that exit unexpectedly are replaced.
+  """
+  server = PooledWSGIServer(host, port, app, threads=threads)
+  if workers > 1 and not hasattr(os, "fork"):
+    log.warning("Multiple worker processes are not supported on this platform, using threads only.")
+    workers = 1
+  log.success("Serving on {}:{} with {} worker processes and {} threads each.".format(
+    host, server.server_port, workers, threads))
+  if workers <= 1:
+    serveWorker(server, menu)
+    return
+
+  # Idle workers must not block in `accept` when another worker takes the connection.
+  server.socket.setblocking(False)
+  children = set()
+  stopping = False
+
+  def spawn():
+    pid = os.fork()
+    if pid == 0:
+      try:
+        serveWorker(server, menu)
+      finally:
+        os._exit(0)
+    children.add(pid)
+
+  def stop(signum, frame):
+    nonlocal stopping
+    stopping = True
+    log.info("Shutting down {} workers...".format(len(children)))
+    for pid in children:
+      os.kill(pid, signal.SIGTERM)
+
+  for _ in range(workers):
+    spawn()
+  signal.signal(signal.SIGTERM, stop)
+  signal.signal(signal.SIGINT, stop)
+  while children:
+    try:
+      pid, _ = os.wait()
+    except ChildProcessError:
+      break
+    children.discard(pid)
+    if not stopping:
+      log.warning("Worker {} exited unexpectedly. Starting a new one.".format(pid))
+      spawn()
+  server.server_close()
+  menu.save()
+
+
+def run(*, config, production=False, workers=None, threads=None, **kwargs):
   """Open the shop!"""
   with LogBlock("Shop"):
     shop_config = import_module(config)
@@ -164,10 +872,17 @@ def run(*, config, **kwargs):
     pastriesRoot.safe_mkdir(parents=True)
 
     debug = try_getattr(shop_config, ("debug", "debugEnabled"), default_value=False)
+    production = production or try_getattr(shop_config, ("production",), default_value=False)
+    workers = workers or try_getattr(shop_config, ("workers",), default_value=1)
+    threads = threads or try_getattr(shop_config, ("threads",), default_value=8)
 
     menu = Menu(pastriesRoot)
     log.info("Full menu file path: {}".format(menu.filePath.as_posix()))
     menu.load()
     app = Shop(menu=menu)
-    app.run(debug=debug, host=shop_config.server.host, port=shop_config.server.port)
-    menu.save()
+    if production:
+      serve(app, menu, host=shop_config.server.host, port=shop_config.server.port, workers=workers, threads=threads)
+    else:
+      # Flask's development server.
+      app.run(debug=debug, host=shop_config.server.host, port=shop_config.server.port)
+      menu.save()
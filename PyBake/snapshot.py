@@ -0,0 +1,161 @@
+"""
+Compact binary snapshots of a menu that can be queried lazily through `mmap`.
+
+Layout of a snapshot file (all integers are little endian):
+
+  Header:  magic (8 bytes), format version, number of names, number of entries,
+           size and SHA-1 digest (20 bytes) of the contents of the menu file the snapshot was created from.
+  Names:   One record per name, sorted by their UTF-8 bytes:
+           offset and length of the name, index of the first entry and number of entries.
+  Entries: One record per version, grouped by name and sorted by version:
+           offset and length of the version string, offset and length of the digest string (empty if unknown).
+  Strings: UTF-8 encoded names, version and digest strings the records above point to.
+"""
+
+from hashlib import sha1
+import mmap
+import os
+import struct
+
+
+class MenuSnapshot:
+  """
+  Read-only view of a menu snapshot file.
+
+  Nothing is parsed up front, names are looked up with a binary search directly in the mapped file.
+  Since the file is mapped read-only, forked processes share its pages.
+
+  :example:
+  MenuSnapshot.write("menu.snapshot", [("foo", [("0.1.0", None), ("0.2.0", "ab12...")])], sourceData=menuFileBytes)
+  snapshot = MenuSnapshot.open("menu.snapshot")
+  snapshot.entries("foo")  # [("0.1.0", None), ("0.2.0", "ab12...")]
+  """
+
+  magic = b"PYBAKEMS"
+  formatVersion = 3
+  headerFormat = struct.Struct("<8sIIIq20s")
+  nameFormat = struct.Struct("<IIII")
+  entryFormat = struct.Struct("<IIII")
+
+  def __init__(self, fileObject, data):
+    self._file = fileObject
+    self._data = data
+    _, _, self.nameCount, self.entryCount, self.sourceSize, self.sourceDigest = MenuSnapshot.headerFormat.unpack_from(data)
+    self._namesOffset = MenuSnapshot.headerFormat.size
+    self._entriesOffset = self._namesOffset + self.nameCount * MenuSnapshot.nameFormat.size
+
+  @classmethod
+  def open(cls, filePath):
+    """
+    Map the snapshot at `filePath` into memory.
+    :return: `None` if the file does not exist or is not a valid snapshot.
+    """
+    try:
+      fileObject = open(str(filePath), "rb")
+    except OSError:
+      return None
+    try:
+      data = mmap.mmap(fileObject.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      # Empty files can not be mapped.
+      fileObject.close()
+      return None
+    if len(data) < cls.headerFormat.size:
+      data.close()
+      fileObject.close()
+      return None
+    magic, formatVersion = cls.headerFormat.unpack_from(data)[:2]
+    if magic != cls.magic or formatVersion != cls.formatVersion:
+      data.close()
+      fileObject.close()
+      return None
+    return cls(fileObject, data)
+
+  @classmethod
+  def write(cls, filePath, entries, *, sourceData):
+    """
+    Write a snapshot to `filePath`.
+    :param entries: Iterable of (name, entries) pairs, sorted by name.
+                    `entries` is a list of (version, digest) pairs sorted by version. `digest` may be `None`.
+    :param sourceData: The contents of the menu file this snapshot is created from, as bytes. Used by `isUpToDate`.
+    """
+    filePath = str(filePath)
+    names = []
+    versions = []
+    strings = bytearray()
+    for name, nameEntries in entries:
+      names.append((name.encode("UTF-8"), len(versions), len(nameEntries)))
+      versions.extend((str(version).encode("UTF-8"), (digest or "").encode("UTF-8")) for version, digest in nameEntries)
+    stringsOffset = cls.headerFormat.size + len(names) * cls.nameFormat.size + len(versions) * cls.entryFormat.size
+
+    def addString(value):
+      """Append `value` to the string pool and return its absolute offset."""
+      offset = stringsOffset + len(strings)
+      strings.extend(value)
+      return offset
+
+    parts = [cls.headerFormat.pack(cls.magic, cls.formatVersion, len(names), len(versions), len(sourceData),
+                                   sha1(sourceData).digest())]
+    for name, first, count in names:
+      parts.append(cls.nameFormat.pack(addString(name), len(name), first, count))
+    for version, digest in versions:
+      parts.append(cls.entryFormat.pack(addString(version), len(version), addString(digest), len(digest)))
+    parts.append(bytes(strings))
+
+    # Write to a temporary file first so processes that currently map the old snapshot are not disturbed.
+    tempPath = "{}.{}.tmp".format(filePath, os.getpid())
+    with open(tempPath, "wb") as snapshotFile:
+      snapshotFile.write(b"".join(parts))
+    os.replace(tempPath, filePath)
+
+  def isUpToDate(self, sourceData):
+    """
+    Whether this snapshot was created from a menu file with the contents `sourceData` (bytes).
+    Compares content digests, so rewrites that keep the size and timestamp of the menu file are detected as well.
+    """
+    return len(sourceData) == self.sourceSize and sha1(sourceData).digest() == self.sourceDigest
+
+  def _string(self, offset, length):
+    return self._data[offset:offset + length].decode("UTF-8")
+
+  def _nameRecord(self, i):
+    return MenuSnapshot.nameFormat.unpack_from(self._data, self._namesOffset + i * MenuSnapshot.nameFormat.size)
+
+  def names(self):
+    """Iterate all names in this snapshot, in sorted order."""
+    for i in range(self.nameCount):
+      offset, length, _, _ = self._nameRecord(i)
+      yield self._string(offset, length)
+
+  def entries(self, name):
+    """
+    Get (version, digest) string pairs of all entries with the given `name`, sorted by version.
+    `digest` is `None` if it is unknown.
+    :return: `None` if there is no such name.
+    """
+    key = name.encode("UTF-8")
+    lo, hi = 0, self.nameCount
+    while lo < hi:
+      mid = (lo + hi) // 2
+      offset, length, first, count = self._nameRecord(mid)
+      current = self._data[offset:offset + length]
+      if current < key:
+        lo = mid + 1
+      elif current > key:
+        hi = mid
+      else:
+        result = []
+        for i in range(first, first + count):
+          versionOffset, versionLength, digestOffset, digestLength = MenuSnapshot.entryFormat.unpack_from(
+            self._data, self._entriesOffset + i * MenuSnapshot.entryFormat.size)
+          result.append((self._string(versionOffset, versionLength), self._string(digestOffset, digestLength) or None))
+        return result
+    return None
+
+  def close(self):
+    """Unmap the snapshot file."""
+    self._data.close()
+    self._file.close()
+
+  def __len__(self):
+    return self.entryCount
@@ -0,0 +1,149 @@
+"""
+Benchmarks of the hot paths of the menu, oven, shop and basket on synthetic workloads.
+
+Run all benchmarks at a given scale and store the results:
+
+  python -m benchmarks --scale small --output benchmarks/results/small.json
+
+Compare a new run against stored results to catch regressions:
+
+  python -m benchmarks --scale small --baseline benchmarks/results/small.json
+
+Benchmark suites are functions decorated with `@benchmark`. Each suite runs in its own temporary working directory
+and times the interesting parts of its workload with `Recorder.measure`.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from PyBake import Path, ChangeDir
+from PyBake.logger import log
+
+
+# Sizes of the synthetic workloads.
+# menuEntries:  Number of pastries on the benchmarked menu.
+# ingredients:  Number of ingredients the oven bakes.
+# shopPastries: Number of pastries the shop serves, which are also installed by the basket.
+# downloads:    Number of /get_pastry requests.
+# concurrency:  Number of clients downloading concurrently.
+scales = {
+  "tiny": dict(menuEntries=1000, ingredients=200, shopPastries=5, downloads=20, concurrency=4),
+  "small": dict(menuEntries=10000, ingredients=10000, shopPastries=20, downloads=200, concurrency=8),
+  "medium": dict(menuEntries=100000, ingredients=100000, shopPastries=50, downloads=1000, concurrency=16),
+  "large": dict(menuEntries=1000000, ingredients=100000, shopPastries=100, downloads=5000, concurrency=32),
+}
+
+# All registered benchmark suites, in the order they were registered.
+suites = []
+
+
+def benchmark(name):
+  """
+  Decorator to register a benchmark suite.
+
+  The suite is called with a `Recorder` and the dict of the current scale, see `scales`.
+
+  :example:
+  @benchmark("menu")
+  def menuBenchmarks(recorder, scale):
+    with recorder.measure("menu.add", ops=scale["menuEntries"]):
+      ...
+  """
+  def decorator(func):
+    suites.append((name, func))
+    return func
+  return decorator
+
+
+class Recorder:
+  """Collects the timings of a benchmark run."""
+
+  def __init__(self):
+    # Maps measurement names to dicts with "seconds", "ops" and "opsPerSecond".
+    self.results = {}
+
+  @contextmanager
+  def measure(self, name, *, ops=1):
+    """
+    Time the code in the `with` block, which performs `ops` operations.
+    If `name` was measured before, the fastest time is kept.
+    Measurements are logged with `LogLevel.All`, so they are printed even if everything else is not.
+    """
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    previous = self.results.get(name)
+    if previous and previous["seconds"] <= seconds:
+      return
+    self.results[name] = {"seconds": seconds, "ops": ops, "opsPerSecond": ops / seconds if seconds else None}
+    log.all("{}: {:.3f}s for {} ops ({:.0f} ops/s)".format(name, seconds, ops, ops / seconds if seconds else 0))
+
+
+def runBenchmarks(scale="small", *, only=None, repeat=1):
+  """
+  Run the benchmark suites.
+
+  :param scale: A key of `scales`.
+  :param only: Names of the suites to run. Runs all suites if `None`.
+  :param repeat: Number of times each suite is run. The fastest time of each measurement is kept.
+  :return: A dict with information about the environment and the "results" of all measurements.
+  """
+  recorder = Recorder()
+  for name, func in suites:
+    if only and name not in only:
+      continue
+    for _ in range(repeat):
+      workDir = tempfile.mkdtemp(prefix="pybake-benchmark-")
+      try:
+        with ChangeDir(workDir):
+          func(recorder, scales[scale])
+      finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+  return {
+    "scale": scale,
+    "timestamp": datetime.now().isoformat(),
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "cpus": os.cpu_count(),
+    "results": recorder.results,
+  }
+
+
+def saveResults(filePath, results):
+  """Save the results of `runBenchmarks` as JSON."""
+  filePath = Path(filePath)
+  filePath.parent.safe_mkdir(parents=True)
+  with filePath.open("w") as resultsFile:
+    json.dump(results, resultsFile, indent=2, sort_keys=True)
+
+
+def loadResults(filePath):
+  """Load results saved by `saveResults`."""
+  with Path(filePath).open("r") as resultsFile:
+    return json.load(resultsFile)
+
+
+def compareResults(results, baseline, *, tolerance=0.25):
+  """
+  Find measurements in `results` that are slower than in `baseline` by more than `tolerance` (a fraction).
+  Measurements that are missing in either of them are ignored.
+
+  :return: A list of (name, baseline seconds, seconds) tuples.
+  :raise ValueError: If the results were measured at different scales.
+  """
+  if results["scale"] != baseline["scale"]:
+    raise ValueError("Can not compare results of scale '{}' with baseline of scale '{}'.".format(
+      results["scale"], baseline["scale"]))
+  regressions = []
+  for name, result in sorted(results["results"].items()):
+    previous = baseline["results"].get(name)
+    if previous and result["seconds"] > previous["seconds"] * (1 + tolerance):
+      regressions.append((name, previous["seconds"], result["seconds"]))
+  return regressions
@@ -0,0 +1,68 @@
+"""
+Run the benchmarks from the command line, see `benchmarks`.
+"""
+
+import argparse
+import sys
+
+from PyBake.logger import log, LogVerbosity, StdOutSink
+from benchmarks import scales, suites, runBenchmarks, saveResults, loadResults, compareResults
+# Register the benchmark suites.
+import benchmarks.menu
+import benchmarks.oven
+import benchmarks.shop
+
+
+def makeParser():
+  """Create the argument parser. Suites registered before this is called can be chosen with --only."""
+  parser = argparse.ArgumentParser(prog="benchmarks", description="Benchmark PyBake on synthetic workloads.")
+  parser.add_argument("--scale", choices=list(scales.keys()), default="small",
+                      help="The size of the workloads. Default: small")
+  parser.add_argument("--only", nargs="+", choices=[name for name, _ in suites],
+                      help="Only run these benchmark suites.")
+  parser.add_argument("--repeat", type=int, default=1,
+                      help="Run each suite this many times and keep the fastest time of each measurement. Default: 1")
+  parser.add_argument("-o", "--output",
+                      help="Store the results in this JSON file.")
+  parser.add_argument("--baseline",
+                      help="Compare the results with the results stored in this JSON file. "
+                           "Exits with code 1 if any measurement regressed.")
+  parser.add_argument("--tolerance", type=float, default=0.25,
+                      help="Fraction a measurement may be slower than the baseline before it counts as a regression. "
+                           "Default: 0.25")
+  return parser
+
+
+def main(argv=None):
+  """
+  Run the benchmarks with the command line arguments `argv`.
+  :return: The exit code: 1 if a measurement regressed compared to the baseline, else 0.
+  """
+  args = makeParser().parse_args(argv)
+
+  # Only print the measurements, not what the benchmarked code logs.
+  verbosity = log.verbosity
+  log.verbosity = LogVerbosity.Error
+  try:
+    results = runBenchmarks(args.scale, only=args.only, repeat=args.repeat)
+  finally:
+    log.verbosity = verbosity
+
+  if args.output:
+    saveResults(args.output, results)
+    log.success("Results written to: {}".format(args.output))
+
+  if args.baseline:
+    regressions = compareResults(results, loadResults(args.baseline), tolerance=args.tolerance)
+    for name, previous, current in regressions:
+      log.error("Regression in {}: {:.3f}s -> {:.3f}s ({:+.0%})".format(name, previous, current, current / previous - 1))
+    if regressions:
+      return 1
+    log.success("No regressions compared to: {}".format(args.baseline))
+  return 0
+
+
+if __name__ == "__main__":
+  log.sinks = [StdOutSink()]
+  log.verbosity = LogVerbosity.Success
+  sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+Benchmarks of `PyBake.Menu`.
+"""
+
+import random
+
+from PyBake import Menu, Pastry
+from benchmarks import benchmark
+
+
+# Number of lookups timed by the `Menu.get` benchmarks.
+numLookups = 10000
+
+# Number of pastries added before timing a journaled save.
+numJournaled = 100
+
+
+def makePastries(numEntries, versionsPerName=10):
+  """Create `numEntries` pastries with `versionsPerName` versions each."""
+  return [Pastry(name="pastry{}".format(i // versionsPerName), version="1.{}.0".format(i % versionsPerName))
+          for i in range(numEntries)]
+
+
+@benchmark("menu")
+def menuBenchmarks(recorder, scale):
+  numEntries = scale["menuEntries"]
+  pastries = makePastries(numEntries)
+  rng = random.Random(0)
+
+  menu = Menu("menu/menu.json")
+  with recorder.measure("menu.add", ops=numEntries):
+    for pastry in pastries:
+      menu.add(pastry)
+  with recorder.measure("menu.save.compact", ops=numEntries):
+    menu.compact()
+
+  menu.snapshotFilePath.unlink()
+  with recorder.measure("menu.load.json", ops=numEntries):
+    Menu(menu.filePath).load()
+  with recorder.measure("menu.load.snapshot", ops=numEntries):
+    loaded = Menu(menu.filePath)
+    loaded.load()
+
+  lookups = [rng.choice(pastries) for _ in range(numLookups)]
+  with recorder.measure("menu.get.exact", ops=numLookups):
+    for pastry in lookups:
+      loaded.get(pastry.name, pastry.version)
+  with recorder.measure("menu.get.spec", ops=numLookups):
+    for pastry in lookups:
+      loaded.get(pastry.name, ">=1.0.0")
+
+  for i in range(numJournaled):
+    loaded.add(Pastry(name="new{}".format(i), version="0.1.0"))
+  with recorder.measure("menu.save.journal", ops=numJournaled):
+    loaded.save()
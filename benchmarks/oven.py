@@ -0,0 +1,52 @@
+"""
+Benchmarks of the oven: collecting ingredients in a pot and baking them with `zipBaker`.
+"""
+
+import os
+import zipfile
+
+from PyBake import Menu, Path
+from PyBake.oven import Pot, zipBaker
+from PyBake.scanner import Scanner
+from benchmarks import benchmark
+
+
+# Ingredients per directory and pastry in the synthetic source tree.
+filesPerDir = 100
+numPastries = 10
+
+
+def makeSourceTree(numFiles, root="src"):
+  """Create `numFiles` small, compressible source files below `root`."""
+  for i in range(numFiles):
+    dirPath = os.path.join(root, "pastry{}".format(i % numPastries), "dir{}".format(i // (filesPerDir * numPastries)))
+    if i % (filesPerDir * numPastries) < numPastries:
+      os.makedirs(dirPath, exist_ok=True)
+    with open(os.path.join(dirPath, "file{}.h".format(i)), "w") as sourceFile:
+      sourceFile.write("// File {}\n".format(i) + "#define VALUE_{} {}\n".format(i, i) * 20)
+
+
+@benchmark("oven")
+def ovenBenchmarks(recorder, scale):
+  numFiles = scale["ingredients"]
+  makeSourceTree(numFiles)
+
+  pot = Pot()
+  with recorder.measure("oven.collect", ops=numFiles):
+    scanner = Scanner()
+    for i in range(numPastries):
+      pot.get("pastry{}".format(i), "0.1.0").addIngredients(scanner.rglob("src/pastry{}".format(i), "*.h", dirs=False))
+
+  Path("out").safe_mkdir()
+  menu = Menu("out")
+  options = {"compression": zipfile.ZIP_DEFLATED}
+  with recorder.measure("oven.zipBaker", ops=numFiles):
+    zipBaker(menu=menu, pot=pot, options=options)
+  # Nothing changed, so fingerprinting all ingredients is the only work left.
+  with recorder.measure("oven.zipBaker.unchanged", ops=numFiles):
+    zipBaker(menu=menu, pot=pot, force=True, options=options)
+
+  Path("outJobs").safe_mkdir()
+  menu = Menu("outJobs")
+  with recorder.measure("oven.zipBaker.jobs", ops=numFiles):
+    zipBaker(menu=menu, pot=pot, options=dict(options, jobs=min(4, os.cpu_count() or 1)))
@@ -0,0 +1,79 @@
+"""
+Benchmarks of a local shop serving pastries to concurrent basket downloads, and of `PyBake.basket.installPastry`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import zipfile
+
+import requests
+from werkzeug.serving import make_server
+
+from PyBake import Menu, Path
+from PyBake.basket import Receipt, installPastry
+from PyBake.oven import Pastry as OvenPastry, bakePastry
+from PyBake.shop import Shop
+from benchmarks import benchmark
+
+
+# Number and size of the ingredients of each served pastry.
+filesPerPastry = 20
+fileSize = 16 * 1024
+
+
+def stockShop(menu, numPastries):
+  """Bake `numPastries` pastries with incompressible ingredients and put them on the `menu`."""
+  Path("src").safe_mkdir()
+  for i in range(numPastries):
+    pastry = OvenPastry(name="pastry{}".format(i), version="0.1.0")
+    for j in range(filesPerPastry):
+      filePath = "src/pastry{}_{}.bin".format(i, j)
+      with open(filePath, "wb") as ingredientFile:
+        ingredientFile.write(os.urandom(fileSize))
+      pastry.addIngredient(filePath)
+    bakePastry(menu.makePath(pastry), pastry, zipfile.ZIP_STORED)
+    menu.add(pastry)
+  menu.save()
+
+
+@benchmark("shop")
+def shopBenchmarks(recorder, scale):
+  numPastries = scale["shopPastries"]
+  numDownloads = scale["downloads"]
+  Path("shop").safe_mkdir()
+  shopMenu = Menu("shop")
+  stockShop(shopMenu, numPastries)
+
+  # Request logging would dominate the measurements.
+  logging.getLogger("werkzeug").setLevel(logging.ERROR)
+  server = make_server("127.0.0.1", 0, Shop(menu=shopMenu), threaded=True)
+  serverThread = threading.Thread(target=server.serve_forever, daemon=True)
+  serverThread.start()
+  url = "http://127.0.0.1:{}".format(server.server_port)
+  try:
+    local = threading.local()
+
+    def download(i):
+      if not hasattr(local, "session"):
+        local.session = requests.Session()
+      response = local.session.post("{}/get_pastry".format(url),
+                                    data={"name": "pastry{}".format(i % numPastries), "version": "0.1.0"})
+      response.raise_for_status()
+      return len(response.content)
+
+    with recorder.measure("shop.get_pastry", ops=numDownloads):
+      with ThreadPoolExecutor(max_workers=scale["concurrency"]) as executor:
+        list(executor.map(download, range(numDownloads)))
+
+    Path("client").safe_mkdir()
+    clientMenu = Menu("client")
+    receipt = Receipt(key="benchmark", dirPath=Path("receipts").resolve())
+    with recorder.measure("basket.installPastry", ops=numPastries):
+      for i in range(numPastries):
+        pastryData = {"name": "pastry{}".format(i), "version": "0.1.0", "destination": "install/pastry{}".format(i)}
+        installPastry(clientMenu, receipt, pastryData, url, forceDownload=False, forceInstall=False)
+  finally:
+    server.shutdown()
+    serverThread.join()
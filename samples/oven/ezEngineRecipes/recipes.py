@@ -5,6 +5,7 @@ Use `PyBake oven` with this script to generate a series of pastries (.zip files)
 """
 
 from PyBake import *
+from PyBake.scanner import scanner
 from itertools import chain
 
 pastryVersion = Version("0.6.0")
@@ -62,32 +63,32 @@ def get_header_files(pot):
   master.addDependency("ezEngine_Headers", pastryVersion)
   pastry = pot.get("ezEngine_Headers", pastryVersion)
   add_common(pastry)
-  for ingredient in ezEnginePath_Headers.rglob("*.h"):
-    pastry.addIngredient(ingredient)
+  pastry.addIngredients(scanner.rglob(ezEnginePath_Headers, "*.h", dirs=False))
 
 
 @recipe
 def get_runtime_files(pot):
   """Get all runtime files."""
   master = pot.get("ezEngine", pastryVersion)
-  for path in ezEnginePath_Bin.glob("*"):
-    if not path.is_dir() or path.match("*Test*"):
+  for path in map(Path, scanner.glob(ezEnginePath_Bin, "*", files=False)):
+    if path.match("*Test*"):
       continue
     platform = extract_platform(path)
     name = createFilename("ezEngine_Bin", platform)
     master.addDependency(name, pastryVersion)
     pastry = pot.get(name, pastryVersion)
     add_common(pastry)
-    for ingredient in chain(path.rglob("ez*.dll"), path.rglob("ez*.pdb"), path.rglob("ez*.so")):
-      pastry.addIngredient(ingredient)
+    pastry.addIngredients(chain(scanner.rglob(path, "ez*.dll", dirs=False),
+                                scanner.rglob(path, "ez*.pdb", dirs=False),
+                                scanner.rglob(path, "ez*.so", dirs=False)))
 
 
 @recipe
 def get_compiletime_files(pot):
   """Get all compile-time files."""
   master = pot.get("ezEngine", pastryVersion)
-  for path in ezEnginePath_Lib.glob("*"):
-    if not path.is_dir() or path.match("*Test*"):
+  for path in map(Path, scanner.glob(ezEnginePath_Lib, "*", files=False)):
+    if path.match("*Test*"):
       continue
     platform = extract_platform(path)
     name = createFilename("ezEngine_Lib", platform)
@@ -95,8 +96,7 @@ def get_compiletime_files(pot):
     pastry = pot.get(name, pastryVersion)
     add_common(pastry)
     pastry.addIngredient("exports_{name}{bits}{generator}.cmake".format(**vars(platform)))
-    for ingredient in path.rglob("ez*.lib"):
-      pastry.addIngredient(ingredient)
+    pastry.addIngredients(scanner.rglob(path, "ez*.lib", dirs=False))
 
 
 def add_common(pastry):
@@ -105,5 +105,4 @@ def add_common(pastry):
   """
   pastry.addIngredient("README.md")
   pastry.addIngredient("License.txt")
-  for ingredient in root.glob("*.cmake"):
-    pastry.addIngredient(ingredient)
+  pastry.addIngredients(scanner.glob(root, "*.cmake", dirs=False))
@@ -20,6 +20,7 @@ setup(
   author="lab132",
   author_email="nobody@nowhere.nevada",
   license="MIT",
+  python_requires=">=3.7",
   classifiers=[
     # How mature is this project? Common values are
     #   3 - Alpha
@@ -36,7 +37,7 @@ setup(
 
     # Specify the Python versions you support here. In particular, ensure
     # that you indicate whether you support Python 2, Python 3 or both.
-    'Programming Language :: Python :: 3.4',
+    'Programming Language :: Python :: 3.7',
   ],
   keywords="packaging package management distribution dependencies pie bake shop pastry oven stock menu shopping list",
   packages=['PyBake'],
@@ -0,0 +1,83 @@
+from tests import *
+from PyBake.archive import *
+from PyBake.oven import Pastry as OvenPastry, bakePastry
+import tarfile
+import zipfile
+
+
+class ArchiveTests(TestCase):
+  def bake(self, archiveFormat, *, reproducible=False, ingredients=("src/a.h", "src/b.h"), fileName="foo.pastry"):
+    Path("src").safe_mkdir()
+    Path("src/a.h").write_text("a")
+    Path("src/b.h").write_text("b")
+    pastry = OvenPastry(name="foo", version="0.1.0")
+    pastry.addIngredients(ingredients)
+    pastry.addDependency("bar", "==1.0.0")
+    pastry.addDependency("baz", ">=0.1.0")
+    bakePastry(fileName, pastry, zipfile.ZIP_DEFLATED, archiveFormat=archiveFormat, reproducible=reproducible)
+    return Path(fileName)
+
+  def check(self, archiveFormat):
+    pastryPath = self.bake(archiveFormat)
+    self.assertEqual(detectArchiveFormat(pastryPath), archiveFormat)
+    self.assertEqual(json.loads(readArchiveMember(pastryPath, "pastry.json").decode("UTF-8"))["name"], "foo")
+    self.assertIsNone(readArchiveMember(pastryPath, "missing.json"))
+    self.assertEqual(sorted(listArchive(pastryPath)), [("src/a.h", 1), ("src/b.h", 1)])
+    extractArchive(pastryPath, "out")
+    self.assertEqual(sorted(p.as_posix() for p in Path("out").rglob("*") if p.is_file()), ["out/src/a.h", "out/src/b.h"])
+
+  def test_Zip(self):
+    self.check(zipArchiveFormat)
+
+  def test_Tar(self):
+    self.check(tarArchiveFormat)
+
+  def test_TarFileName(self):
+    # A tar extension is enough, no matter what is in the file.
+    pastryPath = self.bake(tarArchiveFormat, fileName="foo.tar.xz")
+    self.assertEqual(detectArchiveFormat(pastryPath), tarArchiveFormat)
+    Path("empty.txz").write_bytes(b"")
+    self.assertEqual(detectArchiveFormat("empty.txz"), tarArchiveFormat)
+    self.assertEqual(detectArchiveFormat(self.bake(zipArchiveFormat, fileName="foo.zip")), zipArchiveFormat)
+
+  def test_TarMetadataOnly(self):
+    Path("big.bin").write_bytes(os.urandom(1024 * 1024))
+    with TarWriter("foo.pastry") as archive:
+      archive.writestr("pastry.json", b"{}")
+      archive.write("big.bin")
+    # Cut off the ingredients; metadata lookups must not read that far.
+    with open("foo.pastry", "r+b") as pastryFile:
+      pastryFile.truncate(64 * 1024)
+    self.assertEqual(readArchiveMember("foo.pastry", "pastry.json"), b"{}")
+    self.assertIsNone(readArchiveMember("foo.pastry", "ingredients.json"))
+    with self.assertRaises(tarfile.ReadError):
+      readArchiveMember("foo.pastry", "missing.bin")
+
+  def checkReproducible(self, archiveFormat):
+    first = self.bake(archiveFormat, reproducible=True, fileName="first.pastry")
+    # Different timestamps and a different order of ingredients must not matter.
+    os.utime("src/a.h", (0, 1234567890))
+    second = self.bake(archiveFormat, reproducible=True, ingredients=("src/b.h", "src/a.h"), fileName="second.pastry")
+    self.assertEqual(first.read_bytes(), second.read_bytes())
+    self.assertEqual(archiveDigest(first), archiveDigest(second))
+    self.check(archiveFormat)
+
+  def test_ReproducibleZip(self):
+    self.checkReproducible(zipArchiveFormat)
+    with zipfile.ZipFile("first.pastry") as zipFile:
+      self.assertEqual(zipFile.namelist(), ["pastry.json", "ingredients.json", "src/a.h", "src/b.h"])
+      self.assertEqual({info.date_time for info in zipFile.infolist()}, {(1980, 1, 1, 0, 0, 0)})
+
+  def test_ReproducibleWritestr(self):
+    info = zipfile.ZipInfo("info.txt")
+    with ReproducibleZipFile("foo.zip", "w", compression=zipfile.ZIP_STORED) as zipFile:
+      zipFile.writestr("name.txt", b"x" * 1000, compress_type=zipfile.ZIP_BZIP2)
+      zipFile.writestr(info, b"x" * 1000, compress_type=zipfile.ZIP_DEFLATED, compresslevel=9)
+      zipFile.writestr("default.txt", b"x" * 1000)
+    with zipfile.ZipFile("foo.zip") as zipFile:
+      self.assertEqual([info.compress_type for info in zipFile.infolist()],
+                       [zipfile.ZIP_BZIP2, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+      self.assertEqual(zipFile.read("info.txt"), b"x" * 1000)
+
+  def test_ReproducibleTar(self):
+    self.checkReproducible(tarArchiveFormat)
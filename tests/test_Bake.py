@@ -0,0 +1,113 @@
+from tests import *
+from PyBake.oven import Pot, zipBaker, bakePastryJob
+from PyBake.logger import log, BufferedLogSink, ScopedLogSink, replayRecords, LogLevel
+import zipfile
+
+
+class BakeTests(TestCase):
+  def makePot(self, *, broken=False):
+    Path("src").safe_mkdir()
+    pot = Pot()
+    for i in range(4):
+      Path("src/file{}.h".format(i)).write_text("#define VALUE {}\n".format(i) * 10)
+      pot.get("pastry{}".format(i), "0.1.0").addIngredient("src/file{}.h".format(i))
+    if broken:
+      pot.get("pastry2", "0.1.0").addIngredient("src/missing.h")
+    return pot
+
+  def bake(self, dirName, *, jobs, broken=False):
+    Path(dirName).safe_mkdir()
+    menu = Menu(dirName)
+    zipBaker(menu=menu, pot=self.makePot(broken=broken),
+             options={"compression": zipfile.ZIP_DEFLATED, "jobs": jobs, "reproducible": True})
+    return menu
+
+  def test_JobsMatchSerial(self):
+    serial = self.bake("serial", jobs=1)
+    parallel = self.bake("parallel", jobs=2)
+    self.assertEqual([(str(p), p.digest) for p in parallel], [(str(p), p.digest) for p in serial])
+    for pastry in serial:
+      self.assertEqual(parallel.makePath(pastry).read_bytes(), serial.makePath(pastry).read_bytes())
+
+  def test_JobsFailurePropagates(self):
+    for jobs in (1, 2):
+      Path("broken{}".format(jobs)).safe_mkdir()
+      menu = Menu("broken{}".format(jobs))
+      with self.assertRaises(FileNotFoundError):
+        zipBaker(menu=menu, pot=self.makePot(broken=True), options={"compression": zipfile.ZIP_DEFLATED, "jobs": jobs})
+    # The other pastries are still baked, but the broken one is not on the menu.
+    self.assertEqual([p.name for p in menu], ["pastry0", "pastry1", "pastry3"])
+
+  def test_JobLogRecords(self):
+    pot = self.makePot(broken=True)
+    sinks, verbosity = log.sinks, log.verbosity
+    try:
+      records, error = bakePastryJob("broken.zip", pot.get("pastry2", "0.1.0"), zipfile.ZIP_DEFLATED, {}, None,
+                                     "zip", False, LogLevel.Debug)
+      self.assertIsInstance(error, FileNotFoundError)
+      self.assertIn((int(LogLevel.Info), "Writing ingredients.json..."), records)
+      # Replay into a fresh sink; the job replaced the sinks of the global logger.
+      sink = BufferedLogSink()
+      log.sinks = [sink]
+      replayRecords(records)
+      self.assertEqual(sink.records, records)
+    finally:
+      log.sinks, log.verbosity = sinks, verbosity
+
+  def markOld(self, pastryPath):
+    os.utime(pastryPath.as_posix(), (0, 0))
+
+  def wasRebaked(self, pastryPath):
+    return pastryPath.stat().st_mtime != 0
+
+  def bakeForced(self, pot, **options):
+    menu = Menu("out")
+    menu.load()
+    with ScopedLogSink() as sink:
+      zipBaker(menu=menu, pot=pot, force=True, options=dict(options, compression=zipfile.ZIP_DEFLATED))
+    menu.save()
+    return menu, sink
+
+  def test_Fingerprints(self):
+    Path("out").safe_mkdir()
+    pot = self.makePot()
+    menu, _ = self.bakeForced(pot)
+    fingerprints = json.loads(Path("out/fingerprints.json").read_text())
+    self.assertEqual(sorted(fingerprints), ["pastry{} 0.1.0".format(i) for i in range(4)])
+    self.assertIsNone(fingerprints["pastry0 0.1.0"]["content"])
+
+    # Unchanged pastries are not baked again, even with force.
+    pastryPath = menu.makePath(menu.get("pastry0", "0.1.0"))
+    self.markOld(pastryPath)
+    self.bakeForced(pot)
+    self.assertFalse(self.wasRebaked(pastryPath))
+
+    # Without force, changed pastries are skipped with a warning.
+    Path("src/file0.h").write_text("changed")
+    with ScopedLogSink() as sink:
+      zipBaker(menu=menu, pot=pot, options={"compression": zipfile.ZIP_DEFLATED})
+    self.assertEqual(len(sink.logged["error"]), 1)
+    self.assertIn("pastry0 0.1.0", sink.logged["error"][0])
+    self.assertFalse(self.wasRebaked(pastryPath))
+
+  def test_ContentHash(self):
+    Path("out").safe_mkdir()
+    pot = self.makePot()
+    menu, _ = self.bakeForced(pot, contentHash=True)
+    pastryPath = menu.makePath(menu.get("pastry0", "0.1.0"))
+    self.markOld(pastryPath)
+    # Same size and timestamp, different contents.
+    stat = os.stat("src/file0.h")
+    Path("src/file0.h").write_text(Path("src/file0.h").read_text().replace("0", "9"))
+    os.utime("src/file0.h", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    self.bakeForced(pot)
+    # Switching content hashing off changes the fingerprint, so the pastry is baked once more.
+    self.assertTrue(self.wasRebaked(pastryPath))
+    self.markOld(pastryPath)
+    Path("src/file0.h").write_text(Path("src/file0.h").read_text().replace("9", "0"))
+    os.utime("src/file0.h", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    # Only the content hash notices the change.
+    self.bakeForced(pot)
+    self.assertFalse(self.wasRebaked(pastryPath))
+    self.bakeForced(pot, contentHash=True)
+    self.assertTrue(self.wasRebaked(pastryPath))
@@ -0,0 +1,220 @@
+from tests import *
+from PyBake.basket import downloadPastry, partialDownloadPaths, writePartialInfo, planDownloads, installPastry, Receipt
+from PyBake.shop import Shop, PooledWSGIServer, SendfileWrapper
+from PyBake.oven import Pastry as OvenPastry, bakePastry
+from PyBake.archive import archiveDigest
+import os
+import requests
+import threading
+import zipfile
+
+
+class TruncateFirstDownload:
+  """WSGI middleware that breaks off the first /get_pastry response halfway and records all Range headers."""
+
+  def __init__(self, app):
+    self.app = app
+    self.truncated = False
+    self.ranges = []
+
+  def __call__(self, environ, start_response):
+    self.ranges.append(environ.get("HTTP_RANGE"))
+    if self.truncated or environ["PATH_INFO"] != "/get_pastry":
+      return self.app(environ, start_response)
+    self.truncated = True
+    body = b"".join(self.app(environ, lambda status, headers, exc_info=None: start_response(
+      status, headers + [("Connection", "close")])))
+    return [body[:len(body) // 2]]
+
+
+class RecordRequests:
+  """WSGI middleware that records the paths of all requests."""
+
+  def __init__(self, app):
+    self.app = app
+    self.paths = []
+
+  def __call__(self, environ, start_response):
+    self.paths.append(environ["PATH_INFO"])
+    self.appIter = self.app(environ, start_response)
+    return self.appIter
+
+
+class BasketTests(TestCase):
+  def setUp(self):
+    super().setUp()
+    Path("src").safe_mkdir()
+    with open("src/a.bin", "wb") as ingredientFile:
+      ingredientFile.write(os.urandom(256 * 1024))
+    Path("shop").safe_mkdir()
+    self.shopMenu = Menu("shop")
+    pastry = OvenPastry(name="foo", version="0.1.0")
+    pastry.addIngredient("src/a.bin")
+    self.pastryPath = self.shopMenu.makePath(pastry)
+    bakePastry(self.pastryPath, pastry, zipfile.ZIP_STORED)
+    self.shopMenu.add(Pastry(name="foo", version="0.1.0", digest=archiveDigest(self.pastryPath)))
+    self.shopMenu.save()
+    Path("client").safe_mkdir()
+    self.clientMenu = Menu("client")
+
+  def serve(self, app):
+    server = PooledWSGIServer("127.0.0.1", 0, app, threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(server.shutdown)
+    return "http://127.0.0.1:{}".format(server.server_port)
+
+  def checkDownloaded(self):
+    pastry = self.clientMenu.get("foo", "0.1.0")
+    self.assertEqual(pastry.digest, archiveDigest(self.pastryPath))
+    clientPath = self.clientMenu.makePath(pastry)
+    self.assertEqual(clientPath.read_bytes(), self.pastryPath.read_bytes())
+    self.assertFalse(any(path.exists() for path in partialDownloadPaths(clientPath)))
+
+  def test_ShopRange(self):
+    client = Shop(menu=self.shopMenu).test_client()
+    response = client.get("/pastry/foo/0.1.0", headers={"Range": "bytes=100-"})
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(response.data, self.pastryPath.read_bytes()[100:])
+    self.assertEqual(response.headers["X-Pastry-Digest"], archiveDigest(self.pastryPath))
+    self.assertEqual(client.get("/pastry/foo/0.2.0").status_code, 404)
+    self.assertEqual(client.get("/pastry/foo/latest").status_code, 400)
+
+  def test_ResumeInterrupted(self):
+    app = TruncateFirstDownload(Shop(menu=self.shopMenu))
+    self.assertIsNone(downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, self.serve(app),
+                                     forceDownload=False))
+    self.checkDownloaded()
+    self.assertEqual(len(app.ranges), 2)
+    self.assertTrue(app.ranges[1].startswith("bytes="))
+
+  def test_ResumePrevious(self):
+    app = TruncateFirstDownload(Shop(menu=self.shopMenu))
+    app.truncated = True
+    clientPath = self.clientMenu.makePath(Pastry(name="foo", version="0.1.0"))
+    partialPath, _ = partialDownloadPaths(clientPath)
+    partialPath.write_bytes(self.pastryPath.read_bytes()[:1000])
+    writePartialInfo(clientPath, "0.1.0", '"{}"'.format(archiveDigest(self.pastryPath)))
+    downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, self.serve(app), forceDownload=False)
+    self.checkDownloaded()
+    self.assertEqual(app.ranges, [None, "bytes=1000-"])
+
+  def test_DiscardOtherPartial(self):
+    clientPath = self.clientMenu.makePath(Pastry(name="foo", version="0.1.0"))
+    partialPath, _ = partialDownloadPaths(clientPath)
+    partialPath.write_bytes(b"garbage")
+    writePartialInfo(clientPath, "0.1.0", '"other"')
+    downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, self.serve(Shop(menu=self.shopMenu)),
+                   forceDownload=False)
+    self.checkDownloaded()
+
+  def test_Revalidate(self):
+    server = self.serve(Shop(menu=self.shopMenu))
+    downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, server, forceDownload=False)
+    clientPath = self.clientMenu.makePath(self.clientMenu.get("foo", "0.1.0"))
+    inode = clientPath.stat().st_ino
+    # Unchanged pastries are not downloaded again.
+    downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, server, forceDownload=True)
+    self.assertEqual(clientPath.stat().st_ino, inode)
+    self.checkDownloaded()
+    # Changed pastries are.
+    with open("src/a.bin", "wb") as ingredientFile:
+      ingredientFile.write(os.urandom(1024))
+    pastry = OvenPastry(name="foo", version="0.1.0")
+    pastry.addIngredient("src/a.bin")
+    bakePastry(self.pastryPath, pastry, zipfile.ZIP_STORED)
+    # Changes to the shop's menu invalidate the pastries the shop has cached.
+    self.shopMenu.remove(pastry)
+    self.shopMenu.add(Pastry(name="foo", version="0.1.0", digest=archiveDigest(self.pastryPath)))
+    downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, server, forceDownload=True)
+    self.checkDownloaded()
+    # So do uploads.
+    with open("src/a.bin", "wb") as ingredientFile:
+      ingredientFile.write(os.urandom(1024))
+    bakePastry("upload.zip", pastry, zipfile.ZIP_STORED)
+    with open("upload.zip", "rb") as pastryFile:
+      response = requests.post("{}/upload_pastry".format(server), data={"name": "foo", "version": "0.1.0", "force": "1"},
+                               files={"pastry": pastryFile})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(archiveDigest(self.pastryPath), archiveDigest("upload.zip"))
+    downloadPastry(self.clientMenu, {"name": "foo", "version": "0.1.0"}, server, forceDownload=True)
+    self.checkDownloaded()
+
+  def test_ShopNotModified(self):
+    client = Shop(menu=self.shopMenu).test_client()
+    etag = '"{}"'.format(archiveDigest(self.pastryPath))
+    response = client.post("/get_pastry", data={"name": "foo", "version": "0.1.0"}, headers={"If-None-Match": etag})
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response.headers["ETag"], etag)
+    self.assertEqual(response.headers["X-Pastry-Version"], "0.1.0")
+    self.assertEqual(client.get("/pastry/foo/0.1.0", headers={"If-None-Match": etag}).status_code, 304)
+    response = client.get("/pastry/foo/0.1.0", headers={"If-None-Match": '"other"'})
+    self.assertEqual(response.status_code, 200)
+    response.close()
+
+  def test_ShopComputesMissingDigest(self):
+    self.shopMenu.remove(self.shopMenu.get("foo", "0.1.0"))
+    self.shopMenu.add(Pastry(name="foo", version="0.1.0"))
+    response = Shop(menu=self.shopMenu).test_client().post("/get_pastry", data={"name": "foo", "version": "0.1.0"})
+    self.assertEqual(response.headers["X-Pastry-Digest"], archiveDigest(self.pastryPath))
+    response.close()
+    self.assertEqual(self.shopMenu.get("foo", "0.1.0").digest, archiveDigest(self.pastryPath))
+
+  def test_PlanDownloads(self):
+    app = OvenPastry(name="app", version="1.0.0")
+    app.addIngredient("src/a.bin")
+    app.addDependency("foo", ">=0.1.0")
+    bakePastry(self.shopMenu.makePath(app), app, zipfile.ZIP_STORED)
+    self.shopMenu.add(Pastry(name="app", version="1.0.0"))
+    shop = RecordRequests(Shop(menu=self.shopMenu))
+    client = Shop(menu=self.shopMenu).test_client()
+
+    response = client.post("/resolve", json={"pastries": [{"name": "app", "version": ">=1.0.0"}]})
+    self.assertEqual(response.status_code, 200)
+    pastries = response.get_json()["pastries"]
+    self.assertEqual([(entry["name"], entry["version"]) for entry in pastries], [("app", "1.0.0"), ("foo", "0.1.0")])
+    self.assertEqual(pastries[1]["digest"], archiveDigest(self.pastryPath))
+    self.assertEqual(pastries[1]["size"], self.pastryPath.stat().st_size)
+    self.assertEqual(pastries[0]["dependencies"], [{"name": "foo", "version": ">=0.1.0"}])
+    response = client.post("/resolve", json={"pastries": [{"name": "bar", "version": "1.0.0"}]})
+    self.assertEqual(response.status_code, 400)
+
+    server = self.serve(shop)
+    pastryData = {"name": "app", "version": ">=1.0.0", "destination": "install"}
+    planned = planDownloads(self.clientMenu, [pastryData], server, forceDownload=False)
+    self.assertEqual(planned, {("app", "1.0.0"), ("foo", "0.1.0")})
+    self.checkDownloaded()
+    receipt = Receipt(key="test", dirPath=Path("receipts").resolve())
+    del shop.paths[:]
+    installPastry(self.clientMenu, receipt, pastryData, server, forceDownload=True, forceInstall=False,
+                  planned=planned)
+    # Everything was downloaded up front.
+    self.assertEqual(shop.paths, [])
+    self.assertTrue(receipt.get("foo", "0.1.0"))
+
+  def test_ResolveMissingFile(self):
+    app = OvenPastry(name="app", version="1.0.0")
+    app.addIngredient("src/a.bin")
+    app.addDependency("foo", ">=0.1.0")
+    bakePastry(self.shopMenu.makePath(app), app, zipfile.ZIP_STORED)
+    self.shopMenu.add(Pastry(name="app", version="1.0.0"))
+    client = Shop(menu=self.shopMenu).test_client()
+    self.pastryPath.unlink()
+    response = client.post("/resolve", json={"pastries": [{"name": "app", "version": "1.0.0"},
+                                                          {"name": "foo", "version": "0.1.0"}]})
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.get_json()["errors"], ["Pastry file is missing: foo 0.1.0"])
+    self.assertEqual(client.get("/pastry/foo/0.1.0").status_code, 404)
+
+  def test_Sendfile(self):
+    shop = RecordRequests(Shop(menu=self.shopMenu))
+    server = self.serve(shop)
+    response = requests.post("{}/get_pastry".format(server), data={"name": "foo", "version": "0.1.0"})
+    self.assertEqual(response.content, self.pastryPath.read_bytes())
+    self.assertIsInstance(shop.appIter, SendfileWrapper)
+    self.assertTrue(shop.appIter._headersSent)
+    # Range responses are sent through the wrapper without sendfile.
+    response = requests.get("{}/pastry/foo/0.1.0".format(server), headers={"Range": "bytes=1000-"})
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(response.content, self.pastryPath.read_bytes()[1000:])
@@ -0,0 +1,42 @@
+from tests import *
+from benchmarks import benchmark, suites, compareResults, saveResults, loadResults
+from benchmarks.__main__ import main
+import time
+
+
+class BenchmarkTests(TestCase):
+  def setUp(self):
+    super().setUp()
+    # A suite that is fast enough for unit tests, instead of the real ones with servers and process pools.
+    self.seconds = 0.0
+
+    def smoke(recorder, scale):
+      with recorder.measure("smoke.sleep", ops=scale["downloads"]):
+        time.sleep(self.seconds)
+
+    benchmark("smoke")(smoke)
+    self.addCleanup(suites.remove, ("smoke", smoke))
+
+  def test_Cli(self):
+    self.assertEqual(main(["--scale", "tiny", "--only", "smoke", "--repeat", "2", "-o", "results/tiny.json"]), 0)
+    results = loadResults("results/tiny.json")
+    self.assertEqual(results["scale"], "tiny")
+    self.assertEqual(list(results["results"]), ["smoke.sleep"])
+    self.assertEqual(results["results"]["smoke.sleep"]["ops"], 20)
+
+    # Pretend the baseline was much faster.
+    results["results"]["smoke.sleep"]["seconds"] = 0.0001
+    saveResults("results/baseline.json", results)
+    self.seconds = 0.01
+    self.assertEqual(main(["--scale", "tiny", "--only", "smoke", "--baseline", "results/baseline.json"]), 1)
+    self.assertEqual(main(["--scale", "tiny", "--only", "smoke", "--baseline", "results/baseline.json",
+                           "--tolerance", "1000"]), 0)
+    with self.assertRaises(SystemExit):
+      main(["--only", "unknown"])
+
+  def test_Compare(self):
+    baseline = {"scale": "tiny", "results": {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}}}
+    results = {"scale": "tiny", "results": {"a": {"seconds": 1.2}, "b": {"seconds": 1.5}, "c": {"seconds": 9.0}}}
+    self.assertEqual(compareResults(results, baseline, tolerance=0.25), [("b", 1.0, 1.5)])
+    with self.assertRaises(ValueError):
+      compareResults(dict(results, scale="small"), baseline)
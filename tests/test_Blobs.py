@@ -0,0 +1,97 @@
+from tests import *
+from PyBake.blobs import BlobStore, hashFile, ingredientArcName
+from PyBake.oven import Pastry as OvenPastry, bakePastry
+from PyBake.depot import uploadPastry
+from PyBake.shop import Shop, PooledWSGIServer
+from PyBake.basket import installPastry, Receipt
+import io
+import threading
+import zipfile
+
+
+class BlobStoreTests(TestCase):
+  def test_AddAndCopy(self):
+    Path("a.txt").write_text("same")
+    Path("b.txt").write_text("same")
+    store = BlobStore("BlobTests/blobs")
+    digest = store.add("a.txt")
+    self.assertEqual(digest, hashFile("a.txt"))
+    self.assertEqual(store.add("b.txt"), digest)
+    self.assertEqual(len(list(store.dirPath.rglob("*"))), 2)
+    self.assertEqual(store.missing([digest, "0" * 40]), ["0" * 40])
+    store.copyTo(digest, "BlobTests/out/c.txt")
+    self.assertEqual(Path("BlobTests/out/c.txt").read_text(), "same")
+
+  def test_WriteValidatesDigest(self):
+    store = BlobStore("BlobTests/blobs")
+    with self.assertRaises(ValueError):
+      store.write("0" * 40, io.BytesIO(b"not matching"))
+    self.assertFalse(store.has("0" * 40))
+    self.assertEqual(list(store.dirPath.rglob("*.tmp")), [])
+
+  def test_ArcName(self):
+    self.assertEqual(ingredientArcName("./foo/bar.h"), "foo/bar.h")
+    self.assertEqual(ingredientArcName("/abs/../bar.h"), "abs/bar.h")
+
+
+class RecordRequests:
+  """WSGI middleware that records the paths of all requests."""
+
+  def __init__(self, app):
+    self.app = app
+    self.paths = []
+
+  def __call__(self, environ, start_response):
+    self.paths.append(environ["PATH_INFO"])
+    return self.app(environ, start_response)
+
+
+class BlobRoundTripTests(TestCase):
+  def bake(self, menu, name, paths):
+    pastry = OvenPastry(name=name, version="0.1.0")
+    pastry.addIngredients(paths)
+    bakePastry(menu.makePath(pastry), pastry, zipfile.ZIP_DEFLATED, blobsDirPath=menu.pastryDirPath / "blobs")
+    return menu.add(Pastry(name=name, version="0.1.0"))
+
+  def test_UploadAndInstall(self):
+    Path("src").safe_mkdir()
+    Path("src/shared.bin").write_bytes(os.urandom(64 * 1024))
+    Path("src/foo.txt").write_text("foo")
+    Path("src/bar.txt").write_text("bar")
+    Path("oven").safe_mkdir()
+    ovenMenu = Menu("oven")
+    foo = self.bake(ovenMenu, "foo", ["src/shared.bin", "src/foo.txt"])
+    bar = self.bake(ovenMenu, "bar", ["src/shared.bin", "src/bar.txt"])
+
+    Path("shop").safe_mkdir()
+    shopMenu = Menu("shop")
+    app = RecordRequests(Shop(menu=shopMenu))
+    server = PooledWSGIServer("127.0.0.1", 0, app, threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(server.shutdown)
+    url = "http://127.0.0.1:{}".format(server.server_port)
+
+    uploadPastry(ovenMenu, foo, url, force=False)
+    self.assertEqual(app.paths.count("/upload_blob"), 2)
+    # The shared blob is only uploaded once.
+    uploadPastry(ovenMenu, bar, url, force=False)
+    self.assertEqual(app.paths.count("/upload_blob"), 3)
+    self.assertEqual(app.paths.count("/missing_blobs"), 2)
+    shopMenu.refresh()
+    self.assertIsNotNone(shopMenu.get("foo", "0.1.0"))
+    self.assertIsNotNone(shopMenu.get("bar", "0.1.0"))
+
+    Path("client").safe_mkdir()
+    clientMenu = Menu("client")
+    receipt = Receipt(key="test", dirPath=Path("receipts").resolve())
+    for name in ("foo", "bar"):
+      installPastry(clientMenu, receipt, {"name": name, "version": "0.1.0", "destination": name}, url,
+                    forceDownload=False, forceInstall=False)
+      self.assertEqual(Path(name, "src/shared.bin").read_bytes(), Path("src/shared.bin").read_bytes())
+      self.assertEqual(Path(name, "src", name + ".txt").read_text(), name)
+    # Blobs already in the client's store are not downloaded again.
+    self.assertEqual(app.paths.count("/get_blob/{}".format(hashFile("src/shared.bin"))), 1)
+    self.assertEqual(len([path for path in app.paths if path.startswith("/get_blob/")]), 3)
+    self.assertEqual(len(receipt), 2)
@@ -0,0 +1,77 @@
+from tests import *
+from PyBake.oven import Pastry as OvenPastry, bakePastry, chooseCompression, adaptiveCompressionRules
+from PyBake.shop import Shop, PooledWSGIServer
+from PyBake.basket import installPastry, Receipt
+from PyBake.metadata import MetadataIndex
+import threading
+import zipfile
+
+
+class CompressionTests(TestCase):
+  def bake(self):
+    Path("src").safe_mkdir()
+    files = {
+      "src/text.txt": b"compressible " * 1000,
+      "src/data.dat": b"compressible " * 1000,
+      "src/DATA2.DAT": b"compressible " * 1000,
+      "src/random.bin": os.urandom(64 * 1024),
+      "src/image.png": b"compressible " * 1000,
+    }
+    for path, data in files.items():
+      Path(path).write_bytes(data)
+    pastry = OvenPastry(name="foo", version="0.1.0")
+    pastry.addIngredients(sorted(files))
+    Path("shop").safe_mkdir()
+    self.shopMenu = Menu("shop")
+    pastryPath = self.shopMenu.makePath(pastry)
+    rules = adaptiveCompressionRules({".DAT": "stored", "*": "bzip2"})
+    bakePastry(pastryPath, pastry, adaptiveCompression, rules)
+    return files, pastryPath
+
+  def test_ChooseCompression(self):
+    files, _ = self.bake()
+    rules = adaptiveCompressionRules({".DAT": "stored", "*": "bzip2"})
+    self.assertEqual(chooseCompression("src/text.txt", rules), zipfile.ZIP_BZIP2)
+    self.assertEqual(chooseCompression("src/DATA2.DAT", rules), zipfile.ZIP_STORED)
+    self.assertEqual(chooseCompression("src/random.bin", rules), zipfile.ZIP_STORED)
+    self.assertEqual(chooseCompression("src/text.txt", adaptiveCompressionRules()), zipfile.ZIP_DEFLATED)
+
+  def test_AdaptiveBake(self):
+    files, pastryPath = self.bake()
+    expected = {
+      "src/text.txt": zipfile.ZIP_BZIP2,
+      "src/data.dat": zipfile.ZIP_STORED,
+      "src/DATA2.DAT": zipfile.ZIP_STORED,
+      "src/random.bin": zipfile.ZIP_STORED,
+      "src/image.png": zipfile.ZIP_STORED,
+    }
+    with zipfile.ZipFile(pastryPath.as_posix()) as zipFile:
+      self.assertEqual({info.filename: info.compress_type for info in zipFile.infolist() if info.filename in files},
+                       expected)
+      ingredients = json.loads(zipFile.read("ingredients.json").decode("UTF-8"))
+    names = {zipfile.ZIP_STORED: "stored", zipfile.ZIP_BZIP2: "bzip2"}
+    self.assertEqual(ingredients, [{"path": path, "compression": names[expected[path]]} for path in sorted(files)])
+
+    # The shop indexes the new schema, and the basket installs the pastry.
+    self.shopMenu.add(Pastry(name="foo", version="0.1.0"))
+    server = PooledWSGIServer("127.0.0.1", 0, Shop(menu=self.shopMenu), threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+      url = "http://127.0.0.1:{}".format(server.server_port)
+      client = Shop(menu=self.shopMenu).test_client()
+      response = client.get("/pastry/foo/0.1.0/files")
+      self.assertEqual(sorted((entry["path"], entry["size"]) for entry in response.get_json()["files"]),
+                       sorted((path, len(data)) for path, data in files.items()))
+      digest = self.shopMenu.get("foo", "0.1.0").digest
+      self.assertEqual(MetadataIndex(self.shopMenu.pastryDirPath / "metadata").get(digest)["ingredients"], ingredients)
+
+      Path("client").safe_mkdir()
+      receipt = Receipt(key="test", dirPath=Path("receipts").resolve())
+      installPastry(Menu("client"), receipt, {"name": "foo", "version": "0.1.0", "destination": "install"}, url,
+                    forceDownload=False, forceInstall=False)
+    finally:
+      server.shutdown()
+      thread.join()
+    for path, data in files.items():
+      self.assertEqual(Path("install", path).read_bytes(), data)
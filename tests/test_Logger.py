@@ -0,0 +1,55 @@
+from tests import *
+from PyBake.logger import LogBackend, LogBlock, ScopedLogSink
+import threading
+
+
+class RecordingSink:
+  """Log sink that records messages with their block level."""
+
+  def __init__(self):
+    self.messages = []
+
+  def logMessage(self, *, verbosity, message, blockLevel):
+    self.messages.append((message, blockLevel))
+
+  def logBlock(self, *, block, isOpening):
+    pass
+
+
+class LoggerTests(TestCase):
+  def test_ThreadLocalBlocks(self):
+    sink = RecordingSink()
+    backend = LogBackend(sinks=[sink])
+    opened = threading.Event()
+    mainOpened = threading.Event()
+    closed = threading.Event()
+
+    def other():
+      with LogBlock("other", backend=backend):
+        backend.success("other")
+        opened.set()
+        mainOpened.wait(5)
+      # Closing a block while another thread has one open must not mix up the stacks.
+      closed.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    opened.wait(5)
+    with LogBlock("main", backend=backend):
+      with LogBlock("inner", backend=backend):
+        mainOpened.set()
+        closed.wait(5)
+        backend.success("main")
+    thread.join()
+    self.assertEqual(sorted(sink.messages), [("main", 2), ("other", 1)])
+    self.assertEqual(backend.blockLevel, 0)
+
+  def test_ScopedLogSinkThread(self):
+    backend = LogBackend(sinks=[])
+    with ScopedLogSink(backend) as sink:
+      thread = threading.Thread(target=backend.error, args=("other",))
+      thread.start()
+      thread.join()
+      backend.error("mine")
+    self.assertEqual(sink.logged["error"], ["mine"])
+    self.assertEqual(backend.sinks, [])
@@ -35,3 +35,194 @@ class MenuTests(TestCase):
     m.load()
     self.assertEqual(len(m), 1)
     self.assertEqual(m.get(p1.name, p1.version), p1)
+
+  def test_GetBestMatch(self):
+    m = Menu()
+    for version in ("0.2.0", "0.1.0", "1.0.0", "0.3.0-rc1"):
+      m.add(Pastry(name="foo", version=version))
+    m.add(Pastry(name="bar", version="2.0.0"))
+    self.assertEqual(len(m), 5)
+    self.assertEqual(m.get("foo", ">=0.1.0").version, Version("1.0.0"))
+    self.assertEqual(m.get("foo", "<1.0.0").version, Version("0.3.0-rc1"))
+    self.assertEqual(m.get("foo", Version("0.2.0")).version, Version("0.2.0"))
+    self.assertIsNone(m.get("foo", Version("0.4.0")))
+    self.assertIsNone(m.get("baz", ">=0.0.0"))
+    self.assertEqual([str(p) for p in m], ["bar 2.0.0", "foo 0.1.0", "foo 0.2.0", "foo 0.3.0-rc1", "foo 1.0.0"])
+
+  def test_AddDuplicate(self):
+    m = Menu()
+    p1 = Pastry(name="foo", version="0.1.0")
+    self.assertIs(m.add(p1), p1)
+    self.assertIs(m.add(Pastry(name="foo", version="0.1.0")), p1)
+    self.assertEqual(len(m), 1)
+    self.assertTrue(m.remove(Pastry(name="foo", version="0.1.0")))
+    self.assertFalse(m.remove(p1))
+    self.assertEqual(len(m), 0)
+    self.assertEqual(m.registry, [])
+
+  def test_Journal(self):
+    m = Menu("MenuTests/test_Journal.json")
+    p1 = Pastry(name="foo", version="0.1.0")
+    p2 = Pastry(name="foo", version="0.2.0")
+    m.add(p1)
+    m.add(p2)
+    m.save()
+    m.remove(p1)
+    m.save()
+    # Changes are only appended to the journal, the menu file itself is untouched.
+    with m.filePath.open("r") as menuFile:
+      self.assertEqual(json.load(menuFile), [])
+    self.assertTrue(m.journalFilePath.exists())
+    m2 = Menu(m.filePath)
+    m2.load()
+    self.assertEqual(m2.registry, [p2])
+    m2.compact()
+    self.assertFalse(m2.journalFilePath.exists())
+    m3 = Menu(m.filePath)
+    m3.load()
+    self.assertEqual(m3.registry, [p2])
+
+  def test_JournalCompaction(self):
+    m = Menu("MenuTests/test_JournalCompaction.json")
+    for patch in range(Menu.journalCompactionThreshold + 1):
+      m.add(Pastry(name="foo", version="0.1.{}".format(patch)))
+    m.save()
+    self.assertFalse(m.journalFilePath.exists())
+    m2 = Menu(m.filePath)
+    m2.load()
+    self.assertEqual(len(m2), Menu.journalCompactionThreshold + 1)
+
+  def test_Snapshot(self):
+    m = Menu("MenuTests/test_Snapshot.json")
+    for name in ("foo", "bar"):
+      for version in ("0.1.0", "0.2.0"):
+        m.add(Pastry(name=name, version=version))
+    m.compact()
+    self.assertTrue(m.snapshotFilePath.exists())
+    m2 = Menu(m.filePath)
+    self.assertEqual(m2.load(), 4)
+    # Nothing is parsed until it is needed.
+    self.assertIsNotNone(m2._snapshot)
+    self.assertEqual(len(m2._index), 0)
+    self.assertEqual(len(m2), 4)
+    self.assertEqual(m2.get("foo", ">0.1.0").version, Version("0.2.0"))
+    self.assertEqual(len(m2._index), 1)
+    self.assertEqual(m2.registry, m.registry)
+
+  def test_SnapshotRepeatedLoad(self):
+    m = Menu("MenuTests/test_SnapshotRepeatedLoad.json")
+    for version in ("0.1.0", "0.2.0", "0.3.0"):
+      m.add(Pastry(name="foo", version=version))
+    m.add(Pastry(name="bar", version="1.0.0"))
+    m.compact()
+    m2 = Menu(m.filePath)
+    m2.load()
+    self.assertEqual(len(m2), 4)
+    m2.load()
+    self.assertEqual(len(m2), 4)
+    self.assertEqual(m2.registry, m.registry)
+    self.assertEqual(len(m2), 4)
+
+  def test_Digest(self):
+    m = Menu("MenuTests/test_Digest.json")
+    m.add(Pastry(name="foo", version="0.1.0", digest="ab12"))
+    m.add(Pastry(name="foo", version="0.2.0"))
+    m.compact()
+    m2 = Menu(m.filePath)
+    m2.load()
+    self.assertIsNotNone(m2._snapshot)
+    self.assertEqual(m2.get("foo", "0.1.0").digest, "ab12")
+    self.assertIsNone(m2.get("foo", "0.2.0").digest)
+    self.assertEqual(dict(m2.get("foo", "0.2.0")), {"name": "foo", "version": "0.2.0"})
+
+  def test_Refresh(self):
+    m1 = Menu("MenuTests/test_Refresh.json")
+    m1.load()
+    m2 = Menu(m1.filePath)
+    m2.load()
+    self.assertFalse(m2.refresh())
+    m1.add(Pastry(name="foo", version="0.1.0"))
+    m1.save()
+    self.assertFalse(m1.refresh())
+    # Unsaved changes are kept.
+    m2.add(Pastry(name="bar", version="0.1.0"))
+    self.assertTrue(m2.refresh())
+    self.assertEqual(len(m2), 2)
+    m2.save()
+    self.assertTrue(m1.refresh())
+    self.assertIsNotNone(m1.get("bar", "0.1.0"))
+    m1.compact()
+    self.assertTrue(m2.refresh())
+    self.assertEqual(len(m2), 2)
+
+  def test_Generation(self):
+    m1 = Menu("MenuTests/test_Generation.json")
+    generations = [m1.generation]
+    p1 = Pastry(name="foo", version="0.1.0")
+    m1.add(p1)
+    generations.append(m1.generation)
+    m1.add(Pastry(name="foo", version="0.1.0"))
+    self.assertEqual(m1.generation, generations[-1])
+    m1.save()
+    self.assertEqual(m1.generation, generations[-1])
+    m2 = Menu(m1.filePath)
+    m2.load()
+    m2.add(Pastry(name="bar", version="0.1.0"))
+    m2.save()
+    self.assertTrue(m1.refresh())
+    generations.append(m1.generation)
+    m1.remove(p1)
+    generations.append(m1.generation)
+    m1.clear()
+    generations.append(m1.generation)
+    self.assertEqual(len(set(generations)), len(generations))
+
+  def test_SnapshotRegeneration(self):
+    m = Menu("MenuTests/test_SnapshotRegeneration.json")
+    m.add(Pastry(name="foo", version="0.1.0"))
+    m.compact()
+    # Change the menu file behind the snapshot's back.
+    with m.filePath.open("w") as menuFile:
+      json.dump([{"name": "bar", "version": "1.0.0"}, {"name": "baz", "version": "1.0.0"}], menuFile)
+    m2 = Menu(m.filePath)
+    m2.load()
+    self.assertIsNone(m2._snapshot)
+    self.assertIsNone(m2.get("foo", "0.1.0"))
+    self.assertTrue(m2.get("bar", "1.0.0"))
+    m3 = Menu(m.filePath)
+    m3.load()
+    self.assertIsNotNone(m3._snapshot)
+    self.assertEqual(len(m3), 2)
+    self.assertTrue(m3.get("baz", "1.0.0"))
+
+  def test_SnapshotSameSizeRewrite(self):
+    m = Menu("MenuTests/test_SnapshotSameSizeRewrite.json")
+    m.add(Pastry(name="foo", version="0.1.0"))
+    m.compact()
+    stat = os.stat(m.filePath.as_posix())
+    # Same size and timestamp, different contents.
+    m.filePath.write_text(m.filePath.read_text().replace("foo", "bar"))
+    os.utime(m.filePath.as_posix(), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    m2 = Menu(m.filePath)
+    m2.load()
+    self.assertIsNone(m2._snapshot)
+    self.assertIsNone(m2.get("foo", "0.1.0"))
+    self.assertTrue(m2.get("bar", "0.1.0"))
+
+  def test_ConcurrentSave(self):
+    m1 = Menu("MenuTests/test_ConcurrentSave.json")
+    m1.add(Pastry(name="foo", version="0.1.0"))
+    m1.compact()
+    m2 = Menu(m1.filePath)
+    m2.load()
+    m1.add(Pastry(name="bar", version="1.0.0"))
+    m1.remove(Pastry(name="foo", version="0.1.0"))
+    m1.save()
+    m2.add(Pastry(name="baz", version="2.0.0"))
+    # Compacting merges the changes of m1 instead of overwriting them.
+    m2.compact()
+    self.assertEqual([str(p) for p in m2], ["bar 1.0.0", "baz 2.0.0"])
+    m3 = Menu(m1.filePath)
+    m3.load()
+    self.assertEqual(m3.registry, m2.registry)
+    self.assertFalse(list(m1.pastryDirPath.glob("*.tmp")))
@@ -0,0 +1,38 @@
+from tests import *
+from PyBake.metrics import MetricsRegistry
+
+
+class MetricsTests(TestCase):
+  def test_Render(self):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Number of requests.", labels=("endpoint",))
+    inFlight = registry.gauge("in_flight", "Requests in flight.")
+    registry.gauge("size", "Size.", collect=lambda: 42)
+    duration = registry.histogram("duration_seconds", "Duration.", buckets=(0.1, 1))
+    requests.inc(endpoint="get_pastry")
+    requests.inc(2, endpoint='a "b"')
+    inFlight.inc()
+    inFlight.dec()
+    for value in (0.05, 0.1, 0.5, 5):
+      duration.observe(value)
+    with self.assertRaises(ValueError):
+      requests.inc()
+    self.assertEqual(registry.render(), "\n".join([
+      "# HELP requests_total Number of requests.",
+      "# TYPE requests_total counter",
+      'requests_total{endpoint="a \\"b\\""} 2',
+      'requests_total{endpoint="get_pastry"} 1',
+      "# HELP in_flight Requests in flight.",
+      "# TYPE in_flight gauge",
+      "in_flight 0",
+      "# HELP size Size.",
+      "# TYPE size gauge",
+      "size 42",
+      "# HELP duration_seconds Duration.",
+      "# TYPE duration_seconds histogram",
+      'duration_seconds_bucket{le="0.1"} 2',
+      'duration_seconds_bucket{le="1"} 3',
+      'duration_seconds_bucket{le="+Inf"} 4',
+      "duration_seconds_sum 5.65",
+      "duration_seconds_count 4",
+    ]) + "\n")
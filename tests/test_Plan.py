@@ -0,0 +1,32 @@
+from tests import *
+from PyBake.oven import Pot, planPastries
+import zipfile
+
+
+class PlanTests(TestCase):
+  def test_Plan(self):
+    Path("src").safe_mkdir()
+    Path("src/a.txt").write_text("a" * 10000)
+    Path("src/b.txt").write_text("b" * 5000)
+    pot = Pot()
+    foo = pot.get("foo", "0.1.0")
+    foo.addIngredients(["src/a.txt", "src/b.txt", "src/missing.txt"])
+    pot.get("bar", "0.1.0").addIngredient("src/b.txt")
+    plan = planPastries(pot.pastries, compression=zipfile.ZIP_DEFLATED)
+    fooPlan, barPlan = plan["pastries"]
+    self.assertEqual((fooPlan["name"], fooPlan["files"], fooPlan["rawSize"]), ("foo", 2, 15000))
+    self.assertEqual(fooPlan["missing"], ["src/missing.txt"])
+    self.assertEqual(fooPlan["duplicates"], ["src/b.txt"])
+    self.assertEqual(barPlan["duplicates"], ["src/b.txt"])
+    # Repeated characters compress very well.
+    self.assertLess(fooPlan["estimatedSize"], 1000)
+    self.assertEqual(plan["total"]["rawSize"], 20000)
+    self.assertEqual(plan["total"]["uniqueFiles"], 3)
+    stored = planPastries(pot.pastries, compression=zipfile.ZIP_STORED)
+    self.assertEqual(stored["pastries"][0]["estimatedSize"], 15000)
+
+  def test_FormatSize(self):
+    self.assertEqual(formatSize(10), "10 B")
+    self.assertEqual(formatSize(1536), "1.5 KiB")
+    self.assertEqual(formatSize(3 * 1024 ** 3), "3.0 GiB")
+    self.assertEqual(formatSize(2 * 1024 ** 4), "2.0 TiB")
@@ -0,0 +1,77 @@
+from tests import *
+from PyBake.oven import Pot, bakePastry
+import time
+import zipfile
+
+
+class PotTests(TestCase):
+  def test_Get(self):
+    pot = Pot()
+    p1 = pot.get("foo", "0.1.0")
+    self.assertIs(pot.get("foo", Version("0.1.0")), p1)
+    self.assertIsNot(pot.get("foo", "0.2.0"), p1)
+    self.assertEqual(len(pot.pastries), 2)
+
+  def test_RunRecipesConcurrently(self):
+    def slow(pot):
+      time.sleep(0.05)
+      pot.get("slow", "0.1.0").addIngredient("a")
+      pot.get("shared", "0.1.0").addIngredient("b")
+
+    def fast(pot):
+      pot.get("shared", "0.1.0").addIngredient("c")
+      pot.get("fast", "0.1.0").addDependency("slow", "0.1.0")
+
+    serialPot = Pot()
+    serialPot.runRecipes([slow, fast])
+    concurrentPot = Pot()
+    concurrentPot.runRecipes([slow, fast], jobs=2)
+    self.assertEqual([str(p) for p in concurrentPot.pastries], [str(p) for p in serialPot.pastries])
+    self.assertEqual([str(p) for p in concurrentPot.pastries], ["slow 0.1.0", "shared 0.1.0", "fast 0.1.0"])
+    self.assertEqual(concurrentPot.get("shared", "0.1.0").ingredients, {Path("b"), Path("c")})
+
+  def test_IngredientOrder(self):
+    Path("src").safe_mkdir()
+    for name in ("a", "b", "c", "d"):
+      Path("src", name).write_text(name)
+
+    def slow(pot):
+      time.sleep(0.05)
+      pot.get("shared", "0.1.0").addIngredients(["src/b", "src/a"])
+
+    def fast(pot):
+      pot.get("shared", "0.1.0").addIngredient("src/c")
+      pot.get("shared", "0.1.0").addIngredients(["src/a", "src/d"])
+
+    Path("PotTests").safe_mkdir()
+    archives = []
+    for jobs in (1, 2):
+      pot = Pot()
+      pot.runRecipes([slow, fast], jobs=jobs)
+      shared = pot.get("shared", "0.1.0")
+      self.assertEqual(list(shared.ingredients.paths()), ["src/b", "src/a", "src/c", "src/d"])
+      zipFilePath = Path("PotTests/shared-{}.zip".format(jobs))
+      bakePastry(zipFilePath, shared, zipfile.ZIP_DEFLATED)
+      with zipfile.ZipFile(zipFilePath.as_posix()) as zipFile:
+        archives.append([(info.filename, info.CRC) for info in zipFile.infolist()])
+    self.assertEqual(archives[0], archives[1])
+
+  def test_RecipeErrorsPropagate(self):
+    def broken(pot):
+      raise RuntimeError("broken recipe")
+    with self.assertRaises(RuntimeError):
+      Pot().runRecipes([broken], jobs=2)
+
+  def test_Ingredients(self):
+    pot = Pot()
+    p1 = pot.get("foo", "0.1.0")
+    p2 = pot.get("bar", "0.1.0")
+    p1.addIngredient(Path("dir/a.h"))
+    p1.addIngredients(["./dir/a.h", "dir//b.h", "dir/c.h"])
+    p2.addIngredients(iter(["dir/c.h"]))
+    self.assertEqual(len(p1.ingredients), 3)
+    self.assertEqual(list(p1.ingredients.paths()), ["dir/a.h", "dir/b.h", "dir/c.h"])
+    self.assertIn(Path("dir/b.h"), p1.ingredients)
+    self.assertEqual(p1.ingredients, {Path("dir/a.h"), Path("dir/b.h"), Path("dir/c.h")})
+    # Identical paths share the same string.
+    self.assertIs(list(p1.ingredients.paths())[2], list(p2.ingredients.paths())[0])
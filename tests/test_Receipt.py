@@ -0,0 +1,79 @@
+from tests import *
+from PyBake.basket import Receipt, ReceiptsDatabase, SQLiteReceipt, getReceipt
+
+
+class SQLiteReceiptTests(TestCase):
+  def test_AddRemove(self):
+    db = ReceiptsDatabase("ReceiptTests/receipts.sqlite")
+    r = getReceipt("project/shoppingList.py", database=db)
+    self.assertIsInstance(r, SQLiteReceipt)
+    p1 = Pastry(name="foo", version="0.1.0")
+    p2 = Pastry(name="bar", version="1.0.0")
+    r.add(p1)
+    r.add(p2)
+    r.save()
+    r.remove(p1)
+    r.save()
+    r2 = getReceipt("project/shoppingList.py", database=db)
+    r2.load()
+    self.assertEqual(r2.registry, [p2])
+    self.assertEqual(db.installations("bar"), [(r.key, "1.0.0")])
+    db.close()
+
+  def test_ConcurrentWriters(self):
+    db1 = ReceiptsDatabase("ReceiptTests/receipts.sqlite")
+    db2 = ReceiptsDatabase("ReceiptTests/receipts.sqlite")
+    r1 = getReceipt("project/shoppingList.py", database=db1)
+    r2 = getReceipt("project/shoppingList.py", database=db2)
+    r1.load()
+    r2.load()
+    r1.add(Pastry(name="foo", version="0.1.0"))
+    r2.add(Pastry(name="bar", version="1.0.0"))
+    r1.save()
+    r2.save()
+    r3 = getReceipt("project/shoppingList.py", database=db1)
+    r3.load()
+    self.assertEqual(len(r3), 2)
+    db1.close()
+    db2.close()
+
+  def test_NoMenuFiles(self):
+    db = ReceiptsDatabase("ReceiptTests/receipts.sqlite")
+    r1 = getReceipt("project/shoppingList.py", database=db)
+    r2 = getReceipt("project/shoppingList.py", database=db)
+    r1.add(Pastry(name="foo", version="0.1.0"))
+    r1.save()
+    r1.compact()
+    self.assertTrue(r2.refresh())
+    self.assertEqual(r2.registry, [Pastry(name="foo", version="0.1.0")])
+    r2.add(Pastry(name="bar", version="1.0.0"))
+    # Unsaved changes are kept.
+    self.assertFalse(r2.refresh())
+    db.close()
+    # Only the database and its SQLite files exist.
+    self.assertEqual([p.name for p in Path("ReceiptTests").iterdir() if not p.name.startswith("receipts.sqlite")], [])
+
+  def test_Migrate(self):
+    receiptsDirPath = Path("ReceiptTests/receipts")
+    receipt = Receipt(key="some/project", dirPath=receiptsDirPath)
+    receipt.add(Pastry(name="foo", version="0.1.0"))
+    receipt.add(Pastry(name="bar", version="1.0.0"))
+    receipt.compact()
+    receipt.remove(Pastry(name="bar", version="1.0.0"))
+    receipt.add(Pastry(name="baz", version="2.0.0"))
+    receipt.save()
+    for suffix in (".lock", ".snapshot"):
+      for path in receiptsDirPath.glob("*" + suffix):
+        path.unlink()
+    legacyFiles = sorted(path.name for path in receiptsDirPath.iterdir())
+    receiptsDBPath = Path("ReceiptTests/receipts.json")
+    with receiptsDBPath.open("w") as receiptsDBFile:
+      json.dump({receipt.key: receipt.hash}, receiptsDBFile)
+    db = ReceiptsDatabase("ReceiptTests/receipts.sqlite")
+    self.assertEqual(db.migrate(receiptsDBPath, receiptsDirPath), 1)
+    migrated = SQLiteReceipt(key=receipt.key, database=db)
+    migrated.load()
+    self.assertEqual(migrated.registry, receipt.registry)
+    # Migrating does not leave lock or snapshot files next to the legacy receipts.
+    self.assertEqual(sorted(path.name for path in receiptsDirPath.iterdir()), legacyFiles)
+    db.close()
@@ -0,0 +1,48 @@
+from tests import *
+from PyBake.scanner import Scanner
+
+
+class ScannerTests(TestCase):
+  def setUp(self):
+    super().setUp()
+    for filePath in ("tree/a.h", "tree/b.cpp", "tree/sub/c.h", "tree/sub/deep/d.h", "tree/other/e.h"):
+      Path(filePath).parent.safe_mkdir(parents=True)
+      Path(filePath).write_text("")
+
+  def test_Glob(self):
+    s = Scanner()
+    self.assertEqual(s.glob("tree", "*.h"), ["tree/a.h"])
+    self.assertEqual(s.glob("tree", "*", files=False), ["tree/other", "tree/sub"])
+    self.assertEqual(s.glob("tree", "sub/*.h"), ["tree/sub/c.h"])
+    self.assertEqual(sorted(s.rglob("tree", "*.h")), sorted(p.as_posix() for p in Path("tree").rglob("*.h")))
+    self.assertEqual(s.rglob(".", "d.h"), ["tree/sub/deep/d.h"])
+    self.assertTrue(s.isDir("tree/sub"))
+    self.assertFalse(s.isDir("tree/a.h"))
+    numListed = s.numListed
+    # Everything is cached already.
+    s.rglob("tree", "*.cpp")
+    self.assertEqual(s.numListed, numListed)
+
+  def test_SymlinkedDirs(self):
+    os.symlink(os.path.abspath("tree/sub"), "tree/link")
+    s = Scanner()
+    # Symlinked directories are directories, ...
+    self.assertEqual(s.glob("tree", "*", files=False), sorted(p.as_posix() for p in Path("tree").glob("*") if p.is_dir()))
+    self.assertEqual(s.glob("tree", "*", dirs=False), ["tree/a.h", "tree/b.cpp"])
+    self.assertEqual(s.glob("tree", "link/*.h"), ["tree/link/c.h"])
+    self.assertTrue(s.isDir("tree/link"))
+    # ... but "**" does not recurse into them.
+    self.assertEqual(sorted(s.rglob("tree", "*.h")), sorted(p.as_posix() for p in Path("tree").rglob("*.h")))
+    self.assertNotIn("tree/link/c.h", s.rglob("tree", "*.h"))
+
+  def test_PersistedIndex(self):
+    s = Scanner("scanner.json")
+    s.rglob("tree", "*.h")
+    s.saveIndex()
+    self.assertEqual(s.numListed, 4)
+    Path("tree/sub/new.h").write_text("")
+    s2 = Scanner("scanner.json")
+    self.assertIn("tree/sub/new.h", s2.rglob("tree", "*.h"))
+    # Only the changed directory is listed again.
+    self.assertEqual(s2.numListed, 1)
+    self.assertEqual(s2.numReused, 3)
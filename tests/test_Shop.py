@@ -0,0 +1,241 @@
+from tests import *
+from PyBake.shop import Shop, PooledWSGIServer
+from PyBake.archive import archiveDigest
+from PyBake.metadata import MetadataIndex
+from PyBake.oven import Pastry as OvenPastry, bakePastry
+import requests
+import socket
+import threading
+import time
+import zipfile
+
+
+class ShopTests(TestCase):
+  def bake(self, name, version):
+    Path("src").safe_mkdir()
+    Path("src/a.h").write_text("a")
+    pastry = OvenPastry(name=name, version=version)
+    pastry.addIngredient("src/a.h")
+    bakePastry("upload.zip", pastry, zipfile.ZIP_DEFLATED)
+    return Path("upload.zip")
+
+  def upload(self, client, name, version):
+    pastryPath = self.bake(name, version)
+    with pastryPath.open("rb") as pastryFile:
+      return client.post("/upload_pastry", data={"name": name, "version": version, "pastry": (pastryFile, "foo.zip")})
+
+  def test_UploadInvalidatesOtherWorkers(self):
+    Path("shop").safe_mkdir()
+    # Two workers with their own menu, sharing the menu files.
+    worker1 = Shop(menu=Menu("shop")).test_client()
+    worker2 = Shop(menu=Menu("shop")).test_client()
+    self.assertEqual(worker2.post("/get_pastry", data={"name": "foo", "version": "0.1.0"}).status_code, 400)
+    self.assertEqual(self.upload(worker1, "foo", "0.1.0").status_code, 200)
+    response = worker2.post("/get_pastry", data={"name": "foo", "version": "0.1.0"})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.headers["X-Pastry-Version"], "0.1.0")
+    response.close()
+
+  def test_UploadFormValues(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    client = Shop(menu=menu).test_client()
+
+    def upload(content, force):
+      Path("src").safe_mkdir()
+      Path("src/a.h").write_text(content)
+      pastry = OvenPastry(name="foobar", version="0.1.0")
+      pastry.addIngredient("src/a.h")
+      bakePastry("upload.zip", pastry, zipfile.ZIP_DEFLATED)
+      with open("upload.zip", "rb") as pastryFile:
+        data = {"name": "foobar", "version": "0.1.0", "force": force, "pastry": (pastryFile, "foo.zip")}
+        self.assertEqual(client.post("/upload_pastry", data=data).status_code, 200)
+      return archiveDigest("upload.zip")
+
+    # Whole form values are used, not just their first character.
+    first = upload("a", "False")
+    self.assertEqual(menu.get("foobar", "0.1.0").digest, first)
+    # "False" is not a forced upload, although it is a non-empty string.
+    upload("b", "False")
+    self.assertEqual(menu.get("foobar", "0.1.0").digest, first)
+    forced = upload("c", "True")
+    self.assertNotEqual(forced, first)
+    self.assertEqual(menu.get("foobar", "0.1.0").digest, forced)
+
+  def test_PooledServer(self):
+    Path("shop").safe_mkdir()
+    server = PooledWSGIServer("127.0.0.1", 0, Shop(menu=Menu("shop")), threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+      url = "http://127.0.0.1:{}/get_pastry".format(server.server_port)
+      with requests.Session() as session:
+        for _ in range(3):
+          self.assertEqual(session.post(url, data={"name": "foo", "version": "0.1.0"}).status_code, 400)
+    finally:
+      server.shutdown()
+      thread.join()
+
+  def test_CloseIdleConnections(self):
+    Path("shop").safe_mkdir()
+    server = PooledWSGIServer("127.0.0.1", 0, Shop(menu=Menu("shop")), threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    # A client that connects, but does not send its request (yet), like an idle keep-alive connection.
+    with socket.create_connection(("127.0.0.1", server.server_port)):
+      while not server.idleConnections:
+        time.sleep(0.01)
+      start = time.perf_counter()
+      server.shutdown()
+      thread.join()
+      server.server_close()
+      self.assertLess(time.perf_counter() - start, 5)
+
+  def test_UploadIsSpooledAndChecked(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    client = Shop(menu=menu).test_client()
+    pastryPath = self.bake("foo", "0.1.0")
+    # The pastry.json of the archive does not match the uploaded pastry.
+    with pastryPath.open("rb") as pastryFile:
+      response = client.post("/upload_pastry", data={"name": "foo", "version": "0.2.0", "pastry": (pastryFile, "foo.zip")})
+    self.assertEqual(response.status_code, 400)
+    self.assertIn("do not match", response.get_json()["errors"][0])
+    self.assertIsNone(menu.get("foo", "0.2.0"))
+    self.assertEqual([p.name for p in Path("shop").iterdir() if not p.name.startswith("menu.")], [])
+
+    self.assertEqual(self.upload(client, "foo", "0.1.0").status_code, 200)
+    pastry = menu.get("foo", "0.1.0")
+    self.assertEqual(pastry.digest, archiveDigest(pastryPath))
+    self.assertEqual(archiveDigest(menu.makePath(pastry)), pastry.digest)
+    # No spooled uploads are left behind.
+    self.assertEqual([p.name for p in Path("shop").iterdir() if p.name.startswith(".upload-")], [])
+    # Published pastries get the same permissions as other files, not those of a temporary file.
+    Path("umask.txt").write_text("")
+    self.assertEqual(os.stat(menu.makePath(pastry).as_posix()).st_mode & 0o777,
+                     os.stat("umask.txt").st_mode & 0o777)
+
+  def test_Metadata(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    client = Shop(menu=menu).test_client()
+    self.assertEqual(self.upload(client, "foo", "0.1.0").status_code, 200)
+    digest = menu.get("foo", "0.1.0").digest
+    self.assertTrue(MetadataIndex(menu.pastryDirPath / "metadata").has(digest))
+
+    response = client.get("/pastry/foo/0.1.0/metadata")
+    self.assertEqual(response.status_code, 200)
+    metadata = response.get_json()
+    self.assertEqual(metadata["pastry"]["name"], "foo")
+    self.assertEqual(metadata["digest"], digest)
+    self.assertEqual(metadata["size"], menu.makePath(menu.get("foo", "0.1.0")).stat().st_size)
+    self.assertEqual((metadata["files"], metadata["filesSize"]), (1, 1))
+    self.assertEqual(client.get("/pastry/foo/0.1.0/files").get_json()["files"], [{"path": "src/a.h", "size": 1}])
+    self.assertEqual(client.get("/pastry/foo/0.1.0/dependencies").get_json()["dependencies"], [])
+    response = client.get("/pastry/foo/0.1.0/dependencies", headers={"If-None-Match": '"{}"'.format(digest)})
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(client.get("/pastry/foo/0.2.0/files").status_code, 404)
+
+  def test_MetadataOfPastryAddedWithoutUpload(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    pastry = OvenPastry(name="bar", version="1.0.0")
+    pastry.addDependency("foo", ">=0.1.0")
+    bakePastry(menu.makePath(pastry), pastry, zipfile.ZIP_DEFLATED)
+    menu.add(Pastry(name="bar", version="1.0.0"))
+    response = Shop(menu=menu).test_client().get("/pastry/bar/1.0.0/dependencies")
+    self.assertEqual(response.get_json()["dependencies"], [{"name": "foo", "version": ">=0.1.0"}])
+
+  def test_MissingFileOfPastryAddedWithoutUpload(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    menu.add(Pastry(name="foo", version="0.1.0"))
+    self.assertFalse(menu.makePath(menu.get("foo", "0.1.0")).exists())
+    client = Shop(menu=menu).test_client()
+    self.assertEqual(client.post("/get_pastry", data={"name": "foo", "version": "0.1.0"}).status_code, 400)
+    self.assertEqual(client.get("/pastry/foo/0.1.0").status_code, 404)
+    self.assertEqual(client.get("/pastry/foo/0.1.0/metadata").status_code, 404)
+    response = client.post("/resolve", json={"pastries": [{"name": "foo", "version": "0.1.0"}]})
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.get_json()["errors"], ["Pastry file is missing: foo 0.1.0"])
+
+  def test_MetadataOfInvalidPastry(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    pastry = Pastry(name="bar", version="1.0.0")
+    with zipfile.ZipFile(menu.makePath(pastry).as_posix(), "w") as zipFile:
+      zipFile.writestr("src/a.h", "a")
+    menu.add(pastry)
+    response = Shop(menu=menu).test_client().get("/pastry/bar/1.0.0/metadata")
+    self.assertEqual(response.status_code, 422)
+    self.assertIn("pastry.json", response.get_json()["errors"][0])
+
+  def test_ForcedUploadPrunesMetadata(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    client = Shop(menu=menu).test_client()
+    self.assertEqual(self.upload(client, "foo", "0.1.0").status_code, 200)
+    oldDigest = menu.get("foo", "0.1.0").digest
+    Path("src/a.h").write_text("changed")
+    pastry = OvenPastry(name="foo", version="0.1.0")
+    pastry.addIngredient("src/a.h")
+    bakePastry("upload.zip", pastry, zipfile.ZIP_DEFLATED)
+    with open("upload.zip", "rb") as pastryFile:
+      response = client.post("/upload_pastry", data={"name": "foo", "version": "0.1.0", "force": "True",
+                                                     "pastry": (pastryFile, "foo.zip")})
+    self.assertEqual(response.status_code, 200)
+    newDigest = menu.get("foo", "0.1.0").digest
+    self.assertNotEqual(newDigest, oldDigest)
+    index = MetadataIndex(menu.pastryDirPath / "metadata")
+    self.assertFalse(index.has(oldDigest))
+    self.assertTrue(index.has(newDigest))
+    self.assertFalse(index.remove(oldDigest))
+
+  def test_Metrics(self):
+    Path("shop").safe_mkdir()
+    client = Shop(menu=Menu("shop")).test_client()
+    with self.upload(client, "foo", "0.1.0") as response:
+      self.assertEqual(response.status_code, 200)
+    for _ in range(3):
+      client.post("/get_pastry", data={"name": "foo", "version": "0.1.0"}).close()
+    response = client.get("/metrics")
+    self.assertTrue(response.content_type.startswith("text/plain"))
+    lines = response.get_data(as_text=True).splitlines()
+    self.assertIn('pybake_shop_requests_total{endpoint="get_pastry",status="200"} 3', lines)
+    self.assertIn('pybake_shop_request_duration_seconds_count{endpoint="upload_pastry"} 1', lines)
+    self.assertIn('pybake_shop_upload_seconds_count{phase="receive"} 1', lines)
+    self.assertIn('pybake_shop_requests_in_flight{endpoint="metrics_text"} 1', lines)
+    self.assertIn("pybake_shop_pastry_cache_lookups_total 3", lines)
+    self.assertIn("pybake_shop_pastry_cache_misses_total 1", lines)
+    self.assertIn("pybake_shop_menu_pastries 1", lines)
+
+  def test_MetricsOfStreamedResponse(self):
+    Path("shop").safe_mkdir()
+    menu = Menu("shop")
+    Path("src").safe_mkdir()
+    # Too large to fit into the socket buffers, so sending it blocks until the client reads it.
+    Path("src/a.bin").write_bytes(os.urandom(32 * 1024 * 1024))
+    pastry = OvenPastry(name="foo", version="0.1.0")
+    pastry.addIngredient("src/a.bin")
+    bakePastry(menu.makePath(pastry), pastry, zipfile.ZIP_STORED)
+    menu.add(Pastry(name="foo", version="0.1.0"))
+    server = PooledWSGIServer("127.0.0.1", 0, Shop(menu=menu), threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+    inFlight = 'pybake_shop_requests_in_flight{endpoint="get_pastry"} '
+    try:
+      with requests.post(url + "/get_pastry", data={"name": "foo", "version": "0.1.0"}, stream=True) as response:
+        self.assertEqual(response.status_code, 200)
+        time.sleep(0.1)
+        # The body was not read yet, so the request is still being handled.
+        self.assertIn(inFlight + "1", requests.get(url + "/metrics").text.splitlines())
+        self.assertEqual(len(response.content), menu.makePath(pastry).stat().st_size)
+      deadline = time.perf_counter() + 5
+      while inFlight + "0" not in requests.get(url + "/metrics").text.splitlines():
+        self.assertLess(time.perf_counter(), deadline)
+        time.sleep(0.01)
+    finally:
+      server.shutdown()
+      thread.join()
+      server.server_close()
@@ -9,3 +9,18 @@ class TestVersion(TestCase):
     s = VersionSpec(">0.1.0")
     self.assertIs(s, VersionSpec(s))
     self.assertEqual(str(VersionSpec(Version("0.1.0"))), "==0.1.0")
+
+  def test_ParseCache(self):
+    clearParseCache()
+    v = Version("0.1.0")
+    self.assertIs(Version("0.1.0"), v)
+    s = VersionSpec(">=0.1.0")
+    self.assertIs(VersionSpec(">=0.1.0"), s)
+    self.assertIs(VersionSpec(v), VersionSpec("==0.1.0"))
+    info = parseCacheInfo()
+    self.assertEqual(info["Version"]["hits"], 1)
+    self.assertEqual(info["Version"]["misses"], 1)
+    self.assertEqual(info["VersionSpec"]["hits"], 2)
+    self.assertEqual(info["VersionSpec"]["misses"], 2)
+    clearParseCache()
+    self.assertEqual(parseCacheInfo()["Version"]["size"], 0)